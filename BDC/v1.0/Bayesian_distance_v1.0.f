@@ -187,6 +187,10 @@ c     =============================================================
 c               Read in target sources for distance PDF...
 
       sources_file = 'sources_info.inp'    ! containing source information
+c     A different sources file can be given as first command line argument,
+c     so that one compiled executable can be reused for any list of sources
+      if ( command_argument_count() .ge. 1 )
+     +   call get_command_argument ( 1, sources_file )
 c     Open file and count number of sources
       call open_ascii_file ( lu_sources, sources_file, lu_print )
 
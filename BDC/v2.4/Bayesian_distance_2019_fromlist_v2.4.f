@@ -50,6 +50,7 @@ c     Output files:
 c        summary.prt                            ! one line summary per source
 
 c        Following are not made unless "lu_out = 7" specified below
+c        (i.e. only for output level 2, see below)
 c        sourcename.prt                         ! summary print out for one source
 c        sourcename_final_distance_pdf.dat      ! full distance pdf values
 c        sourcename_arm_latitude_pdf.dat        ! spiral-arm * latitude pdf
@@ -67,61 +68,34 @@ c            component with the greatest integrated probability
 
       implicit real*8 (a-h,o-z)
 
-      character*48  control_file,sources_file,srcprt_file,summary_file
-      character*48  data_file, out_file
-      character*32  citation(1000), cite, pdf_name
-      character*14  src, ref_src(1000), stripped_src
-      character*12  near_far, ref, ref_arm(1000)
-      character*13  Gname
-      character*1   asign, bsign, M, arm, s1, nf, c1
-
-      real*8        ref_ell(1000), ref_bee(1000)
-      real*8        ref_vlsr(1000), ref_vunc(1000)
-      real*8        ref_par(1000), ref_punc(1000)
-
-      real*8        dist_prior(1001), prob_dist(1001)
-      real*8        par_bins(1001), dist_bins(1001)
-      real*8        prob_arm(1001), prob_lat(1001), prob_armlat(1001)
-      real*8        prob_Dpm_ell(1001),prob_Dpm_bee(1001),prob_Dk(1001)
-      real*8        prob_MWmodel(1001)
+      character*48  sources_file,srcprt_file,summary_file,level_arg
+      character*14  src, stripped_src
+      character*12  res_arm(2), a_name
+      character*2   res_q(2)
+      character*1   s1
+      character*256 line
 
-      real*8        peaks(25), peaks_low(25), peaks_high(25)
-      real*8        peak_prob(25), peaks_width(25), prob_int(25)
-      real*8        peak_dist(25), peak_dunc(25), peak_int(25)
+      real*8        Dk_kd(2), res_dist(2), res_dunc(2), res_int(2)
+      real*8        pdfs(1001,6)
 
-      logical       use_peak(25)
+      logical       daemon
 
-      real*8        params(77), new_params(77), param_sigmas(77)
-      character*16  parnames(77)
-      integer       paramids(77)
-
-c     Arm information arrays
-      real*8        arm_probabilities(29)
+c     Spiral arm names (see load_bdc_model)
+      character*12  arm_name(29)
+      common /bdc_arm_names/ arm_name
+      integer       iarm_entries(29)
       real*8        arm_ell(29,300), arm_bee(29,300), arm_vel(29,300)
       real*8        arm_Rgc(29,300), arm_beta(29,300), arm_dist(29,300)
       real*8        seg_ell_min(29,2), seg_ell_max(29,2)
-      real*8        d_store(29), b_store(29)
-      integer       iarm_entries(29)
-      character*12  a_store(29)
-
-      character*48  arm_file, galaxy_file
+      common /bdc_arms/ arm_ell, arm_bee, arm_vel, arm_Rgc, arm_beta,
+     +                  arm_dist, seg_ell_min, seg_ell_max,
+     +                  iarm_entries, num_arms
 
-      character*12  arm_assigned, arm_indicated, unknown, p2_arm
-      character*12  a_name, arm_name(29), arm_max, arm_max_bin(1001)
+c     Directory of the input files (blank: current working directory)
+      character*256 data_dir
+      common /bdc_data_dir/ data_dir
 
-      character*20  extra_info
-      character*2   questionable, q2
-
-      logical       writeout, found_arm, accept, odd_source
-
-c     Set some maximum dimension values, switches, and logical unit numbers...
-      max_num_parallaxes = 1000  ! max number of parallaxes entered
-      max_num_lbvs   = 300       ! max number of (l,b,v,R,beta,D) values to define an arm segment
-      max_num_params = 77        ! max number of Gaussian fit parameters used for final PDF
-      max_num_peaks  = 25        ! max number of peaks in final PDF
-c     max_num_arms   = 29        ! max number of arm segments (hardwired in subroutine)
-
-      lu_noprint   =-1
+c     Set logical unit numbers...
       lu_print     = 6
 
       lu_out       = 7           ! Make multiple PDF files for each source
@@ -133,45 +107,24 @@ c     lu_out       =-1           ! Don't make multiple PDF files for each source
       lu_srcprt    =12
       lu_summary   =99
 
-      pi = 4.d0 * atan(1.d0)
-      twopi = 2.d0 * pi
-      factor = (1.d0/twopi)**1.5d0
-      deg_to_rad = pi/180.d0
-      hr_to_rad  = pi/12.d0
+c     Output level (optional second command line argument):
+c        0 = one line summary per source only
+c        1 = summary and kinematic distance(s) in the summary file
+c        2 = summary, print out and PDF files for each source (default)
+      level_out = 2
+      if ( command_argument_count() .ge. 2 ) then
+         call get_command_argument ( 2, level_arg )
+         read (level_arg,*) level_out
+      endif
+      if ( level_out .lt. 2 ) then
+         lu_out    = -1
+         lu_srcprt = -1
+      endif
 
 cc      write (lu_print,1000)
  1000 format(' Bayesian distance estimator: 2019: September 24, 2019')
 
-c     =============================================================
-c     Important numerical parameters
-      num_bins = 1001         ! Dimension limit for par_prob array
-      bin_size = 0.025d0      ! kpc
-
-c     To calculate prob of being in an arm based on (l,b,v)-traces,
-c     add Virial velocity uncertainty to other uncertainties (measured, peculiar)
-      sig_vel     = 5.d0      ! km/s
-
-c     Maximum difference in longitude to bother calculating arm prob
-      ell_dif_max = 5.d0      ! deg
-
-c     To calculate probability based on arm width vs Radius
-c     Arm width formula  W = 0.17 + (R_kpc-3.5)*0.036 kpc for R>3.5kpc
-c     (which comes from W = 0.336 + (R_kpc-8.15)*0.036; see Fig. 2 of Reid+2019)
-      width_min  = 0.17d0     ! kpc  (Gaussian sigma)
-      width_Rref = 3.5d0      ! kpc
-      width_slope= 0.036d0    ! kpc/kpc
-
-c     To calculate prob of being off the (warped) plane
-c     Arm z-width formula  W_z = 0.03 + (R-7.0)*0.036 kpc for R>7kpc
-      sigz    = 0.03d0               ! kpc      (1-sig z-height for Rgc<Rsigz)
-      Rsigz   = 7.0d0                ! kpc
-      sigzdot = 0.036d0              ! kpc/kpc  (slope of z-height with Rgc)
-
-c     To calcuate prob of matching a source with one with measured parallax
-      sig_GMC = 0.05d0        ! kpc (1-sig radius difference for sources in a GMC)
-
-c     Smooth prob(d) based on arm assignment (which is "lumpy")
-      smooth_kpc = 0.5d0      ! kpc (smooth dist_prob over this length)
+      data_dir = ' '
 
 c     =============================================================
 c               Read in 4 logical program controls...
@@ -180,53 +133,68 @@ c               Read in 4 logical program controls...
      +                    P_max_PM )
 
 c     =============================================================
-c               Read in Galactic/Solar parameters...
-      galaxy_file = 'galaxy_data_Univ.inp'
-      call galaxy_parameters_Univ( lu_data, galaxy_file, lu_print,
-     +           Ro, a1, a2, a3, Uo, Vo, Wo, Us, Vs, Ws,
-     +           glong_min, glong_max )
-
-c     =============================================================
-c               Read in spiral arm segment data...
-      call get_arm_segments ( lu_data, lu_print, max_num_lbvs,
-     +                        arm_name, seg_ell_min, seg_ell_max,
-     +                        arm_ell, arm_bee, arm_vel,
-     +                        arm_Rgc, arm_beta, arm_dist,
-     +                        iarm_entries, num_arms )
+c               Read in Galactic/Solar parameters, spiral arm segment
+c               data and trig parallax results...
+      call load_bdc_model ( lu_data, lu_control, lu_print )
 
+c     Open files (for each arm) used for plotting and document with comment line
+      if ( level_out .ge. 2 ) then
+         lu = 30
+         a_name = 'Unk'
+         write (30,1010) lu, a_name
+         do n_a = 1, num_arms
+            lu = 30 + n_a
+            write (lu,1010) lu, arm_name(n_a)
+ 1010       format('! File fort.',i2,' for spiral arm segment "',a3,'"',
+     +            /'! Long.   Lat.   Vlsr  +/-    Dist.  +/-  ',
+     +             'Integrated  Arm',
+     +            /'! (deg)  (deg)  (km/s)        (kpc)       ',
+     +             'Probability')
 
-c     =============================================================
-c               Read in trig parallax results...
-      call get_parallaxes ( lu_control, lu_print,
-     +                      max_num_parallaxes, num_parallaxes,
-     +                      ref_src, ref_arm, ref_ell,
-     +                      ref_bee, ref_vlsr, ref_vunc,
-     +                      ref_par, ref_punc )
+         enddo
+      endif
 
 c     =============================================================
 c               Read in target sources for distance PDF...
 c     Get source information from one file (one line per source)...
       sources_file = 'sources_info.inp'
-      call open_ascii_file ( lu_sources, sources_file, lu_print )
+c     A different sources file can be given as first command line argument,
+c     so that one compiled executable can be reused for any list of sources
+      if ( command_argument_count() .ge. 1 )
+     +   call get_command_argument ( 1, sources_file )
+
+c     Daemon mode (sources file "-"): read sources from standard input
+c     until end-of-file and write the summary (and kinematic distances)
+c     of each source to standard output, terminated by a "! END" line
+      daemon = ( sources_file .eq. '-' )
+      lu_kd  = -1
+      if ( level_out .eq. 1 ) lu_kd = lu_summary
+      if ( daemon ) then
+         lu_sources = 5
+         lu_summary = lu_print
+         if ( level_out .ge. 1 ) lu_kd = lu_print
+      else
+         call open_ascii_file ( lu_sources, sources_file, lu_print )
+      endif
 
       ieof = 0
       do while ( ieof .ge. 0 )
 
 c      Check for "commented-out" source line (ie, starting with a "!")
-       read (lu_sources,*,iostat=ieof) s1
+       read (lu_sources,'(a)',iostat=ieof) line
+       s1 = adjustl(line)
 
-       if ( s1.ne.'!' .and. ieof.ge.0 ) then
+       if ( s1.ne.'!' .and. line.ne.' ' .and. ieof.ge.0 ) then
 
-         backspace (unit=lu_sources)
-         read (lu_sources,*) src, coord1, coord2, v_lsr, v_lsr_unc,
-     +                       far_prob
+         read (line,*) src, coord1, coord2, v_lsr, v_lsr_unc,
+     +                 far_prob
 
 c     Open summary output file...
 c        Strip blanks out of source name in output file naming
       call strip_blanks_14 ( src, stripped_src, nch_src )
       write (summary_file,1180) stripped_src(1:nch_src)
  1180 format(a,'_summary.prt')
-      open ( unit=lu_summary, file=summary_file )
+      if ( .not.daemon ) open ( unit=lu_summary, file=summary_file )
 c     Document summary output
       write (lu_summary,1100)
  1100 format('! Parallax-based distance estimator: Version 2',/
@@ -240,91 +208,320 @@ c     Document summary output
      +       '(kpc)       Probability          ')
 cc      write (lu_print,1100)
 
-c        Set source characteristics that are not entered in this version
-c        (ie, assume proper motions are not measured)
-         pm_x      = 0.d0
-         pm_x_unc  = 0.d0
-         pm_y      = 0.d0
-         pm_y_unc  = 0.d0
-
-c        Decide if input coordinates are (RA,Dec) or (ell,bee),
-c        since input RA,Dec are in hhmmss and dd''"" formats.
-         if ( coord1.gt.360.d0 .and. abs(coord2).gt.90.d0 ) then
-c              Almost certainly (RA,Dec), so convert to (ell,bee)
-               call hmsrad (coord1, ra_radians)
-               call dmsrad (coord2, dec_radians)
-               ra_hr   = ra_radians / hr_to_rad        ! hours
-               dec_deg = dec_radians / deg_to_rad      ! deg
-               call radec_to_galactic (ra_hr, dec_deg,
-     +                                 ell, bee )
-            else
-c              Almost certainly (ell,bee) in degrees
-               ell = coord1
-               bee = coord2
-c              Calculate (RA,Dec) from (ell,bee)
-               call ellbee_to_radec ( ell, bee,
-     +              ra_hr, dec_deg, ra_hhmmss, dec_ddmmss)
+         write (srcprt_file,1130) stripped_src(1:nch_src)
+ 1130    format(a,'.prt')
+         if ( lu_srcprt .gt. 0 )
+     +      open ( unit=lu_srcprt, file=srcprt_file )
+
+         call calc_source_distance ( lu_out, lu_srcprt, lu_summary,
+     +            lu_kd, P_max_SA, P_max_KD, P_max_GL, P_max_PS,
+     +            P_max_PM, src, coord1, coord2, v_lsr, v_lsr_unc,
+     +            far_prob, 0, ell, bee, n_kd, Dk_kd,
+     +            n_res, res_dist, res_dunc, res_int, res_arm, res_q,
+     +            pdfs )
+
+         if ( lu_srcprt .gt. 0 ) close ( unit=lu_srcprt )
+
+         if ( daemon ) then
+            write (lu_summary,'(a)') '! END'
+            flush ( lu_summary )
          endif
 
-c        Make sure Prob(Far) ranges from 0 -> 1
-         if ( far_prob .lt. 0.d0 ) far_prob = 0.d0
-         if ( far_prob .gt. 1.d0 ) far_prob = 1.d0
+       endif          ! "commented-out target" check
 
-c        Check if source in desired Galactic longitude range...
-         call longitude_range ( ell, glong_min, glong_max,
-     +                          accept )
+      enddo         ! target loop
 
-c        Strip blanks out of source name in output file naming
-         call strip_blanks_14 ( src,
-     +                          stripped_src, nch_src )
+      end
 
-         write (srcprt_file,1130) stripped_src(1:nch_src)
- 1130    format(a,'.prt')
-         open ( unit=lu_srcprt, file=srcprt_file )
-
-c        Calculate (pm_Glong,pm_Glat) from (pm_x,pm_y)
-c        (NB: increase shifts to avoid roundoff errors)
-         x_motion = pm_x * 1000.d0                            ! uas in 1 yr
-         y_motion = pm_y * 1000.d0                            ! uas in 1 yr
-         call xy_to_galactic ( ra_hr, dec_deg, x_motion, y_motion,
-     +                         ell_motion, bee_motion )
-         pm_ell = ell_motion / 1000.d0                        ! mas/yr
-         pm_bee = bee_motion / 1000.d0                        ! mas/yr
-
-c        Calculate uncertainties in these Galactic motion components
-         x_motion_unc = pm_x_unc * 1000.d0                    ! uas in 1 yr
-         y_motion_unc = pm_y_unc * 1000.d0                    ! uas in 1 yr
-         call xy_to_galactic ( ra_hr, dec_deg,
-     +                         x_motion_unc, y_motion_unc,
-     +                         ell_motion_unc, bee_motion_unc )
-         pm_ell_unc = ell_motion_unc / 1000.d0                ! mas/yr
-         pm_bee_unc = bee_motion_unc / 1000.d0                ! mas/yr
-
-         write (lu_srcprt,1140) src, ell, bee, far_prob,
-     +          v_lsr,v_lsr_unc, pm_ell,pm_ell_unc, pm_bee,pm_bee_unc
- 1140    format(//'================================================',
-     +            '================================',
-     +      /'Source          Long.    Lat.    Pfar    Vlsr   +/- ',
-     +       '  pm_ell  +/-   pm_bee  +/-',
-     +      /a14,2f8.3,f7.2,2x,f7.2,f6.2,2x,2f6.2,2x,2f6.2,/1x)
-
-c        ----------------------------------------------------------------
-c        Pre-calculate non-distance based probability terms:
-c              P(arm) and near/far kinematic distance values
-
-c        Calculate P(arm) to be used later in P(d)=P(d|arm)*P(arm)
-c        Use (ell,z,vel) to assign arm segment probabilities
-         call assign_arm_probabilities ( ell, bee, v_lsr, v_lsr_unc,
-     +            ell_dif_max,
-     +            num_arms, arm_ell, arm_bee, arm_vel, iarm_entries,
-     +            arm_Rgc, arm_beta, arm_dist,
-     +            width_min, width_Rref, width_slope,
-     +            sigz, Rsigz, sigzdot,
-     +            seg_ell_min, seg_ell_max,
-     +            sig_ell, sig_vel,
-     +            arm_probabilities )
-
-c        Print out absolute probabilities.
+c====================================================================
+
+      subroutine load_bdc_model ( lu_data, lu_control, lu_print )
+
+c     Reads in the Galactic/Solar parameters, the spiral arm segment data
+c     and the trig parallax results into the common blocks used by
+c     calc_source_distance.  Input files are looked up in the directory
+c     given by data_dir (see open_ascii_file).
+
+      implicit real*8 (a-h,o-z)
+
+      character*48  galaxy_file
+
+      common /bdc_galaxy/ Ro, a1, a2, a3, Uo, Vo, Wo, Us, Vs, Ws,
+     +                    glong_min, glong_max
+
+      character*12  arm_name(29)
+      common /bdc_arm_names/ arm_name
+      integer       iarm_entries(29)
+      real*8        arm_ell(29,300), arm_bee(29,300), arm_vel(29,300)
+      real*8        arm_Rgc(29,300), arm_beta(29,300), arm_dist(29,300)
+      real*8        seg_ell_min(29,2), seg_ell_max(29,2)
+      common /bdc_arms/ arm_ell, arm_bee, arm_vel, arm_Rgc, arm_beta,
+     +                  arm_dist, seg_ell_min, seg_ell_max,
+     +                  iarm_entries, num_arms
+
+      character*14  ref_src(1000)
+      character*12  ref_arm(1000)
+      common /bdc_parallax_names/ ref_src, ref_arm
+      real*8        ref_ell(1000), ref_bee(1000)
+      real*8        ref_vlsr(1000), ref_vunc(1000)
+      real*8        ref_par(1000), ref_punc(1000)
+      common /bdc_parallaxes/ ref_ell, ref_bee, ref_vlsr, ref_vunc,
+     +                        ref_par, ref_punc, num_parallaxes
+
+c     Set some maximum dimension values...
+      max_num_parallaxes = 1000  ! max number of parallaxes entered
+      max_num_lbvs   = 300       ! max number of (l,b,v,R,beta,D) values to define an arm segment
+c     max_num_arms   = 29        ! max number of arm segments (hardwired in subroutine)
+
+c     =============================================================
+c               Read in Galactic/Solar parameters...
+      galaxy_file = 'galaxy_data_Univ.inp'
+      call galaxy_parameters_Univ( lu_data, galaxy_file, lu_print,
+     +           Ro, a1, a2, a3, Uo, Vo, Wo, Us, Vs, Ws,
+     +           glong_min, glong_max )
+
+c     =============================================================
+c               Read in spiral arm segment data...
+      call get_arm_segments ( lu_data, lu_print, max_num_lbvs,
+     +                        arm_name, seg_ell_min, seg_ell_max,
+     +                        arm_ell, arm_bee, arm_vel,
+     +                        arm_Rgc, arm_beta, arm_dist,
+     +                        iarm_entries, num_arms )
+
+
+c     =============================================================
+c               Read in trig parallax results...
+      call get_parallaxes ( lu_control, lu_print,
+     +                      max_num_parallaxes, num_parallaxes,
+     +                      ref_src, ref_arm, ref_ell,
+     +                      ref_bee, ref_vlsr, ref_vunc,
+     +                      ref_par, ref_punc )
+
+      return
+      end
+
+c====================================================================
+
+      subroutine calc_source_distance ( lu_out, lu_srcprt, lu_summary,
+     +           lu_kd, P_max_SA, P_max_KD, P_max_GL, P_max_PS,
+     +           P_max_PM, src, coord1, coord2, v_lsr, v_lsr_unc,
+     +           far_prob, i_fallback, ell, bee, n_kd, Dk_kd,
+     +           n_res, res_dist, res_dunc, res_int, res_arm, res_q,
+     +           pdfs )
+
+c     Generates the distance probability density function for one source
+c     given its (ell,bee,Vlsr) values, using the Galaxy model, spiral arm
+c     and parallax data read in by load_bdc_model.
+
+c     Print out goes to lu_srcprt, the one line summary to lu_summary and
+c     the kinematic distance(s) to lu_kd; nothing is written if the
+c     respective unit number is not positive.  PDF files are only made
+c     if lu_out >= 7.
+
+c     If i_fallback = 1 and the prior far_prob yields no distance peaks,
+c     the final PDF is recalculated with a flat prior (far_prob = 0.5).
+c     Only the kinematic distance PDF depends on far_prob, so the other
+c     component PDFs are reused; far_prob returns the prior in use.
+
+c     Returned values:
+c        ell, bee          ! Galactic coordinates of the source (deg)
+c        n_kd, Dk_kd       ! number and values of kinematic distances (kpc)
+c        n_res             ! 1 if distance peaks were found, otherwise 0
+c        res_dist, res_dunc, res_int, res_arm, res_q
+c                          ! distance, +/-, integrated probability, arm
+c                          !   and quality flag of the 1st and 2nd peak
+c        pdfs              ! kinematic distance, spiral arm, latitude,
+c                          !   arm*latitude, parallax and final PDFs
+
+      implicit real*8 (a-h,o-z)
+
+      character*32  pdf_name
+      character*14  src
+      character*2   res_q(2)
+      character*12  res_arm(2)
+
+      real*8        Dk_kd(2), res_dist(2), res_dunc(2), res_int(2)
+      real*8        pdfs(1001,6)
+
+      real*8        dist_prior(1001), prob_dist(1001)
+      real*8        par_bins(1001), dist_bins(1001)
+      real*8        prob_arm(1001), prob_lat(1001), prob_armlat(1001)
+      real*8        prob_Dpm_ell(1001),prob_Dpm_bee(1001),prob_Dk(1001)
+      real*8        prob_MWmodel(1001)
+
+      real*8        peaks(25), peaks_width(25)
+      real*8        peak_prob(25)
+      real*8        peak_dist(25), peak_dunc(25), peak_int(25)
+
+      logical       use_peak(25)
+
+      real*8        params(77)
+      character*16  parnames(77)
+      integer       paramids(77)
+
+c     Arm information arrays
+      real*8        arm_probabilities(29)
+      real*8        d_store(29), b_store(29)
+      character*12  a_store(29)
+
+      character*12  arm_indicated, p2_arm
+      character*12  arm_max, arm_max_bin(1001)
+
+      character*2   questionable, q2
+
+      logical       accept, odd_source
+
+c     Galaxy model, spiral arm and parallax data (see load_bdc_model)
+      common /bdc_galaxy/ Ro, a1, a2, a3, Uo, Vo, Wo, Us, Vs, Ws,
+     +                    glong_min, glong_max
+
+      character*12  arm_name(29)
+      common /bdc_arm_names/ arm_name
+      integer       iarm_entries(29)
+      real*8        arm_ell(29,300), arm_bee(29,300), arm_vel(29,300)
+      real*8        arm_Rgc(29,300), arm_beta(29,300), arm_dist(29,300)
+      real*8        seg_ell_min(29,2), seg_ell_max(29,2)
+      common /bdc_arms/ arm_ell, arm_bee, arm_vel, arm_Rgc, arm_beta,
+     +                  arm_dist, seg_ell_min, seg_ell_max,
+     +                  iarm_entries, num_arms
+
+      character*14  ref_src(1000)
+      character*12  ref_arm(1000)
+      common /bdc_parallax_names/ ref_src, ref_arm
+      real*8        ref_ell(1000), ref_bee(1000)
+      real*8        ref_vlsr(1000), ref_vunc(1000)
+      real*8        ref_par(1000), ref_punc(1000)
+      common /bdc_parallaxes/ ref_ell, ref_bee, ref_vlsr, ref_vunc,
+     +                        ref_par, ref_punc, num_parallaxes
+
+c     Set some maximum dimension values...
+      max_num_params = 77        ! max number of Gaussian fit parameters used for final PDF
+      max_num_peaks  = 25        ! max number of peaks in final PDF
+
+      pi = 4.d0 * atan(1.d0)
+      deg_to_rad = pi/180.d0
+      hr_to_rad  = pi/12.d0
+
+c     =============================================================
+c     Important numerical parameters
+      num_bins = 1001         ! Dimension limit for par_prob array
+      bin_size = 0.025d0      ! kpc
+
+c     To calculate prob of being in an arm based on (l,b,v)-traces,
+c     add Virial velocity uncertainty to other uncertainties (measured, peculiar)
+      sig_vel     = 5.d0      ! km/s
+
+c     Maximum difference in longitude to bother calculating arm prob
+      ell_dif_max = 5.d0      ! deg
+
+c     To calculate probability based on arm width vs Radius
+c     Arm width formula  W = 0.17 + (R_kpc-3.5)*0.036 kpc for R>3.5kpc
+c     (which comes from W = 0.336 + (R_kpc-8.15)*0.036; see Fig. 2 of Reid+2019)
+      width_min  = 0.17d0     ! kpc  (Gaussian sigma)
+      width_Rref = 3.5d0      ! kpc
+      width_slope= 0.036d0    ! kpc/kpc
+
+c     To calculate prob of being off the (warped) plane
+c     Arm z-width formula  W_z = 0.03 + (R-7.0)*0.036 kpc for R>7kpc
+      sigz    = 0.03d0               ! kpc      (1-sig z-height for Rgc<Rsigz)
+      Rsigz   = 7.0d0                ! kpc
+      sigzdot = 0.036d0              ! kpc/kpc  (slope of z-height with Rgc)
+
+c     To calcuate prob of matching a source with one with measured parallax
+      sig_GMC = 0.05d0        ! kpc (1-sig radius difference for sources in a GMC)
+
+c     Smooth prob(d) based on arm assignment (which is "lumpy")
+      smooth_kpc = 0.5d0      ! kpc (smooth dist_prob over this length)
+
+c     No distance peaks found (yet)
+      n_res = 0
+      do n_r = 1, 2
+         res_dist(n_r) = 0.d0
+         res_dunc(n_r) = 0.d0
+         res_int(n_r)  = 0.d0
+         res_arm(n_r)  = '...'
+         res_q(n_r)    = '  '
+      enddo
+
+c     Set source characteristics that are not entered in this version
+c     (ie, assume proper motions are not measured)
+      pm_x      = 0.d0
+      pm_x_unc  = 0.d0
+      pm_y      = 0.d0
+      pm_y_unc  = 0.d0
+
+c     Decide if input coordinates are (RA,Dec) or (ell,bee),
+c     since input RA,Dec are in hhmmss and dd''"" formats.
+      if ( coord1.gt.360.d0 .and. abs(coord2).gt.90.d0 ) then
+c           Almost certainly (RA,Dec), so convert to (ell,bee)
+            call hmsrad (coord1, ra_radians)
+            call dmsrad (coord2, dec_radians)
+            ra_hr   = ra_radians / hr_to_rad        ! hours
+            dec_deg = dec_radians / deg_to_rad      ! deg
+            call radec_to_galactic (ra_hr, dec_deg,
+     +                              ell, bee )
+         else
+c           Almost certainly (ell,bee) in degrees
+            ell = coord1
+            bee = coord2
+c           Calculate (RA,Dec) from (ell,bee)
+            call ellbee_to_radec ( ell, bee,
+     +           ra_hr, dec_deg, ra_hhmmss, dec_ddmmss)
+      endif
+
+c     Make sure Prob(Far) ranges from 0 -> 1
+      if ( far_prob .lt. 0.d0 ) far_prob = 0.d0
+      if ( far_prob .gt. 1.d0 ) far_prob = 1.d0
+
+c     Check if source in desired Galactic longitude range...
+      call longitude_range ( ell, glong_min, glong_max,
+     +                       accept )
+
+c     Calculate (pm_Glong,pm_Glat) from (pm_x,pm_y)
+c     (NB: increase shifts to avoid roundoff errors)
+      x_motion = pm_x * 1000.d0                            ! uas in 1 yr
+      y_motion = pm_y * 1000.d0                            ! uas in 1 yr
+      call xy_to_galactic ( ra_hr, dec_deg, x_motion, y_motion,
+     +                      ell_motion, bee_motion )
+      pm_ell = ell_motion / 1000.d0                        ! mas/yr
+      pm_bee = bee_motion / 1000.d0                        ! mas/yr
+
+c     Calculate uncertainties in these Galactic motion components
+      x_motion_unc = pm_x_unc * 1000.d0                    ! uas in 1 yr
+      y_motion_unc = pm_y_unc * 1000.d0                    ! uas in 1 yr
+      call xy_to_galactic ( ra_hr, dec_deg,
+     +                      x_motion_unc, y_motion_unc,
+     +                      ell_motion_unc, bee_motion_unc )
+      pm_ell_unc = ell_motion_unc / 1000.d0                ! mas/yr
+      pm_bee_unc = bee_motion_unc / 1000.d0                ! mas/yr
+
+      if ( lu_srcprt .gt. 0 )
+     +   write (lu_srcprt,1140) src, ell, bee, far_prob,
+     +       v_lsr,v_lsr_unc, pm_ell,pm_ell_unc, pm_bee,pm_bee_unc
+ 1140 format(//'================================================',
+     +         '================================',
+     +   /'Source          Long.    Lat.    Pfar    Vlsr   +/- ',
+     +    '  pm_ell  +/-   pm_bee  +/-',
+     +   /a14,2f8.3,f7.2,2x,f7.2,f6.2,2x,2f6.2,2x,2f6.2,/1x)
+
+c     ----------------------------------------------------------------
+c     Pre-calculate non-distance based probability terms:
+c           P(arm) and near/far kinematic distance values
+
+c     Calculate P(arm) to be used later in P(d)=P(d|arm)*P(arm)
+c     Use (ell,z,vel) to assign arm segment probabilities
+      call assign_arm_probabilities ( ell, bee, v_lsr, v_lsr_unc,
+     +         ell_dif_max,
+     +         num_arms, arm_ell, arm_bee, arm_vel, iarm_entries,
+     +         arm_Rgc, arm_beta, arm_dist,
+     +         width_min, width_Rref, width_slope,
+     +         sigz, Rsigz, sigzdot,
+     +         seg_ell_min, seg_ell_max,
+     +         sig_ell, sig_vel,
+     +         arm_probabilities )
+
+c     Print out absolute probabilities.
+      if ( lu_srcprt .gt. 0 ) then
          write (lu_srcprt,1147)
  1147    format(' Arm  Prob(arm|l,b,v)')
          do n_a = 1, num_arms
@@ -332,367 +529,382 @@ c        Print out absolute probabilities.
      +                             arm_probabilities(n_a)
  1148       format(1x,a3,f13.5)
          enddo
+      endif
 
-c        Get "standard" kinematic distance(s) for informational use only.
-c        (Later Prob_KD will be directly calculated from velocity differences,
-c        avoiding complications associated with allowing for velocity uncertainties.)
-         farnear_flag = 0.d0                              ! near distance flag
-         call calc_Dk_Univ ( lu_out,
-     +               Ro, a1, a2, a3, Uo, Vo, Wo, Us, Vs, Ws,
-     +               ell, bee, farnear_flag, v_lsr,
-     +               v_lsr_rev, Dk_near )
-
-         write (lu_srcprt,1149)
- 1149    format(' ')
-         if ( Dk_near .gt. 0.d0 ) then
-            write (lu_srcprt,1150) Dk_near
- 1150       format(' Kinematic distance(s):',f7.2)
-         endif
-
-         farnear_flag = 1.d0                              ! far distance flag
-         call calc_Dk_Univ ( lu_out,
-     +               Ro, a1, a2, a3, Uo, Vo, Wo, Us, Vs, Ws,
-     +               ell, bee, farnear_flag, v_lsr,
-     +               v_lsr_rev, Dk_far )
+c     Get "standard" kinematic distance(s) for informational use only.
+c     (Later Prob_KD will be directly calculated from velocity differences,
+c     avoiding complications associated with allowing for velocity uncertainties.)
+      farnear_flag = 0.d0                              ! near distance flag
+      call calc_Dk_Univ ( lu_out,
+     +            Ro, a1, a2, a3, Uo, Vo, Wo, Us, Vs, Ws,
+     +            ell, bee, farnear_flag, v_lsr,
+     +            v_lsr_rev, Dk_near )
+
+c     Kinematic distance(s) are also reported to lu_kd (if > 0)
+      do n_k = 1, 2
+         Dk_kd(n_k) = 0.d0
+      enddo
+      n_kd = 0
+
+      if ( lu_srcprt .gt. 0 ) write (lu_srcprt,1149)
+ 1149 format(' ')
+      if ( Dk_near .gt. 0.d0 ) then
+         if ( lu_srcprt .gt. 0 ) write (lu_srcprt,1150) Dk_near
+ 1150    format(' Kinematic distance(s):',f7.2)
+         if ( lu_kd .gt. 0 ) write (lu_kd,1150) Dk_near
+         n_kd = n_kd + 1
+         Dk_kd(n_kd) = Dk_near
+      endif
 
-         if ( Dk_far .gt. Dk_near ) then
-            write (lu_srcprt,1150) Dk_far
-         endif
+      farnear_flag = 1.d0                              ! far distance flag
+      call calc_Dk_Univ ( lu_out,
+     +            Ro, a1, a2, a3, Uo, Vo, Wo, Us, Vs, Ws,
+     +            ell, bee, farnear_flag, v_lsr,
+     +            v_lsr_rev, Dk_far )
+
+      if ( Dk_far .gt. Dk_near ) then
+         if ( lu_srcprt .gt. 0 ) write (lu_srcprt,1150) Dk_far
+         if ( lu_kd .gt. 0 ) write (lu_kd,1150) Dk_far
+         n_kd = n_kd + 1
+         Dk_kd(n_kd) = Dk_far
+      endif
 
-c        Check for pathalogical values...
-         if ( Dk_near.le.0.d0 .and. Dk_far.le.0.d0 ) then
-            write (lu_srcprt,1160) src, v_lsr, ell
- 1160       format(/' Source ',a12,': unlikely V(LSR),longitude pair (',
-     +              2f8.2,').',
-     +             /' Resetting kinematic distance to 5 kpc',
-     +              ' with large uncertainty.')
-            Dk_near       = 5.d0                              ! kpc
-            Dk_far        = 0.d0                              ! kpc
-         endif
+c     Check for pathalogical values...
+      if ( Dk_near.le.0.d0 .and. Dk_far.le.0.d0 ) then
+         if ( lu_srcprt .gt. 0 ) write (lu_srcprt,1160) src, v_lsr, ell
+ 1160    format(/' Source ',a12,': unlikely V(LSR),longitude pair (',
+     +           2f8.2,').',
+     +          /' Resetting kinematic distance to 5 kpc',
+     +           ' with large uncertainty.')
+         Dk_near       = 5.d0                              ! kpc
+         Dk_far        = 0.d0                              ! kpc
+      endif
 
-c        ----------------------------------------------------------------
-c           Start distance-based probability calculations
-c        ----------------------------------------------------------------
+c     ----------------------------------------------------------------
+c        Start distance-based probability calculations
+c     ----------------------------------------------------------------
 
-c        Define distance bins and get warping model
-c        Zero distance probability array and define bins
-c        (eg, 0.025 kpc steps from 0.025 to 25.025 kpc with 1001 bins)
-         do n_ps = 1, num_bins
-            dist_prior(n_ps) = 0.d0
-            dist_bins(n_ps)  = n_ps * bin_size                ! kpc
-c           Generate 1/d parallax bins
-            par_bins(n_ps)   = 1.d0 / dist_bins(n_ps)         ! mas
-         enddo
+c     Define distance bins and get warping model
+c     Zero distance probability array and define bins
+c     (eg, 0.025 kpc steps from 0.025 to 25.025 kpc with 1001 bins)
+      do n_ps = 1, num_bins
+         dist_prior(n_ps) = 0.d0
+         dist_bins(n_ps)  = n_ps * bin_size                ! kpc
+c        Generate 1/d parallax bins
+         par_bins(n_ps)   = 1.d0 / dist_bins(n_ps)         ! mas
+      enddo
 
-c        Get warping model values for distance bins along ray from Sun through source...
-         call get_warping ( num_bins, Ro, num_arms, iarm_entries,
-     +                      arm_name, arm_probabilities,
-     +                      arm_ell, arm_bee, arm_vel,
-     +                      arm_Rgc, arm_beta, arm_dist,
-     +                      ell, bee, dist_bins,
-     +                      n_bees, d_store, b_store, a_store)
-
-c        =========================================================
-c        First calculate parallax-source based Prob_PS(d).
-c        This requires examining hundreds of parallax sources and
-c        calculating dist_prob(n) for each potential matching source.
-c        Doing it now is much more efficient than later and going through
-c        each distance bin and then searching for parallax-source match.
-
-c        Find "nearby" in (l,b,v) parallax sources
-         write (lu_srcprt,1170)
- 1170    format(/' Priors from other source parallaxes:',
-     +          /' Source         Vlsr      Parallax   +/-',
-     +           '      Arm        Weight')
-         n_pf = 0
-         sum_weight = 0.d0
-
-c        Check that we have some parallax sources and that we want to use them
-         if ( num_parallaxes.ge.1 .and. P_max_PS.gt.0.d0 ) then
-            do n_p = 1, num_parallaxes
-
-c              Temporary variables for this parallax source...
-               dist_par = 1.d0 / ref_par(n_p)
-               ell_par  = ref_ell(n_p)
-               bee_par  = ref_bee(n_p)
-               vlsr_par = ref_vlsr(n_p)
-
-c              Calculate differences between target and parallax source
-               dell = abs( ell - ell_par )                       ! deg
-               dbee = abs( bee - bee_par )                       ! deg
-               dvel = abs( v_lsr - vlsr_par )                    ! km/s
-
-c              Convert (longitude,latitude) to (rho,zee) in kpc units,
-c              using the parallax-source's measured parallax distance
-               drho = dell*deg_to_rad * dist_par                 ! kpc
-               dzee = dbee*deg_to_rad * dist_par                 ! kpc
-
-c              Both the target and parallax sources have significant V
-c              uncertainty, the V-difference uncertainty will be larger
-               sig_vel_dif = sqrt( sig_vel**2 + v_lsr_unc**2 )   ! km/s
-
-c              Don't bother with this parallax source unless close in all parameters
-               if ( drho.le.3.d0*sig_GMC     .and.
-     +              dzee.le.3.d0*sig_GMC     .and.
-     +              dvel.le.3.d0*sig_vel_dif       ) then
-
-c                 Have a nearby parallax source...
-                  n_pf = n_pf + 1
-
-c                 Calculate weight
-                  ssq = drho**2/(2.0d0*sig_GMC**2) +
-     +                  dzee**2/(2.0d0*sig_GMC**2) +
-     +                  dvel**2/(2.0d0*sig_vel_dif**2)
-                  weight     = exp(-ssq)               ! unity for perfect match
-                  sum_weight = sum_weight + weight
-
-                  pref = ref_par(n_p)
-                  eref = ref_punc(n_p)
-                  vref = ref_vlsr(n_p)
-
-                  write (lu_srcprt,1200) ref_src(n_p), vref,
-     +                                pref, eref, ref_arm(n_p), weight
- 1200             format(1x,a12,f7.1,5x,2f8.3,5x,a3,5x,f10.6)
-
-c                 Add to prior parallax probability, converted to distance probability
-                  do n_ps = 1, num_bins
-
-c                    Calculate weighted parallax probability for this prior
-                     p_bin = par_bins(n_ps)
-                     call gauss_prob ( pref, eref, p_bin, prob )
-                     p_prob = weight * prob
-
-c                    Convert to distance probability (P(d)=P(pi)*pi^2)
-c                    and sum in this distance bin...
-                     d_prob = p_prob * p_bin**2
-                     dist_prior(n_ps) = dist_prior(n_ps) + d_prob
-
-                  enddo
-
-               endif            ! prior source close to target source
-
-            enddo            ! prior source loop
-
-         endif          ! no parallaxes check
-
-c        Do not want to assume entirely that the parallax sources give the distance
-c        to the target.  So, add in a background "flat" pdf for all distances...
-c        Use sum_weight, since we want total probability (not density)
-c        Set maximum total parallax probability to P_max_PS
-c        Normalize parallax association pdf
-         call condition_pdf(num_bins, bin_size, P_max_PS, dist_prior)
-         pdf_name = 'parallaxes_pdf'
-         if ( lu_out .ge.7 ) then
-            call output_pdf ( lu_out, pdf_name, src, num_bins,
-     +                        dist_bins, dist_prior )
-         endif
+c     Get warping model values for distance bins along ray from Sun through source...
+      call get_warping ( num_bins, Ro, num_arms, iarm_entries,
+     +                   arm_name, arm_probabilities,
+     +                   arm_ell, arm_bee, arm_vel,
+     +                   arm_Rgc, arm_beta, arm_dist,
+     +                   ell, bee, dist_bins,
+     +                   n_bees, d_store, b_store, a_store)
+
+c     =========================================================
+c     First calculate parallax-source based Prob_PS(d).
+c     This requires examining hundreds of parallax sources and
+c     calculating dist_prob(n) for each potential matching source.
+c     Doing it now is much more efficient than later and going through
+c     each distance bin and then searching for parallax-source match.
+
+c     Find "nearby" in (l,b,v) parallax sources
+      if ( lu_srcprt .gt. 0 ) write (lu_srcprt,1170)
+ 1170 format(/' Priors from other source parallaxes:',
+     +       /' Source         Vlsr      Parallax   +/-',
+     +        '      Arm        Weight')
+      n_pf = 0
+      sum_weight = 0.d0
+
+c     Check that we have some parallax sources and that we want to use them
+      if ( num_parallaxes.ge.1 .and. P_max_PS.gt.0.d0 ) then
+         do n_p = 1, num_parallaxes
+
+c           Temporary variables for this parallax source...
+            dist_par = 1.d0 / ref_par(n_p)
+            ell_par  = ref_ell(n_p)
+            bee_par  = ref_bee(n_p)
+            vlsr_par = ref_vlsr(n_p)
+
+c           Calculate differences between target and parallax source
+            dell = abs( ell - ell_par )                       ! deg
+            dbee = abs( bee - bee_par )                       ! deg
+            dvel = abs( v_lsr - vlsr_par )                    ! km/s
+
+c           Convert (longitude,latitude) to (rho,zee) in kpc units,
+c           using the parallax-source's measured parallax distance
+            drho = dell*deg_to_rad * dist_par                 ! kpc
+            dzee = dbee*deg_to_rad * dist_par                 ! kpc
+
+c           Both the target and parallax sources have significant V
+c           uncertainty, the V-difference uncertainty will be larger
+            sig_vel_dif = sqrt( sig_vel**2 + v_lsr_unc**2 )   ! km/s
+
+c           Don't bother with this parallax source unless close in all parameters
+            if ( drho.le.3.d0*sig_GMC     .and.
+     +           dzee.le.3.d0*sig_GMC     .and.
+     +           dvel.le.3.d0*sig_vel_dif       ) then
+
+c              Have a nearby parallax source...
+               n_pf = n_pf + 1
+
+c              Calculate weight
+               ssq = drho**2/(2.0d0*sig_GMC**2) +
+     +               dzee**2/(2.0d0*sig_GMC**2) +
+     +               dvel**2/(2.0d0*sig_vel_dif**2)
+               weight     = exp(-ssq)               ! unity for perfect match
+               sum_weight = sum_weight + weight
+
+               pref = ref_par(n_p)
+               eref = ref_punc(n_p)
+               vref = ref_vlsr(n_p)
+
+               if ( lu_srcprt .gt. 0 )
+     +            write (lu_srcprt,1200) ref_src(n_p), vref,
+     +                             pref, eref, ref_arm(n_p), weight
+ 1200          format(1x,a12,f7.1,5x,2f8.3,5x,a3,5x,f10.6)
+
+c              Add to prior parallax probability, converted to distance probability
+               do n_ps = 1, num_bins
+
+c                 Calculate weighted parallax probability for this prior
+                  p_bin = par_bins(n_ps)
+                  call gauss_prob ( pref, eref, p_bin, prob )
+                  p_prob = weight * prob
+
+c                 Convert to distance probability (P(d)=P(pi)*pi^2)
+c                 and sum in this distance bin...
+                  d_prob = p_prob * p_bin**2
+                  dist_prior(n_ps) = dist_prior(n_ps) + d_prob
 
-c        =============================================================
-c        Now work towards a full Prob(d) by including
-c        Prob_SA, Prob_KD, Prob_GL, and Prob_pm_ell...
+               enddo
 
-         write (lu_srcprt,1900)
- 1900    format(/'  Dist     P_PS    P_GalMod   P_posteriori',
-     +           '   Arm',
-     +          /'  (kpc)')
+            endif            ! prior source close to target source
 
-c        Run through distance bins and calculate various PDFs...
-         do n_ps = 1, num_bins
+         enddo            ! prior source loop
 
-c           Bin parallax value
-            d_bin = dist_bins(n_ps)                               ! kpc
+      endif          ! no parallaxes check
 
-c           Calculate probabilities for spiral arm model, based on the
-c           minimum separation of the target source (for a trial distance)
-c           from the center of a given spiral arm
-            call arm_model_prob ( Ro, num_arms, iarm_entries,
-     +                            ell_dif_max,
-     +                            arm_name, arm_probabilities,
-     +                            arm_ell, arm_bee, arm_vel,
-     +                            arm_Rgc, arm_beta, arm_dist,
-     +                            width_min, width_Rref, width_slope,
-     +                            ell, bee, d_bin,
-     +                            arm_max, p_arm )
-
-c           If user specified not to use Prob_SA or if the target's
-c           Galactic longitude is out of range, reset p_arm to zero
-            arm_max_bin(n_ps) = arm_max
-            if ( P_max_SA.eq.0.d0 .or. .not.accept ) p_arm = 0.d0
-            prob_arm(n_ps) = p_arm
-
-c           Kinematic distance pdf...
-c           Added measurement and Virial uncertainty in quadrature
-            sig_vel_infl = sqrt( sig_vel**2 + v_lsr_unc**2 )      ! km/s
-            call Dk_prob_density ( a1, a2, a3, Ro, To,
-     +           Uo, Vo, Wo, Us, Vs, Ws,
-     +           ell, bee, d_bin, v_lsr,
-     +           Dk_near, Dk_far, far_prob, sig_vel_infl,
-     +           p_Dk )
-            if ( P_max_KD .eq. 0.d0 ) p_Dk = 0.d0
-            prob_Dk(n_ps) = p_Dk
+c     Do not want to assume entirely that the parallax sources give the distance
+c     to the target.  So, add in a background "flat" pdf for all distances...
+c     Use sum_weight, since we want total probability (not density)
+c     Set maximum total parallax probability to P_max_PS
+c     Normalize parallax association pdf
+      call condition_pdf(num_bins, bin_size, P_max_PS, dist_prior)
+      pdf_name = 'parallaxes_pdf'
+      if ( lu_out .ge.7 ) then
+         call output_pdf ( lu_out, pdf_name, src, num_bins,
+     +                     dist_bins, dist_prior )
+      endif
 
-c           Galactic latitude pdf...
-            call lat_prob_warped ( ell, bee, d_bin, Ro,
-     +                             Rsigz, sigz, sigzdot,
-     +                             n_bees, d_store, b_store,
-     +                             p_lat, arg )
-            if ( P_max_GL .eq. 0.d0 ) p_lat = 0.d0
-            prob_lat(n_ps) = p_lat
-
-c           Proper motion pdfs...
-            prob_Dpm_ell(n_ps) = 0.d0
-            prob_Dpm_bee(n_ps) = 0.d0
-
-c           Caculate only if a non-zero PM component is entered
-            if ( pm_x.ne.0.d0 .or. pm_y.ne.0.d0 ) then
-
-c              Galactic longitude proper motion pdf...
-               call pm_ell_prob_density ( a1, a2, a3, Ro, To,
-     +                 Uo, Vo, Wo, Us, Vs, Ws,
-     +                 ell, bee, d_bin, pm_ell, pm_ell_unc, sig_vel,
-     +                 p_Dpm_ell )
-               if ( P_max_PM .eq. 0.d0 ) p_Dpm_ell = 0.d0
-               prob_Dpm_ell(n_ps) = p_Dpm_ell
-
-c              Galactic latitude proper motion pdf...
-               call pm_bee_prob_density ( Wo, ell, bee,
-     +                                 pm_bee, pm_bee_unc,
-     +                                 d_bin, sig_vel,
-     +                                 p_Dpm_bee )
-               if ( P_max_PM .eq. 0.d0 ) p_Dpm_bee = 0.d0
-               prob_Dpm_bee(n_ps) = p_Dpm_bee
+c     =============================================================
+c     Now work towards a full Prob(d) by including
+c     Prob_SA, Prob_KD, Prob_GL, and Prob_pm_ell...
 
-            endif
+      if ( lu_srcprt .gt. 0 ) write (lu_srcprt,1900)
+ 1900 format(/'  Dist     P_PS    P_GalMod   P_posteriori',
+     +        '   Arm',
+     +       /'  (kpc)')
 
-         enddo         ! distance bin loop
+c     Run through distance bins and calculate various PDFs...
+      do n_ps = 1, num_bins
 
-c        ------------------------------------------------------------
-c        Normalize the component PDFs...
+c        Bin parallax value
+         d_bin = dist_bins(n_ps)                               ! kpc
 
-c        Arm model...
-c        Smooth prob_arm to get rid of numerous secondary peaks caused by
-c        using lbvRBD information, which has variations on small scales
-         call smooth ( smooth_kpc, num_bins, dist_bins,
-     +                 prob_arm )
+c        Calculate probabilities for spiral arm model, based on the
+c        minimum separation of the target source (for a trial distance)
+c        from the center of a given spiral arm
+         call arm_model_prob ( Ro, num_arms, iarm_entries,
+     +                         ell_dif_max,
+     +                         arm_name, arm_probabilities,
+     +                         arm_ell, arm_bee, arm_vel,
+     +                         arm_Rgc, arm_beta, arm_dist,
+     +                         width_min, width_Rref, width_slope,
+     +                         ell, bee, d_bin,
+     +                         arm_max, p_arm )
 
-c        Add a background probability density if Sum P(arm) < 1
-         sum_arm_probs = 0.d0
-         do i_a = 1, num_arms
-            sum_arm_probs = sum_arm_probs + arm_probabilities(i_a)
-         enddo
+c        If user specified not to use Prob_SA or if the target's
+c        Galactic longitude is out of range, reset p_arm to zero
+         arm_max_bin(n_ps) = arm_max
+         if ( P_max_SA.eq.0.d0 .or. .not.accept ) p_arm = 0.d0
+         prob_arm(n_ps) = p_arm
 
-c        Final normalization, with background if needed
-c        Use Sum{arm_probabilities) for P_max, but clip so that <P_max_SA
-         P_max = min( P_max_SA, sum_arm_probs )
-         call condition_pdf (num_bins, bin_size, P_max, prob_arm)
+c        Kinematic distance pdf...
+c        Added measurement and Virial uncertainty in quadrature
+         sig_vel_infl = sqrt( sig_vel**2 + v_lsr_unc**2 )      ! km/s
+         call Dk_prob_density ( a1, a2, a3, Ro, To,
+     +        Uo, Vo, Wo, Us, Vs, Ws,
+     +        ell, bee, d_bin, v_lsr,
+     +        Dk_near, Dk_far, far_prob, sig_vel_infl,
+     +        p_Dk )
+         if ( P_max_KD .eq. 0.d0 ) p_Dk = 0.d0
+         prob_Dk(n_ps) = p_Dk
+
+c        Galactic latitude pdf...
+         call lat_prob_warped ( ell, bee, d_bin, Ro,
+     +                          Rsigz, sigz, sigzdot,
+     +                          n_bees, d_store, b_store,
+     +                          p_lat, arg )
+         if ( P_max_GL .eq. 0.d0 ) p_lat = 0.d0
+         prob_lat(n_ps) = p_lat
+
+c        Proper motion pdfs...
+         prob_Dpm_ell(n_ps) = 0.d0
+         prob_Dpm_bee(n_ps) = 0.d0
+
+c        Caculate only if a non-zero PM component is entered
+         if ( pm_x.ne.0.d0 .or. pm_y.ne.0.d0 ) then
+
+c           Galactic longitude proper motion pdf...
+            call pm_ell_prob_density ( a1, a2, a3, Ro, To,
+     +              Uo, Vo, Wo, Us, Vs, Ws,
+     +              ell, bee, d_bin, pm_ell, pm_ell_unc, sig_vel,
+     +              p_Dpm_ell )
+            if ( P_max_PM .eq. 0.d0 ) p_Dpm_ell = 0.d0
+            prob_Dpm_ell(n_ps) = p_Dpm_ell
+
+c           Galactic latitude proper motion pdf...
+            call pm_bee_prob_density ( Wo, ell, bee,
+     +                              pm_bee, pm_bee_unc,
+     +                              d_bin, sig_vel,
+     +                              p_Dpm_bee )
+            if ( P_max_PM .eq. 0.d0 ) p_Dpm_bee = 0.d0
+            prob_Dpm_bee(n_ps) = p_Dpm_bee
 
-C        Next 5 lines added by M. Riener
-         pdf_name = 'arm_pdf'
-         if ( lu_out .ge.7 ) then
-            call output_pdf ( lu_out, pdf_name, src, num_bins,
-     +                        dist_bins, prob_arm )
          endif
 
-c        Latitude distance pdf...
-         call condition_pdf (num_bins, bin_size, P_max_GL, prob_lat)
+      enddo         ! distance bin loop
 
-C        Next 5 lines added by M. Riener
-         pdf_name = 'latitude_pdf'
-         if ( lu_out .ge.7 ) then
-            call output_pdf ( lu_out, pdf_name, src, num_bins,
-     +                        dist_bins, prob_lat )
-         endif
+c     ------------------------------------------------------------
+c     Normalize the component PDFs...
 
-c        Combine spiral arm pdf and latitude pdf...
-         do n_b = 1, num_bins
-            prob_armlat(n_b) = prob_arm(n_b) * prob_lat(n_b)
-         enddo
-C         call condition_pdf (num_bins, bin_size, P_max, prob_armlat)
-
-C        Next 8 lines added by M. Riener
-         if ( P_max_SA.eq.0.d0 ) then
-C            P_max_GL = P_max_GL / 2.d0
-            prob_armlat = prob_lat
-            call condition_pdf (num_bins, bin_size, P_max_GL,
-     +                          prob_armlat)
-         else
-            call condition_pdf (num_bins, bin_size, P_max,
-     +                          prob_armlat)
-         endif
+c     Arm model...
+c     Smooth prob_arm to get rid of numerous secondary peaks caused by
+c     using lbvRBD information, which has variations on small scales
+      call smooth ( smooth_kpc, num_bins, dist_bins,
+     +              prob_arm )
 
-         pdf_name = 'arm_latitude_pdf'
-         if ( lu_out .ge.7 ) then
-            call output_arm_pdf ( lu_out, pdf_name, src, num_bins,
-     +                            dist_bins, prob_armlat, arm_max_bin )
-         endif
+c     Add a background probability density if Sum P(arm) < 1
+      sum_arm_probs = 0.d0
+      do i_a = 1, num_arms
+         sum_arm_probs = sum_arm_probs + arm_probabilities(i_a)
+      enddo
 
-c        Kinematic distance pdf...
-         call condition_pdf (num_bins, bin_size, P_max_KD, prob_Dk)
-         pdf_name = 'kinematic_distance_pdf'
-         if ( lu_out .ge.7 ) then
-            call output_pdf ( lu_out, pdf_name, src, num_bins,
-     +                        dist_bins, prob_Dk )
-         endif
+c     Final normalization, with background if needed
+c     Use Sum{arm_probabilities) for P_max, but clip so that <P_max_SA
+      P_max = min( P_max_SA, sum_arm_probs )
+      call condition_pdf (num_bins, bin_size, P_max, prob_arm)
 
-c        Galactic longitude (ell) proper motion distance pdf...
-         call condition_pdf (num_bins, bin_size, P_max_PM,
-     +                       prob_Dpm_ell)
-         pdf_name = 'pm_ell_distance_pdf'
-         if ( lu_out .ge.7 ) then
-            call output_pdf ( lu_out, pdf_name, src, num_bins,
-     +                        dist_bins, prob_Dpm_ell )
-         endif
+C     Next 5 lines added by M. Riener
+      pdf_name = 'arm_pdf'
+      if ( lu_out .ge.7 ) then
+         call output_pdf ( lu_out, pdf_name, src, num_bins,
+     +                     dist_bins, prob_arm )
+      endif
 
-c        Galactic latitude (bee) proper motion distance pdf...
-         call condition_pdf (num_bins, bin_size, P_max_PM,
-     +                       prob_Dpm_bee)
-         pdf_name = 'pm_bee_distance_pdf'
-         if ( lu_out .ge.7 ) then
-            call output_pdf ( lu_out, pdf_name, src, num_bins,
-     +                        dist_bins, prob_Dpm_bee )
-         endif
+c     Latitude distance pdf...
+      call condition_pdf (num_bins, bin_size, P_max_GL, prob_lat)
 
-c        Combine probabilities for arm+latitude, Dk, and PMs ...
-c        to make a "Milky Way" model based pdf
-         do n_ps = 1, num_bins
-            prob_MWmodel(n_ps) = 0.d0
-            if ( prob_armlat(n_ps)  .gt.1.d-09 .and.
-     +           prob_Dk(n_ps)      .gt.1.d-09 .and.
-     +           prob_Dpm_ell(n_ps) .gt.1.d-09 .and.
-     +           prob_Dpm_bee(n_ps) .gt.1.d-09       ) then
-
-               prob_MWmodel(n_ps) = prob_armlat(n_ps)*prob_Dk(n_ps)*
-     +                         prob_Dpm_ell(n_ps)*prob_Dpm_bee(n_ps)
-            endif
-         enddo
+C     Next 5 lines added by M. Riener
+      pdf_name = 'latitude_pdf'
+      if ( lu_out .ge.7 ) then
+         call output_pdf ( lu_out, pdf_name, src, num_bins,
+     +                     dist_bins, prob_lat )
+      endif
 
-c        Normalize this pdf
-         P_max = 1.d0
-         call condition_pdf(num_bins, bin_size, P_max, prob_MWmodel)
+c     Combine spiral arm pdf and latitude pdf...
+      do n_b = 1, num_bins
+         prob_armlat(n_b) = prob_arm(n_b) * prob_lat(n_b)
+      enddo
+C      call condition_pdf (num_bins, bin_size, P_max, prob_armlat)
+
+C     Next 8 lines added by M. Riener
+      if ( P_max_SA.eq.0.d0 ) then
+C         P_max_GL = P_max_GL / 2.d0
+         prob_armlat = prob_lat
+         call condition_pdf (num_bins, bin_size, P_max_GL,
+     +                       prob_armlat)
+      else
+         call condition_pdf (num_bins, bin_size, P_max,
+     +                       prob_armlat)
+      endif
 
-c        Combine the Milky Way and parallax source pdfs...
-         do n_ps = 1, num_bins
-            prob_dist(n_ps) = 0.d0
-            if ( dist_prior(n_ps)  .gt.1.d-09 .and.
-     +           prob_MWmodel(n_ps).gt.1.d-09       ) then
-               p_dist          = dist_prior(n_ps)*prob_MWmodel(n_ps)
-               prob_dist(n_ps) = p_dist      ! combined PDF for parallax bin
-            endif
-         enddo
+      pdf_name = 'arm_latitude_pdf'
+      if ( lu_out .ge.7 ) then
+         call output_arm_pdf ( lu_out, pdf_name, src, num_bins,
+     +                         dist_bins, prob_armlat, arm_max_bin )
+      endif
+
+c     Galactic longitude (ell) proper motion distance pdf...
+      call condition_pdf (num_bins, bin_size, P_max_PM,
+     +                    prob_Dpm_ell)
+      pdf_name = 'pm_ell_distance_pdf'
+      if ( lu_out .ge.7 ) then
+         call output_pdf ( lu_out, pdf_name, src, num_bins,
+     +                     dist_bins, prob_Dpm_ell )
+      endif
+
+c     Galactic latitude (bee) proper motion distance pdf...
+      call condition_pdf (num_bins, bin_size, P_max_PM,
+     +                    prob_Dpm_bee)
+      pdf_name = 'pm_bee_distance_pdf'
+      if ( lu_out .ge.7 ) then
+         call output_pdf ( lu_out, pdf_name, src, num_bins,
+     +                     dist_bins, prob_Dpm_bee )
+      endif
+
+c     Kinematic distance pdf (the only pdf that depends on far_prob)...
+ 100  call condition_pdf (num_bins, bin_size, P_max_KD, prob_Dk)
+      pdf_name = 'kinematic_distance_pdf'
+      if ( lu_out .ge.7 ) then
+         call output_pdf ( lu_out, pdf_name, src, num_bins,
+     +                     dist_bins, prob_Dk )
+      endif
+
+c     Combine probabilities for arm+latitude, Dk, and PMs ...
+c     to make a "Milky Way" model based pdf
+      do n_ps = 1, num_bins
+         prob_MWmodel(n_ps) = 0.d0
+         if ( prob_armlat(n_ps)  .gt.1.d-09 .and.
+     +        prob_Dk(n_ps)      .gt.1.d-09 .and.
+     +        prob_Dpm_ell(n_ps) .gt.1.d-09 .and.
+     +        prob_Dpm_bee(n_ps) .gt.1.d-09       ) then
+
+            prob_MWmodel(n_ps) = prob_armlat(n_ps)*prob_Dk(n_ps)*
+     +                      prob_Dpm_ell(n_ps)*prob_Dpm_bee(n_ps)
+         endif
+      enddo
+
+c     Normalize this pdf
+      P_max = 1.d0
+      call condition_pdf(num_bins, bin_size, P_max, prob_MWmodel)
 
-c        Normalize
-         P_max = 1.d0
-         call condition_pdf (num_bins, bin_size, P_max, prob_dist)
-         pdf_name = 'final_distance_pdf'
-         if ( lu_out .ge.7 ) then
-            call output_pdf ( lu_out, pdf_name, src, num_bins,
-     +                        dist_bins, prob_dist )
+c     Combine the Milky Way and parallax source pdfs...
+      do n_ps = 1, num_bins
+         prob_dist(n_ps) = 0.d0
+         if ( dist_prior(n_ps)  .gt.1.d-09 .and.
+     +        prob_MWmodel(n_ps).gt.1.d-09       ) then
+            p_dist          = dist_prior(n_ps)*prob_MWmodel(n_ps)
+            prob_dist(n_ps) = p_dist      ! combined PDF for parallax bin
          endif
+      enddo
+
+c     Normalize
+      P_max = 1.d0
+      call condition_pdf (num_bins, bin_size, P_max, prob_dist)
+      pdf_name = 'final_distance_pdf'
+      if ( lu_out .ge.7 ) then
+         call output_pdf ( lu_out, pdf_name, src, num_bins,
+     +                     dist_bins, prob_dist )
+      endif
 
-c        Finished generating PDFs!
-c        ---------------------------------------------------------------------
-c        Now start to analyze the probability information...
-c        First, print out PDF information
+c     Finished generating PDFs!
+c     ---------------------------------------------------------------------
+c     Now start to analyze the probability information...
+c     First, print out PDF information
+      if ( lu_srcprt .gt. 0 ) then
          do n_ps = 1, num_bins
             if ( prob_dist(n_ps) .gt. 0.5d-05 ) then
                write (lu_srcprt,2000) dist_bins(n_ps),
@@ -701,178 +913,219 @@ c        First, print out PDF information
  2000          format(f7.3,3f10.5,8x,a3)
             endif
          enddo
+      endif
 
-c        Find combined pdf peak(s)...to be used for initial values for fitting
-c        individual distance components
-         call find_probability_peaks(lu_srcprt, max_num_peaks,
-     +                bin_size, num_bins, dist_bins, prob_dist,
-     +                num_peaks, peak_prob,
-     +                peaks, peaks_width)
+c     Find combined pdf peak(s)...to be used for initial values for fitting
+c     individual distance components
+      call find_probability_peaks(lu_srcprt, max_num_peaks,
+     +             bin_size, num_bins, dist_bins, prob_dist,
+     +             num_peaks, peak_prob,
+     +             peaks, peaks_width)
 
-         call edit_peaks ( num_peaks,
-     +                     peak_prob, peaks, peaks_width,
-     +                     use_peak )
+      call edit_peaks ( num_peaks,
+     +                  peak_prob, peaks, peaks_width,
+     +                  use_peak )
 
+      if ( lu_srcprt .gt. 0 ) then
          write (lu_srcprt,3000)
  3000    format(/'  Peak  Distance     +/-    Use?')
          if ( num_peaks .gt. 0 )
      +      write (lu_srcprt,3100) (n, peaks(n), peaks_width(n),
      +                              use_peak(n), n=1,num_peaks)
  3100       format(i5,2f10.2,5x,l1)
+      endif
 
-c        Initialize parameter info...
-         do i = 1, max_num_params
-            params(i)   = 0.d0
-            paramids(i) = 0
-         enddo
+c     Initialize parameter info...
+      do i = 1, max_num_params
+         params(i)   = 0.d0
+         paramids(i) = 0
+      enddo
 
-c        Include a flat "background" (baseline) when fitting
-         params(1)   = 0.0d0                  ! baseline offset
-         paramids(1) = 1
-         params(2)   = 0.0d0                  ! baseline slope
-         paramids(2) = 0
+c     Include a flat "background" (baseline) when fitting
+      params(1)   = 0.0d0                  ! baseline offset
+      paramids(1) = 1
+      params(2)   = 0.0d0                  ! baseline slope
+      paramids(2) = 0
 
-c        Fit multiple Gaussians to probability vs distance data,
-c        provided there is at least one recognizable peak in the PDF
-         if ( num_peaks .ge. 1 ) then
+c     Fit multiple Gaussians to probability vs distance data,
+c     provided there is at least one recognizable peak in the PDF
+      if ( num_peaks .ge. 1 ) then
 
-c           First, put initial guesses into parameters array
-            index  = 2
-            do j_p = 1, num_peaks
+c        First, put initial guesses into parameters array
+         index  = 2
+         do j_p = 1, num_peaks
 
-               index = index + 1
-               params(index) = peak_prob(j_p)   ! amplitude (1/kpc)
-               paramids(index) = 0
-               if ( use_peak(j_p) ) paramids(index) = 1
+            index = index + 1
+            params(index) = peak_prob(j_p)   ! amplitude (1/kpc)
+            paramids(index) = 0
+            if ( use_peak(j_p) ) paramids(index) = 1
 
-               index = index + 1
-               params(index) = peaks(j_p)       ! center (kpc)
-               paramids(index) = 0
-               if ( use_peak(j_p) ) paramids(index) = 1
+            index = index + 1
+            params(index) = peaks(j_p)       ! center (kpc)
+            paramids(index) = 0
+            if ( use_peak(j_p) ) paramids(index) = 1
 
-               index = index + 1
-c              convert from 1-sigma to FWHM...
-               params(index) = 2.3548d0*peaks_width(j_p) ! FWHM (kpc)
-               paramids(index) = 0
-               if ( use_peak(j_p) ) paramids(index) = 1
+            index = index + 1
+c           convert from 1-sigma to FWHM...
+            params(index) = 2.3548d0*peaks_width(j_p) ! FWHM (kpc)
+            paramids(index) = 0
+            if ( use_peak(j_p) ) paramids(index) = 1
 
-            enddo
-            num_params = index
+         enddo
+         num_params = index
 
-            call encode_parnames ( num_peaks, parnames )
+         call encode_parnames ( num_peaks, parnames )
 
-c           But, for sources with very odd (l,b,v) values, don't fit Gaussians;
-c           instead use the initial guesses
-            odd_source = .false.
-            if ( Dk_near.gt.25.d0 ) then
-c              Avoid fitting by setting via "solve-for" flags to zeros
-               do n_p = 1, num_params
-                  paramids(n_p) = 0
-               enddo
-               odd_source = .true.
-            endif
+c        But, for sources with very odd (l,b,v) values, don't fit Gaussians;
+c        instead use the initial guesses
+         odd_source = .false.
+         if ( Dk_near.gt.25.d0 ) then
+c           Avoid fitting by setting via "solve-for" flags to zeros
+            do n_p = 1, num_params
+               paramids(n_p) = 0
+            enddo
+            odd_source = .true.
+         endif
 
-            call fit_multiple_gaussians ( lu_srcprt,
-     +            num_bins, num_params, parnames,
-     +            params, paramids,
-     +            dist_bins, prob_dist, arm_max_bin,
-     +            peak_dist, peak_dunc, peak_int )
+         call fit_multiple_gaussians ( lu_srcprt,
+     +         num_bins, num_params, parnames,
+     +         params, paramids,
+     +         dist_bins, prob_dist, arm_max_bin,
+     +         peak_dist, peak_dunc, peak_int )
 
-          else
+       else
 
 cc            write (lu_print,3120) src
- 3120       format(' No distance probability peaks found for ',a)
-
-         endif                  ! num_peaks > 0 check
-
-c        ===============================================================
-c        Output to fort.3x depending on arm_assignment
-c        Write separate files by arms for plotting
-
-c        Find two greatest integrated probability peaks
-         p_int_max = 0.d0
-         n_max     = 0
-         if ( num_peaks .ge. 1 ) then
-c           Find greatest integrated probability peak...
+ 3120    format(' No distance probability peaks found for ',a)
+
+      endif                  ! num_peaks > 0 check
+
+c     ===============================================================
+c     Output to fort.3x depending on arm_assignment
+c     Write separate files by arms for plotting
+
+c     Find two greatest integrated probability peaks
+      p_int_max = 0.d0
+      n_max     = 0
+      if ( num_peaks .ge. 1 ) then
+c        Find greatest integrated probability peak...
+         do n_p = 1, num_peaks
+            if ( peak_int(n_p) .gt. p_int_max ) then
+               p_int_max = peak_int(n_p)
+               n_max     = n_p
+            endif
+         enddo
+c        Find second greatest peak...
+         p2_int_max = 0.d0
+         n2_max     = 0
+         if ( num_peaks .ge. 2 ) then
             do n_p = 1, num_peaks
-               if ( peak_int(n_p) .gt. p_int_max ) then
-                  p_int_max = peak_int(n_p)
-                  n_max     = n_p
+               if ( peak_int(n_p).gt.p2_int_max .and.
+     +              n_p.ne.n_max                     ) then
+                  p2_int_max = peak_int(n_p)
+                  n2_max     = n_p
                endif
             enddo
-c           Find second greatest peak...
-            p2_int_max = 0.d0
-            n2_max     = 0
-            if ( num_peaks .ge. 2 ) then
-               do n_p = 1, num_peaks
-                  if ( peak_int(n_p).gt.p2_int_max .and.
-     +                 n_p.ne.n_max                     ) then
-                     p2_int_max = peak_int(n_p)
-                     n2_max     = n_p
-                  endif
-               enddo
-            endif
          endif
+      endif
 
-c        If there is a maximum probability peak, output
-         if ( n_max .gt. 0 ) then
+c     If there is a maximum probability peak, output
+      if ( n_max .gt. 0 ) then
 
-            distance = peak_dist(n_max)
-            call closest_arm ( num_bins, dist_bins, arm_max_bin,
-     +                         distance,
-     +                         arm_indicated )
+         distance = peak_dist(n_max)
+         call closest_arm ( num_bins, dist_bins, arm_max_bin,
+     +                      distance,
+     +                      arm_indicated )
 
-            lu_arm = 30                                ! unassigned arm
-            do i_a = 1, num_arms
-               if (arm_indicated .eq. arm_name(i_a)) lu_arm=30+i_a
-            enddo
+         lu_arm = 30                                ! unassigned arm
+         do i_a = 1, num_arms
+            if (arm_indicated .eq. arm_name(i_a)) lu_arm=30+i_a
+         enddo
 
-c           Flag if we didn't fit Gaussians...
-            questionable = ' '
-            if ( sum_arm_probs .lt. 0.1d0 ) questionable = '? '
-            if ( odd_source )               questionable = '??'
-
-c           Write out results in several files...
-            write (lu_arm,3200) ell, bee, v_lsr, v_lsr_unc,
-     +          peak_dist(n_max),peak_dunc(n_max),peak_int(n_max),
-     +          arm_indicated,questionable
- 3200       format(2f7.2,f7.1,f5.1,f8.2,f7.2,f8.2,5x,a3,a2)
-
-c           Get 2nd peak information...
-            p2_dist    = 0.d0
-            p2_dunc    = 0.d0
-            p2_arm     = '...'
-            q2         = '  '
-            if ( n2_max .gt. 0 ) then
-               p2_dist = peak_dist(n2_max)
-               p2_dunc = peak_dunc(n2_max)
-               d2 = peak_dist(n2_max)
-               call closest_arm ( num_bins, dist_bins, arm_max_bin,
-     +                            d2,
-     +                            p2_arm )
-               q2 = questionable
-            endif
+c        Flag if we didn't fit Gaussians...
+         questionable = ' '
+         if ( sum_arm_probs .lt. 0.1d0 ) questionable = '? '
+         if ( odd_source )               questionable = '??'
+
+c        Write out results in several files...
+         if ( lu_srcprt .gt. 0 )
+     +      write (lu_arm,3200) ell, bee, v_lsr, v_lsr_unc,
+     +       peak_dist(n_max),peak_dunc(n_max),peak_int(n_max),
+     +       arm_indicated,questionable
+ 3200    format(2f7.2,f7.1,f5.1,f8.2,f7.2,f8.2,5x,a3,a2)
+
+c        Get 2nd peak information...
+         p2_dist    = 0.d0
+         p2_dunc    = 0.d0
+         p2_arm     = '...'
+         q2         = '  '
+         if ( n2_max .gt. 0 ) then
+            p2_dist = peak_dist(n2_max)
+            p2_dunc = peak_dunc(n2_max)
+            d2 = peak_dist(n2_max)
+            call closest_arm ( num_bins, dist_bins, arm_max_bin,
+     +                         d2,
+     +                         p2_arm )
+            q2 = questionable
+         endif
 
 cc            write (lu_print,3210) ell, bee, v_lsr, v_lsr_unc,
 cc     +          peak_dist(n_max),peak_dunc(n_max),peak_int(n_max),
 cc     +          arm_indicated,questionable,
 cc     +          p2_dist, p2_dunc, p2_int_max, p2_arm,q2
- 3210       format(2f7.2,f7.1,f5.1,f8.2,f7.2,f8.2,5x,a3,a2,
-     +                             f8.2,f7.2,f8.2,5x,a3,a2)
-
-            write (lu_summary,3210) ell, bee, v_lsr, v_lsr_unc,
-     +          peak_dist(n_max),peak_dunc(n_max),peak_int(n_max),
-     +          arm_indicated,questionable,
-     +          p2_dist, p2_dunc, p2_int_max, p2_arm,q2
-
-         endif
+ 3210    format(2f7.2,f7.1,f5.1,f8.2,f7.2,f8.2,5x,a3,a2,
+     +                          f8.2,f7.2,f8.2,5x,a3,a2)
+
+         if ( lu_summary .gt. 0 )
+     +      write (lu_summary,3210) ell, bee, v_lsr, v_lsr_unc,
+     +       peak_dist(n_max),peak_dunc(n_max),peak_int(n_max),
+     +       arm_indicated,questionable,
+     +       p2_dist, p2_dunc, p2_int_max, p2_arm,q2
+
+c        Return the summary values of both peaks
+         n_res = 1
+         res_dist(1) = peak_dist(n_max)
+         res_dunc(1) = peak_dunc(n_max)
+         res_int(1)  = peak_int(n_max)
+         res_arm(1)  = arm_indicated
+         res_q(1)    = questionable
+         res_dist(2) = p2_dist
+         res_dunc(2) = p2_dunc
+         res_int(2)  = p2_int_max
+         res_arm(2)  = p2_arm
+         res_q(2)    = q2
 
-         close ( unit=lu_srcprt )
+      endif
 
-       endif          ! "commented-out target" check
+c     No distance peaks with the prior far_prob: start over from the
+c     kinematic distance pdf with a flat prior
+      if ( n_res.eq.0 .and. i_fallback.eq.1 .and.
+     +     far_prob.ne.0.5d0 ) then
+         far_prob = 0.5d0
+         do n_ps = 1, num_bins
+            d_bin = dist_bins(n_ps)
+            call Dk_prob_density ( a1, a2, a3, Ro, To,
+     +           Uo, Vo, Wo, Us, Vs, Ws,
+     +           ell, bee, d_bin, v_lsr,
+     +           Dk_near, Dk_far, far_prob, sig_vel_infl,
+     +           p_Dk )
+            if ( P_max_KD .eq. 0.d0 ) p_Dk = 0.d0
+            prob_Dk(n_ps) = p_Dk
+         enddo
+         goto 100
+      endif
 
-      enddo         ! target loop
+c     Return the component PDFs
+      do n_ps = 1, num_bins
+         pdfs(n_ps,1) = prob_Dk(n_ps)
+         pdfs(n_ps,2) = prob_arm(n_ps)
+         pdfs(n_ps,3) = prob_lat(n_ps)
+         pdfs(n_ps,4) = prob_armlat(n_ps)
+         pdfs(n_ps,5) = dist_prior(n_ps)
+         pdfs(n_ps,6) = prob_dist(n_ps)
+      enddo
 
+      return
       end
 
 c====================================================================
@@ -2870,11 +3123,16 @@ c     character is "!").  Leaves file open, ready to read data.
 
       character*48       ascii_file
       character*80       comment
+      character*256      data_dir
+      character*305      file_path
       character*1        c_1
       equivalence       (c_1, comment)
 
       logical            first_comment
 
+c     Directory of the input files (blank: current working directory)
+      common /bdc_data_dir/ data_dir
+
 c     Open input ascii file...
       first_comment = .true.
       if ( lu_print .gt. 0 ) then
@@ -2882,7 +3140,10 @@ cc         write (lu_print,1000) ascii_file
  1000    format(/' Openning input ascii file "',a32,'"')
       endif
 
-      open (unit=lu_in, file=ascii_file, status='old')
+      file_path = ascii_file
+      if ( data_dir .ne. ' ' )
+     +   file_path = trim(data_dir)//'/'//ascii_file
+      open (unit=lu_in, file=file_path, status='old')
 
 c     Read all comment lines (but stop at data)
       if ( lu_print .gt. 0 ) then
@@ -4072,7 +4333,7 @@ c     Arm information arrays
       integer       iarm_entries(29)
 
       character*48  arm_file
-      character*12  a_name, arm_name(29)
+      character*12  arm_name(29)
       character*1   c1
 
 c     Spiral arm segment names; used to point to (lbvRBD) files
@@ -4114,21 +4375,6 @@ c     Spiral arm segment names; used to point to (lbvRBD) files
       arm_name(23)= 'LoS'         ! Local spur
 
 
-c     Open files (for each arm) used for plotting and document with comment line
-      lu = 30
-      a_name = 'Unk'
-      write (30,1010) lu, a_name
-      do n_a = 1, num_arms
-         lu = 30 + n_a
-         write (lu,1010) lu, arm_name(n_a)
- 1010    format('! File fort.',i2,' for spiral arm segment "',a3,'"',
-     +         /'! Long.   Lat.   Vlsr  +/-    Dist.  +/-  ',
-     +          'Integrated  Arm',
-     +         /'! (deg)  (deg)  (km/s)        (kpc)       ',
-     +          'Probability')
-
-      enddo
-
 c    ----------------------------------------------------------
 c               Read in spiral arm (l,b,v,R,beta,d) information
 cc      write (lu_print,1014)
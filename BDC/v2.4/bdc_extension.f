@@ -0,0 +1,120 @@
+c     Entry points of the Python extension module of the Bayesian distance
+c     calculator.  The module is built with f2py from this file and the
+c     subroutines of Bayesian_distance_2019_fromlist_v2.4.f (without its
+c     main program), so sources can be processed from Python without any
+c     input/output files.
+
+c     Usage (Python):
+c        bdc_init(data_dir)
+c        ell, bee, n_kd, dk_kd, n_res, res_dist, res_dunc, res_int,
+c        res_arm, res_q, pdfs, pfar_used = bdc_batch(ell, bee, vlsr,
+c                                         vlsr_unc, pfar, p_max_sa,
+c                                         p_max_kd, p_max_gl, p_max_ps,
+c                                         p_max_pm, nb, fallback)
+
+c======================================================================
+
+      subroutine bdc_init ( data_dir_in )
+
+c     Reads in the Galaxy model, spiral arm and parallax data from the
+c     input files in directory data_dir_in.  Has to be called before
+c     bdc_batch.
+
+      character*(*) data_dir_in
+
+Cf2py intent(in) data_dir_in
+
+c     Directory of the input files (see open_ascii_file)
+      character*256 data_dir
+      common /bdc_data_dir/ data_dir
+
+      lu_noprint = -1
+      lu_data    = 8
+      lu_control = 9
+
+      data_dir = data_dir_in
+      call load_bdc_model ( lu_data, lu_control, lu_noprint )
+
+      return
+      end
+
+c======================================================================
+
+      subroutine bdc_batch ( n, ell_in, bee_in, vlsr, vlsr_unc, pfar,
+     +                       P_max_SA, P_max_KD, P_max_GL, P_max_PS,
+     +                       P_max_PM, nb, i_fallback, ell, bee,
+     +                       n_kd, Dk_kd, n_res, res_dist, res_dunc,
+     +                       res_int, res_arm, res_q, pdfs, pfar_used )
+
+c     Calculates the distance PDFs of n sources with calc_source_distance
+c     and returns the kinematic distances and the summary values of the
+c     first and second peak of each source.  The component PDFs are only
+c     returned if nb = 1001 (number of distance bins); pass nb = 1 if they
+c     are not needed.  With i_fallback = 1, sources without distance
+c     peaks for their prior pfar are recalculated with pfar = 0.5 within
+c     the same evaluation; pfar_used returns the prior of the results.
+
+      implicit real*8 (a-h,o-z)
+
+      real*8        ell_in(n), bee_in(n), vlsr(n), vlsr_unc(n), pfar(n)
+      real*8        pfar_used(n)
+      real*8        ell(n), bee(n), Dk_kd(n,2)
+      real*8        res_dist(n,2), res_dunc(n,2), res_int(n,2)
+      real*8        pdfs(n,6,nb)
+      integer       n_kd(n), n_res(n)
+      character*12  res_arm(n,2)
+      character*2   res_q(n,2)
+
+Cf2py intent(in) ell_in, bee_in, vlsr, vlsr_unc, pfar
+Cf2py intent(in) P_max_SA, P_max_KD, P_max_GL, P_max_PS, P_max_PM, nb
+Cf2py intent(in) i_fallback
+Cf2py intent(hide), depend(ell_in) :: n = len(ell_in)
+Cf2py intent(out) ell, bee, n_kd, Dk_kd, n_res, res_dist, res_dunc
+Cf2py intent(out) res_int, res_arm, res_q, pdfs, pfar_used
+Cf2py depend(n) ell, bee, n_kd, Dk_kd, n_res, res_dist, res_dunc
+Cf2py depend(n) res_int, res_arm, res_q, pfar_used
+Cf2py depend(n,nb) pdfs
+
+      character*14  src
+      character*12  src_arm(2)
+      character*2   src_q(2)
+      real*8        src_Dk(2), src_dist(2), src_dunc(2), src_int(2)
+      real*8        src_pdfs(1001,6)
+
+c     No print out, summary, kinematic distance or PDF files
+      lu_noprint = -1
+      src        = ' '
+
+      do i = 1, n
+
+         far_prob = pfar(i)
+         call calc_source_distance ( lu_noprint, lu_noprint,
+     +            lu_noprint, lu_noprint,
+     +            P_max_SA, P_max_KD, P_max_GL, P_max_PS, P_max_PM,
+     +            src, ell_in(i), bee_in(i), vlsr(i), vlsr_unc(i),
+     +            far_prob, i_fallback, ell(i), bee(i), n_kd(i), src_Dk,
+     +            n_res(i), src_dist, src_dunc, src_int, src_arm, src_q,
+     +            src_pdfs )
+         pfar_used(i) = far_prob
+
+         do k = 1, 2
+            Dk_kd(i,k)    = src_Dk(k)
+            res_dist(i,k) = src_dist(k)
+            res_dunc(i,k) = src_dunc(k)
+            res_int(i,k)  = src_int(k)
+            res_arm(i,k)  = src_arm(k)
+            res_q(i,k)    = src_q(k)
+         enddo
+
+         if ( nb .eq. 1001 ) then
+            do m = 1, 6
+               do n_b = 1, nb
+                  pdfs(i,m,n_b) = src_pdfs(n_b,m)
+               enddo
+            enddo
+         endif
+
+      enddo
+
+      return
+      end
@@ -1,103 +1,439 @@
+import collections
+import hashlib
 import multiprocessing
+import os
 import signal
-import sys
+import socket
+import threading
+import time
 import numpy as np
 from tqdm import tqdm
-from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 
 from BD_wrapper.BD_wrapper import BayesianDistance
+from BD_wrapper.bdc_queue import MAX_ATTEMPTS, POLL_INTERVAL, WorkQueue
+from BD_wrapper.bdc_report import RunReport
 
-#  With Python 3.8 the start method for multiprocessing defaults to 'spawn' for
-#  MacOS systems. Here we change it back to 'fork' for compatibility reasons.
-if sys.version_info[:2] >= (3, 8):
-    multiprocessing.set_start_method('fork', force=True)
+#  number of submitted tasks per worker process whose results have not been
+#  yielded yet
+TASKS_PER_WORKER = 4
+#  number of consecutive exits of the local work queue workers of a slot
+#  without a completed range, after which the coordinator gives up
+MAX_RESTARTS = 3
 
+#  BayesianDistance object of a worker process; the threads of the 'threads'
+#  backend have their own copies in `thread_data`
+bd_object = None
+thread_data = threading.local()
 
-def init_worker():
-    """ Worker initializer to ignore Keyboard interrupt """
+
+def init_worker(config=None):
+    """ Worker initializer to ignore Keyboard interrupt and to recreate the
+    BayesianDistance object from its settings """
+    global bd_object
     signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if config is not None:
+        bd_object = BayesianDistance()
+        bd_object.initialize_worker(config)
 
 
-def init(bd_list):
-    global ilist, bd_object, bd_data
-    bd_object, bd_data = bd_list
-    ilist = np.arange(len(bd_data))
+def get_bd_object():
+    """BayesianDistance object of the current worker process or thread."""
+    return getattr(thread_data, 'bd_object', bd_object)
 
 
-def determine_distance(i):
-    result = BayesianDistance.determine(bd_object, bd_data[i], i)
-    return result
+def determine_distance_rows(rows, indices, priors=None):
+    """ Results of the rows and the run report of the worker for the task (None if the run is not instrumented) """
+    result = BayesianDistance.determine_chunk(
+        get_bd_object(), rows, indices, priors)
+    return result, get_bd_object().pop_stats()
 
 
-def get_cartesian_coords(i):
-    result = BayesianDistance.get_cartesian_coords(bd_object, bd_data[i])
+def evaluate_grid_nodes(nodes):
+    result = BayesianDistance.evaluate_grid_nodes(get_bd_object(), nodes)
     return result
 
 
-def parallel_process(array, function, n_jobs=16, use_kwargs=False, front_num=3):
+def get_executor(bd, use_ncpus):
     """
-        A parallel version of the map function with a progress bar.
+        Pool of worker processes or threads for the tasks of `schedule`.
+
+        The worker processes recreate the object from the settings of `bd` and load its tables themselves (see
+        `init_worker`). For the 'threads' backend, each thread gets a copy of `bd` that shares its tables but opens
+        its own BDC daemon, scratch directory, PDF output and results cache.
 
-        Args:
-            array (array-like): An array to iterate over.
-            function (function): A python function to apply to the elements of array
-            n_jobs (int, default=16): The number of cores to use
-            use_kwargs (boolean, default=False): Whether to consider the elements of array as dictionaries of
-                keyword arguments to function
-            front_num (int, default=3): The number of iterations to run serially before kicking off the parallel job.
-                Useful for catching bugs
         Returns:
-            [function(array[0]), function(array[1]), ...]
+            The executor and the list of the copies of `bd` made by its threads
     """
-    #We run the first few iterations serially to catch bugs
-    if front_num > 0:
-        front = [function(**a) if use_kwargs else function(a) for a in array[:front_num]]
-    #If we set n_jobs to 1, just run a list comprehension. This is useful for benchmarking and debugging.
-    if n_jobs==1:
-        return front + [function(**a) if use_kwargs else function(a) for a in tqdm(array[front_num:])]
-    #Assemble the workers
-    with ProcessPoolExecutor(max_workers=n_jobs) as pool:
-        #Pass the elements of array into function
-        if use_kwargs:
-            futures = [pool.submit(function, **a) for a in array[front_num:]]
-        else:
-            futures = [pool.submit(function, a) for a in array[front_num:]]
-        kwargs = {
-            'total': len(futures),
-            'unit': 'it',
-            'unit_scale': True,
-            'leave': True
-        }
-        #Print out the progress as tasks complete
-        for f in tqdm(as_completed(futures), **kwargs):
-            pass
-    out = []
-    #Get the results from the futures.
-    for i, future in tqdm(enumerate(futures)):
-        try:
-            out.append(future.result())
-        except Exception as e:
-            out.append(e)
-    return front + out
+    if bd.backend == 'threads':
+        copies = []
+        config, resources = bd.get_worker_config(), bd.get_worker_resources()
+
+        def init_thread():
+            thread_data.bd_object = BayesianDistance()
+            thread_data.bd_object.initialize_worker(config, resources)
+            copies.append(thread_data.bd_object)
+
+        return ThreadPoolExecutor(max_workers=use_ncpus,
+                                  initializer=init_thread), copies
 
+    mp_context = None
+    if bd.start_method is not None:
+        mp_context = multiprocessing.get_context(bd.start_method)
+    return ProcessPoolExecutor(max_workers=use_ncpus, mp_context=mp_context,
+                               initializer=init_worker,
+                               initargs=(bd.get_worker_config(), )), []
 
-def func(task='determine_distance', use_ncpus=None):
-    # Multiprocessing code
+
+def get_use_ncpus(use_ncpus=None):
     ncpus = multiprocessing.cpu_count()
-    # p = multiprocessing.Pool(ncpus, init_worker)
     if use_ncpus is None:
         use_ncpus = int(0.75 * ncpus)
+    use_ncpus = max(1, use_ncpus)
     print('Using {} of {} cpus'.format(use_ncpus, ncpus))
+    return use_ncpus
+
+
+def schedule(bd, function, tasks, use_ncpus=None, max_pending=None,
+             total=None):
+    """
+        Apply a function to a stream of tasks in worker processes, yielding the results in the order of the tasks.
+
+        The tasks are only taken from `tasks` when they can be submitted, and at most `max_pending` tasks are
+        submitted and not yet yielded at any time, so the memory and scheduling overhead do not depend on the total
+        number of tasks. The worker processes receive the settings of `bd` once (see
+        `BayesianDistance.get_worker_config`) instead of inheriting the whole object, so any multiprocessing start
+        method ('fork', 'spawn' or 'forkserver') can be used. With `bd.backend = 'threads'`, the tasks are processed
+        by a pool of threads instead (see `get_executor`).
+
+        Args:
+            bd (BayesianDistance): The object whose settings are used by the worker processes
+            function (function): A function of this module that is applied to the arguments of each task
+            tasks (iterable): A key and a tuple of arguments for each task
+            use_ncpus (int, default=None): The number of cores to use; 75% of all cores by default. For a single
+                core, the tasks are processed in the main process, which is useful for benchmarking and debugging
+            max_pending (int, default=None): The maximum number of submitted tasks whose results have not been
+                yielded yet; TASKS_PER_WORKER per worker process by default
+            total (int, default=None): The number of tasks, for the progress bar
+        Yields:
+            The key and result of each task; the result is the exception if the task failed
+    """
+    global bd_object
+    use_ncpus = get_use_ncpus(use_ncpus)
+    kwargs = {
+        'total': total,
+        'unit': 'it',
+        'unit_scale': True,
+        'leave': True
+    }
     try:
-        if task is 'determine_distance':
-            results_list = parallel_process(ilist, determine_distance,
-                                            n_jobs=use_ncpus)
-            # results_list = p.map(determine_distance, tqdm(ilist))
-        elif task is 'get_cartesian_coords':
-            results_list = parallel_process(ilist, get_cartesian_coords,
-                                            n_jobs=use_ncpus)
-            # results_list = p.map(get_cartesian_coords, tqdm(ilist))
+        if use_ncpus == 1:
+            bd_object = bd
+            for key, args in tqdm(tasks, **kwargs):
+                try:
+                    result = function(*args)
+                except Exception as e:
+                    result = e
+                yield key, result
+            return
+
+        if max_pending is None:
+            max_pending = TASKS_PER_WORKER * use_ncpus
+        max_pending = max(use_ncpus, max_pending)
+
+        pending = collections.deque()
+        tasks = iter(tasks)
+        executor, copies = get_executor(bd, use_ncpus)
+        try:
+            with executor as pool, tqdm(**kwargs) as progress:
+                while True:
+                    for key, args in tasks:
+                        try:
+                            future = pool.submit(function, *args)
+                        except BrokenProcessPool as e:
+                            future = Future()
+                            future.set_exception(e)
+                        pending.append((key, future))
+                        if len(pending) >= max_pending:
+                            break
+                    if not pending:
+                        break
+                    key, future = pending.popleft()
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        result = e
+                    progress.update()
+                    yield key, result
+        finally:
+            #  the copies of the threads are closed once all threads are done
+            for worker in copies:
+                worker.close_resources()
     except KeyboardInterrupt:
         print("KeyboardInterrupt... quitting.")
         quit()
-    return results_list
+
+
+def determine_distances(bd, table, indices, chunk_size=1, use_ncpus=None):
+    """
+        Determine the distances of rows of a table in chunks of contiguous indices.
+
+        Args:
+            bd (BayesianDistance): The object determining the distances
+            table (astropy.table.Table): The input table
+            indices (list): The indices of the rows that are processed
+            chunk_size (int, default=1): The number of rows per task
+            use_ncpus (int, default=None): The number of cores to use
+        Yields:
+            The indices of each chunk and the results of its rows, in the order of `indices`
+    """
+    chunk_size = max(1, int(chunk_size))
+
+    def tasks():
+        for k in range(0, len(indices), chunk_size):
+            chunk = [int(idx) for idx in indices[k:k + chunk_size]]
+            yield chunk, ([list(table[idx]) for idx in chunk], chunk,
+                          bd.get_kda_priors(chunk))
+
+    for chunk, result in schedule(
+            bd, determine_distance_rows, tasks(), use_ncpus=use_ncpus,
+            total=-(-len(indices) // chunk_size)):
+        if isinstance(result, tuple):
+            result, stats = result
+            bd.merge_stats(stats)
+        else:
+            result = len(chunk) * [result]
+        yield chunk, result
+
+
+def evaluate_grid(bd, nodes, chunk_size=1000, use_ncpus=None):
+    """
+        Evaluate the BDC for the nodes of the BDC grid.
+
+        Args:
+            bd (BayesianDistance): The object evaluating the BDC
+            nodes (numpy.ndarray): The (l, b, v) values of the grid nodes
+            chunk_size (int, default=1000): The number of nodes per task
+            use_ncpus (int, default=None): The number of cores to use
+        Returns:
+            The results of each chunk of nodes (see `BayesianDistance.evaluate_grid_nodes`)
+    """
+    tasks = ((k, (nodes[k:k + chunk_size], ))
+             for k in range(0, len(nodes), chunk_size))
+    return [result for k, result in schedule(
+        bd, evaluate_grid_nodes, tasks, use_ncpus=use_ncpus,
+        total=-(-len(nodes) // chunk_size))]
+
+
+def stream(bd, chunks, chunk_size=1, use_ncpus=None, max_pending=None):
+    """
+        Determine the distances of a stream of table chunks.
+
+        The literature KDA priors of the rows of each chunk are determined in one pass (see
+        `BayesianDistance.determine_kda_priors`) before its tasks are submitted.
+
+        Args:
+            bd (BayesianDistance): The object determining the distances
+            chunks (iterable): Index of the first row and rows of each chunk
+            chunk_size (int, default=1): The number of rows per task
+            use_ncpus (int, default=None): The number of cores to use
+            max_pending (int, default=None): The maximum number of submitted tasks whose results have not been
+                yielded yet; the next chunk is only read once its tasks can be submitted
+        Yields:
+            The index of the first row of each chunk and the list of results of its rows, in the order of the chunks
+    """
+    chunk_size = max(1, int(chunk_size))
+
+    def tasks():
+        for offset, chunk in chunks:
+            rows = [list(row) for row in chunk]
+            priors = bd.determine_kda_priors(chunk)
+            for k in range(0, len(rows), chunk_size):
+                indices = list(range(offset + k, offset + min(
+                    k + chunk_size, len(rows))))
+                last = k + chunk_size >= len(rows)
+                yield (offset, len(indices), last), (
+                    rows[k:k + chunk_size], indices,
+                    None if priors is None else priors[k:k + chunk_size])
+
+    results = []
+    for (offset, n_sources, last), result in schedule(
+            bd, determine_distance_rows, tasks(), use_ncpus=use_ncpus,
+            max_pending=max_pending):
+        if isinstance(result, tuple):
+            result, stats = result
+            bd.merge_stats(stats)
+        else:
+            result = n_sources * [result]
+        results.extend(result)
+        if last:
+            yield offset, results
+            results = []
+
+
+def determine_distances_queue(bd, table, indices, chunk_size=1000,
+                              use_ncpus=None):
+    """
+        Determine the distances of rows of a table via the work queue `bd.path_to_work_queue`.
+
+        The rows are put into the queue in ranges of `chunk_size` rows, which are processed by local worker processes
+        and any number of workers on other hosts (see `run_queue_worker`). If the queue already contains the ranges of
+        the same run, e.g. because the coordinator was interrupted, the completed ranges are reused. Local workers
+        that exit before the queue is finished are restarted; if the workers of a slot exit `MAX_RESTARTS` times in a
+        row without any range being completed in the meantime (e.g. because they fail to start), an exception with
+        their exit code is raised.
+
+        Args:
+            bd (BayesianDistance): The object determining the distances
+            table (astropy.table.Table): The input table
+            indices (list): The indices of the rows that are processed
+            chunk_size (int, default=1000): The number of rows per range
+            use_ncpus (int, default=None): The number of local worker processes; no local workers are started for 0
+        Yields:
+            The indices of each range and the results of its rows, in the order of `indices`
+    """
+    chunk_size = max(1, int(chunk_size))
+    ranges = range(0, len(indices), chunk_size)
+
+    def payloads():
+        for k in ranges:
+            chunk = [int(idx) for idx in indices[k:k + chunk_size]]
+            yield [list(table[idx]) for idx in chunk], chunk, bd.get_kda_priors(
+                chunk)
+
+    queue = WorkQueue(bd.path_to_work_queue)
+    meta = {'run': bd.get_checkpoint_meta(), 'chunk_size': chunk_size,
+            'indices': hashlib.sha256(np.asarray(
+                indices, dtype='int64').tobytes()).hexdigest()}
+    if queue.get_meta() == meta:
+        bd.say("resuming work queue '{}' ({} of {} ranges completed)".format(
+            bd.path_to_work_queue, queue.counts()['done'], len(ranges)))
+    else:
+        queue.create(meta, {'config': bd.get_worker_config(),
+                            'lease': float(bd.work_queue_lease)}, payloads())
+
+    if use_ncpus != 0:
+        use_ncpus = get_use_ncpus(use_ncpus)
+    mp_context = multiprocessing.get_context(bd.start_method)
+    workers = [None] * use_ncpus
+    #  consecutive exits of the workers of each slot without progress, and the
+    #  number of completed ranges when the current worker was started
+    n_exits = [0] * use_ncpus
+    n_done = [0] * use_ncpus
+
+    def start_worker(n):
+        worker = workers[n]
+        if worker is not None:
+            done = queue.counts()['done']
+            n_exits[n] = 0 if done > n_done[n] else n_exits[n] + 1
+            if n_exits[n] >= MAX_RESTARTS:
+                raise Exception(
+                    "Work queue worker exited with code {} {} times in a row "
+                    "without completing a range".format(
+                        worker.exitcode, n_exits[n]))
+        n_done[n] = queue.counts()['done']
+        workers[n] = mp_context.Process(
+            target=run_queue_worker, args=(bd.path_to_work_queue, ))
+        workers[n].start()
+
+    def failed(payload):
+        error = Exception("Range of rows was given up after {} expired "
+                          "leases".format(MAX_ATTEMPTS))
+        return len(payload[1]) * [error], None
+
+    try:
+        with tqdm(total=len(ranges), unit='it', unit_scale=True,
+                  leave=True) as progress:
+            for task_id, k in enumerate(ranges):
+                result = queue.get_result(task_id)
+                while result is None:
+                    queue.give_up(failed)
+                    for n, worker in enumerate(workers):
+                        if (worker is None) or (worker.exitcode is not None):
+                            start_worker(n)
+                    time.sleep(POLL_INTERVAL)
+                    result = queue.get_result(task_id)
+                result, stats = result
+                bd.merge_stats(stats)
+                progress.update()
+                yield [int(idx) for idx in indices[k:k + chunk_size]], result
+    except KeyboardInterrupt:
+        print("KeyboardInterrupt... quitting.")
+        quit()
+    finally:
+        for worker in workers:
+            if worker is not None:
+                if not queue.finished():
+                    worker.terminate()
+                worker.join()
+        queue.close()
+
+
+def run_queue_worker(path_to_queue, worker_id=None):
+    """
+        Process ranges of rows from a work queue until all of them are completed.
+
+        The worker recreates the BayesianDistance object from the settings stored in the queue by the coordinator, so
+        the paths of the BDC files, tables and caches in the settings have to be accessible from the host of the
+        worker. If the queue was not created or filled yet, the worker waits for it.
+
+        Args:
+            path_to_queue (str): Path to the work queue
+            worker_id (str, default=None): Name of the worker in the queue; the host name and process ID by default
+    """
+    global bd_object
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    if worker_id is None:
+        worker_id = '{}:{}'.format(socket.gethostname(), os.getpid())
+    #  the queue file is created by the coordinator, so that a worker started
+    #  too early does not create an empty queue
+    while not os.path.exists(path_to_queue):
+        time.sleep(POLL_INTERVAL)
+    queue = WorkQueue(path_to_queue)
+    settings = queue.get_settings()
+    while settings is None:
+        time.sleep(POLL_INTERVAL)
+        settings = queue.get_settings()
+    bd_object = BayesianDistance()
+    bd_object.initialize_worker(settings['config'])
+    chunk_size = max(1, int(bd_object.bdc_chunk_size))
+
+    try:
+        while True:
+            task = queue.lease(worker_id, settings['lease'])
+            if task is None:
+                if queue.finished():
+                    break
+                time.sleep(POLL_INTERVAL)
+                continue
+            task_id, (rows, indices, priors) = task
+            results = []
+            stats = RunReport() if bd_object.use_instrumentation() else None
+            for k in range(0, len(rows), chunk_size):
+                try:
+                    result, chunk_stats = determine_distance_rows(
+                        rows[k:k + chunk_size], indices[k:k + chunk_size],
+                        None if priors is None else priors[k:k + chunk_size])
+                    if stats is not None:
+                        stats.merge(chunk_stats)
+                except Exception as e:
+                    result = len(indices[k:k + chunk_size]) * [e]
+                results.extend(result)
+                queue.renew(task_id, worker_id, settings['lease'])
+            #  the results are stored with the run report of the range
+            queue.complete(task_id, worker_id, (results, stats))
+    finally:
+        bd_object.close_resources()
+        queue.close()
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(
+        description='Worker processing the sources of a BD_wrapper work '
+                    'queue (see BayesianDistance.path_to_work_queue).')
+    parser.add_argument('path_to_work_queue')
+    parser.add_argument('--worker-id', default=None)
+    args = parser.parse_args()
+    run_queue_worker(args.path_to_work_queue, worker_id=args.worker_id)
@@ -1,15 +1,58 @@
+import contextlib
+import cProfile
+import hashlib
+import multiprocessing
 import os
 import pickle
+import subprocess
+import time
 import warnings
 
 import numpy as np
-from shutil import copyfile
+from shutil import copyfile, rmtree
 
 from astropy import units as u
 from astropy.table import Table, Column
 
+from .bdc_async import (AsyncBDC,
+                        determine_distances as determine_distances_async)
+from .bdc_build import get_bdc_executable
+from .bdc_cache import BDCResultCache, model_hash
+from .bdc_checkpoint import Checkpoint
+from .bdc_daemon import BDCDaemon
+from .bdc_extension import PDF_COMPONENTS, BDCExtension, get_bdc_extension
+from .bdc_grid import GRID_KEYS, BDCGrid, grid_axis
+from .bdc_kda import KDAInfoIndex
+from .bdc_numpy import BDCNumpy
+from .bdc_pdfs import (PDFArchive, create_pdf_archive, create_pdf_cube,
+                       open_pdf_cube, read_pdf_files)
+from .bdc_queue import WorkQueue
+from .bdc_report import (RunReport, TraceWriter, get_dir_size,
+                         write_profile, write_run_report)
+from .bdc_scratch import create_scratch_dir
+from .bdc_stream import (STREAM_FORMATS, TableWriter, get_reader_format,
+                         iter_table_chunks)
+from .KDA_tables import load_kda_info_store, read_kda_info_ini
 from .kinematic_distance import KinematicDistance
 
+#  derived attributes that the workers need in addition to the settings; the
+#  random samples of the velocity dispersion prior have to be the same in all
+#  workers
+WORKER_STATE = ['_use_bdc_numpy', '_model_hash', '_probability_controls',
+                '_indices', '_sigma_0']
+#  tables and models that the workers load themselves (see
+#  `BayesianDistance.initialize_worker`)
+WORKER_RESOURCES = ['_kda_tables', '_kda_parameters', '_kda_info_indices',
+                    'kd', '_bdc_grid']
+
+
+def is_plain_value(value):
+    """Check whether a value is a number, string, None or a list of them."""
+    if isinstance(value, (list, tuple)):
+        return all(is_plain_value(item) for item in value)
+    return (value is None) or isinstance(value, (bool, int, float, str,
+                                                 np.generic))
+
 
 class BayesianDistance(object):
     def __init__(self, filename=None):
@@ -25,9 +68,46 @@ class BayesianDistance(object):
             terminal.
         """
         self.path_to_bdc = None
+        self.path_to_executable = None
+        self.path_to_extension = None
+        self.path_to_bdc_cache = None
+        self.path_to_scratch = None
+        self.fortran_compiler = 'gfortran'
+        self.fortran_flags = ['-O2']
         self.version = '2.4'
         self.path_to_input_table = None
         self.path_to_output_table = None
+        self.path_to_pdfs = None
+        self.path_to_pdf_archive = None
+        self.pdf_archive_components = ['final_distance']
+        self.path_to_results_cache = None
+        self.results_cache_size = 1000
+        self.path_to_bdc_grid = None
+        self.bdc_grid_spacing = [0.1, 0.1, 1.0]
+        self.bdc_grid_p_far = 0.5
+        self.bdc_grid_tolerance = 0.1
+        self.bdc_grid_max_nodes = 10**6
+        self.deduplicate = False
+        self.dedup_tolerance = [0., 0., 0., 0.]
+        self.checkpoint = False
+        self.resume = False
+        self.streaming = False
+        self.stream_chunk_size = 10000
+        self.stream_max_chunks = 4
+        self.path_to_work_queue = None
+        self.work_queue_chunk_size = 1000
+        self.work_queue_lease = 600.
+        self.work_queue_workers = None
+        self.instrument = False
+        self.save_run_report = False
+        self.save_trace = False
+        self.profile = False
+        self.run_report = None
+        self._run_report = None
+        self._run_start = None
+        self._stats = None
+        self._trace_writer = None
+        self._profiler = None
         self.input_table = None
         self.verbose = True
         self.add_kinematic_distance = True
@@ -48,6 +128,8 @@ class BayesianDistance(object):
         self.default_e_vel = 5.0
         self.kda_info_tables = []
         self.exclude_kda_info_tables = []
+        self.kda_info_index = True
+        self.kda_prior_batch = True
         self.kda_weight = 1
 
         self.random_seed = 177
@@ -59,17 +141,64 @@ class BayesianDistance(object):
         self.size_linewidth_e_sigma_0 = 0.1
 
         self.use_ncpus = None
+        self.backend = 'processes'
+        self.start_method = None
         self.plot_probability = False
+        self.bdc_chunk_size = 1
+        self.bdc_daemon = False
+        self._bdc_daemon = None
+        self._bdc_daemon_pid = None
+        self.bdc_async = False
+        self._bdc_async = None
+        self._bdc_async_pid = None
+        self.bdc_extension = True
+        self._bdc_extension = None
+        self.bdc_numpy = False
+        self.bdc_output_level = None
+        self._bdc_numpy = None
+        self._use_bdc_numpy = False
+        self._probability_controls = None
+        self._scratch_dir = None
+        self._scratch_dir_pid = None
+        self._pdf_cube = None
+        self._pdf_cube_pid = None
+        self._pdf_archive = None
+        self._pdf_archive_pid = None
+        self._results_cache = None
+        self._results_cache_pid = None
+        self._model_hash = None
+        self._bdc_grid = None
+        self._checkpoint = None
+        self._kda_tables = []
+        self._kda_parameters = []
+        self._kda_info_indices = []
+        self._kda_priors = None
 
         self._p = {
             '1.0': {
                 'bdc_fortran': 'Bayesian_distance_v1.0.f',
+                'bdc_extension': None,
                 'summary_suffix': '.prt',
+                'bdc_outputs': (
+                    '.prt', '_arm_ranges.dat', '_final_distance_pdf.dat',
+                    '_kinematic_distance_pdf.dat', '_latitude_pdf.dat',
+                    '_parallaxes_pdf.dat', '_spiral_arm_pdf.dat'),
+                'pdf_components': (
+                    'kinematic_distance', 'spiral_arm', 'latitude',
+                    'parallaxes', 'final_distance'),
                 'fct_extract': self.extract_results_v1p0,
                 'R_0': 8.34},
             '2.4': {
                 'bdc_fortran': 'Bayesian_distance_2019_fromlist_v2.4.f',
-                'summary_suffix': 'summary.prt',
+                'bdc_extension': 'bdc_extension.f',
+                'summary_suffix': '_summary.prt',
+                'bdc_outputs': (
+                    '.prt', '_summary.prt', '_arm_latitude_pdf.dat',
+                    '_arm_pdf.dat', '_arm_ranges.dat', '_final_distance_pdf.dat',
+                    '_kinematic_distance_pdf.dat', '_latitude_pdf.dat',
+                    '_parallaxes_pdf.dat', '_pm_bee_distance_pdf.dat',
+                    '_pm_ell_distance_pdf.dat'),
+                'pdf_components': PDF_COMPONENTS,
                 'fct_extract': self.extract_results_v2p4,
                 'R_0': 8.15}
         }
@@ -79,14 +208,273 @@ class BayesianDistance(object):
         if self.verbose:
             print(message, end=end)
 
+    def close_resources(self):
+        """Close the BDC daemon, scratch directory, PDF output and results
+        cache opened by the current process (or thread copy)."""
+        self.close_bdc_daemon()
+        self.remove_scratch_dir()
+        self.close_pdf_output()
+        self.close_results_cache()
+
+    def use_instrumentation(self):
+        return (self.instrument or self.save_run_report or self.save_trace or
+                self.profile)
+
+    def get_stats(self):
+        """Return the run report of the current worker (see `RunReport`)."""
+        if self._stats is None:
+            self._stats = RunReport()
+        return self._stats
+
+    def stage(self, name):
+        """Context manager timing a stage of the run in the report of the
+        current worker; does nothing if the run is not instrumented."""
+        if not self.use_instrumentation():
+            return contextlib.nullcontext()
+        return self.get_stats().stage(name)
+
+    def count(self, name, n=1):
+        """Increase a counter of the run report of the current worker."""
+        if self.use_instrumentation():
+            self.get_stats().count(name, n)
+
+    def record_scratch_usage(self):
+        """Record the size of the scratch directory after a BDC run."""
+        if self.use_instrumentation() and (self._scratch_dir is not None):
+            self.get_stats().record_worker(
+                scratch_size=get_dir_size(self._scratch_dir))
+
+    def pop_stats(self):
+        """Return the report of the current worker since the last call,
+        including its resource usage; None if the run is not instrumented.
+
+        The worker processes and threads return their reports with the
+        results of their tasks (see `BD_multiprocessing`).
+        """
+        if not self.use_instrumentation():
+            return None
+        stats = self.get_stats()
+        stats.record_worker()
+        self._stats = None
+        return stats
+
+    def merge_stats(self, stats):
+        """Add the report of a worker to the report of the run.
+
+        The traces of the sources are written to the trace file right away.
+        """
+        if (self._run_report is None) or (stats is None):
+            return
+        if stats.trace:
+            self._trace_writer.write(stats.trace)
+            stats.trace = []
+        self._run_report.merge(stats)
+
+    @contextlib.contextmanager
+    def profiling(self):
+        """Profile the enclosed code with cProfile if `profile` is set.
+
+        The statistics are added to the report of the current worker. Nested
+        calls and calls while another profiler is active (on Python >= 3.12,
+        only one profiler can be active per process) do not start a new
+        profiler.
+        """
+        profiler = None
+        if self.profile and (self._profiler is None):
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+            except ValueError:
+                profiler = None
+        if profiler is None:
+            yield
+            return
+        self._profiler = profiler
+        try:
+            yield
+        finally:
+            profiler.disable()
+            self._profiler = None
+            self.get_stats().add_profile(profiler)
+
+    def get_p_far_source(self, p_far, kda_ref):
+        """Origin of the KDA prior of a source for its trace."""
+        if (self.colnr_kda is not None) and (p_far != 0.5):
+            return 'kda_column'
+        #  '--' marks sources without a match in the KDA info tables
+        if kda_ref not in [None, '--']:
+            return 'literature'
+        return 'flat'
+
+    def add_trace_time(self, sources, step, seconds):
+        """Add the time of a step for sources to their traces; the time of
+        a step for several sources is split evenly between them."""
+        for src in sources:
+            if 'trace' in src:
+                src['trace'][step] += seconds / len(sources)
+
+    def add_traces(self, sources):
+        """Add the traces of processed sources to the report of the
+        current worker (see `TRACE_COLUMNS`)."""
+        if not self.save_trace:
+            return
+        self.get_stats().trace.extend(
+            (src['index'], src['lon'], src['lat'], src['vel'],
+             src['trace']['p_far'], src['trace']['p_far_source'],
+             src['kda_ref'], int(src['trace']['fallback']),
+             src['trace']['origin'], round(src['trace']['prior'], 6),
+             round(src['trace']['bdc'], 6), round(src['trace']['parse'], 6))
+            for src in sources)
+
+    def initialize_run_report(self):
+        self.run_report = None
+        self._run_report, self._stats = None, None
+        if self.use_instrumentation():
+            self._run_report = RunReport()
+            self._run_start = time.perf_counter()
+
+    def get_trace_path(self):
+        return os.path.join(
+            self.dirname_table, '{}_trace.csv'.format(self.table_filename))
+
+    def get_profile_path(self):
+        return os.path.join(
+            self.dirname_table, '{}_profile.prof'.format(self.table_filename))
+
+    def get_engine(self):
+        """Name of the BDC implementation used for the run."""
+        if self.bdc_async:
+            return 'async'
+        if self._use_bdc_numpy:
+            return 'numpy'
+        if self.path_to_extension is not None:
+            return 'extension'
+        return 'daemon' if self.bdc_daemon else 'executable'
+
+    def get_bdc_build(self):
+        """Name of the build directory of the compiled BDC used for the run.
+
+        The name contains the `build_hash` of the Fortran source and the
+        compiler settings (see `get_bdc_executable` and `get_bdc_extension`);
+        None for the NumPy implementation or before `initialize_bdc`.
+        """
+        if self._use_bdc_numpy:
+            return None
+        path = self.path_to_extension
+        if (path is None) or self.bdc_async:
+            path = self.path_to_executable
+        if path is None:
+            return None
+        return os.path.basename(os.path.dirname(path))
+
+    def finish_run_report(self, n_sources):
+        """Complete the run report of `calculate_distances`.
+
+        The report is stored as a dict in `run_report` and, if
+        `save_run_report` is set, written as JSON to
+        '{table_filename}_run_report.json' next to the output table. It
+        contains the wall time of the run, the settings that determine how
+        the sources were processed and the contents of the merged reports of
+        all workers (see `RunReport`): the wall and CPU time [s] and number
+        of calls of each stage, the counters (sources, BDC runs, fallback
+        reruns with p_far = 0.5, cache hits and interpolated sources) and the
+        peak memory [MB], BDC CPU time [s] and peak scratch directory size
+        [MB] of each worker.
+        """
+        if self._run_report is None:
+            return
+        self.merge_stats(self.pop_stats())
+        if self._trace_writer is not None:
+            self._trace_writer.close()
+            self._trace_writer = None
+            self.say(">> saved traces of the sources in '{}'".format(
+                self.get_trace_path()))
+        if self.profile:
+            write_profile(self._run_report.profile, self.get_profile_path())
+            self.say(">> saved merged profile in '{}'".format(
+                self.get_profile_path()))
+        report = {
+            'wall_time': time.perf_counter() - self._run_start,
+            'n_sources': n_sources,
+            'settings': {
+                'engine': self.get_engine(), 'backend': self.backend,
+                'use_ncpus': self.use_ncpus,
+                'bdc_chunk_size': self.bdc_chunk_size,
+                'streaming': self.streaming,
+                'work_queue': self.path_to_work_queue is not None}}
+        report.update(self._run_report.to_dict())
+        self.run_report, self._run_report = report, None
+
+        self.say('run report (wall time {:.1f} s):'.format(
+            report['wall_time']))
+        for name, stage in report['stages'].items():
+            self.say('  {:<15} wall {:>9.2f} s  cpu {:>9.2f} s'.format(
+                name, stage['wall'], stage['cpu']))
+        if self.save_run_report:
+            filename = '{}_run_report.json'.format(self.table_filename)
+            write_run_report(report, os.path.join(self.dirname_table, filename))
+            self.say(">> saved run report '{}' in {}\n".format(
+                filename, self.dirname_table))
+
+    def get_worker_config(self):
+        """Compact settings from which the workers recreate the object.
+
+        Contains the settings with plain values (numbers, strings, paths and
+        lists of them) and the derived values in `WORKER_STATE`. The loaded
+        tables and models (`WORKER_RESOURCES`), the input table and the
+        objects that are only valid in the process that created them (BDC
+        daemon, in-process BDC, scratch directory, PDF output, results cache
+        and checkpoint) are not included; the workers load or open their own
+        ones (see `initialize_worker`). The settings can be pickled, so they
+        can be sent to worker processes started with any multiprocessing
+        start method or stored in the work queue.
+        """
+        config = {key: value for key, value in self.__dict__.items()
+                  if not key.startswith('_') and (key not in WORKER_RESOURCES)
+                  and is_plain_value(value)}
+        config.update({key: getattr(self, key) for key in WORKER_STATE})
+        config['_load_bdc_grid'] = self._bdc_grid is not None
+        return config
+
+    def get_worker_resources(self):
+        """Loaded tables and models, which the threads of the 'threads'
+        backend share with the object (see `initialize_worker`)."""
+        return {key: getattr(self, key) for key in WORKER_RESOURCES
+                if hasattr(self, key)}
+
+    def initialize_worker(self, config, resources=None):
+        """Recreate the object in a worker from `get_worker_config`.
+
+        The tables and models are taken from `resources` if given (see
+        `get_worker_resources`). Otherwise, the KDA info tables and their
+        indices are loaded from the precompiled store, the kinematic
+        distance model is initialized and the BDC grid is loaded from
+        `path_to_bdc_grid`, as far as they are needed.
+        """
+        self.__dict__.update({key: value for key, value in config.items()
+                              if key != '_load_bdc_grid'})
+        if resources is not None:
+            self.__dict__.update(resources)
+            return
+        if self.check_for_kda_solutions:
+            self.initialize_kda_tables()
+        if self.prior_velocity_dispersion:
+            self.kd = KinematicDistance()
+            self.kd.initialize()
+        if config['_load_bdc_grid']:
+            self._bdc_grid = BDCGrid.load(self.path_to_bdc_grid)
+
     def check_settings(self):
         self.initialize_bdc()
         self.initialize_table()
         self.set_probability_controls()
-        if self.check_for_kda_solutions:
-            self.initialize_kda_tables()
-        if self.prior_velocity_dispersion:
-            self.initialize_prior_velocity_dispersion()
+        with self.stage('p_far_prior'):
+            if self.check_for_kda_solutions:
+                self.initialize_kda_tables()
+            if self.prior_velocity_dispersion:
+                self.initialize_prior_velocity_dispersion()
+        if self.path_to_results_cache is not None:
+            self.initialize_results_cache()
 
         text = 'Python wrapper for Bayesian distance calculator v{}'.format(
             self.version)
@@ -97,6 +485,40 @@ class BayesianDistance(object):
     def initialize_bdc(self):
         if self.version is None:
             raise Exception("Need to specify 'version'")
+        if self.bdc_daemon and (self.version != '2.4'):
+            raise Exception("'bdc_daemon' is only supported for version '2.4'")
+        if self.bdc_numpy and (self.version != '2.4'):
+            raise Exception("'bdc_numpy' is only supported for version '2.4'")
+        if self.backend not in ['processes', 'threads']:
+            raise Exception("'backend' needs to be 'processes' or 'threads'")
+        if (self.path_to_work_queue is not None) and self.save_pdfs():
+            #  the PDF outputs are written through memory maps and part files
+            #  named by thread IDs, which are only valid on one host
+            raise Exception(
+                "'path_to_pdfs' and 'path_to_pdf_archive' cannot be combined "
+                "with 'path_to_work_queue'")
+        if (self.backend == 'threads') and self.plot_probability:
+            raise Exception(
+                "'plot_probability' is not supported for backend 'threads'")
+        if self.bdc_async and (self.bdc_daemon or self.bdc_numpy):
+            raise Exception("'bdc_async' cannot be combined with 'bdc_daemon' "
+                            "or 'bdc_numpy'")
+        if self.bdc_output_level is not None:
+            if self.version != '2.4':
+                raise Exception(
+                    "'bdc_output_level' is only supported for version '2.4'")
+            if self.bdc_output_level not in [0, 1, 2]:
+                raise Exception("'bdc_output_level' needs to be 0, 1 or 2")
+            if self.plot_probability and (self.bdc_output_level < 2):
+                raise Exception(
+                    "'plot_probability' requires 'bdc_output_level = 2'")
+            if self.save_pdfs() and (self.bdc_output_level < 2):
+                raise Exception(
+                    "'path_to_pdfs' and 'path_to_pdf_archive' require "
+                    "'bdc_output_level = 2'")
+            if self.add_kinematic_distance and (self.bdc_output_level < 1):
+                raise Exception(
+                    "'add_kinematic_distance' requires 'bdc_output_level' >= 1")
 
         path_script = os.path.dirname(
             os.path.dirname(os.path.realpath(__file__)))
@@ -106,8 +528,49 @@ class BayesianDistance(object):
         path_to_file = os.path.join(
             self.path_to_bdc, self._p[self.version]['bdc_fortran'])
 
-        with open(path_to_file, "r") as fin:
-            self.bdc_script = fin.readlines()
+        #  the extension module and the NumPy implementation do not produce
+        #  the PDF files needed for the plots; the asyncio engine runs the
+        #  BDC executable
+        in_process = ((self._p[self.version]['bdc_extension'] is not None) and
+                      not (self.plot_probability or self.bdc_async))
+        self._use_bdc_numpy = in_process and self.bdc_numpy
+        self.path_to_extension = None
+
+        #  the NumPy implementation does not need the compiled BDC
+        self.path_to_executable = None
+        if not self._use_bdc_numpy:
+            with self.stage('compile'):
+                self.path_to_executable = get_bdc_executable(
+                    path_to_file, compiler=self.fortran_compiler,
+                    flags=self.fortran_flags,
+                    path_to_cache=self.path_to_bdc_cache, verbose=self.verbose)
+
+        if in_process and self.bdc_extension and not self._use_bdc_numpy:
+            try:
+                with self.stage('compile'):
+                    self.path_to_extension = get_bdc_extension(
+                        path_to_file, os.path.join(
+                            self.path_to_bdc,
+                            self._p[self.version]['bdc_extension']),
+                        compiler=self.fortran_compiler,
+                        flags=self.fortran_flags,
+                        path_to_cache=self.path_to_bdc_cache,
+                        verbose=self.verbose)
+            except Exception as e:
+                warnings.warn(
+                    "Could not build the BDC extension module; using the BDC "
+                    "executable instead.\n{}".format(e))
+
+        #  the extension keeps its state in global Fortran variables, so its
+        #  calls are serialized (see `bdc_extension`)
+        condition = ((self.path_to_extension is not None) and
+                     (self.backend == 'threads') and (self.use_ncpus != 1))
+        if condition:
+            warnings.warn(
+                "The calls of the BDC extension module are serialized, so "
+                "backend 'threads' runs one source at a time; use backend "
+                "'processes', 'bdc_numpy' or 'bdc_extension = False' for "
+                "parallel threads.")
 
     def initialize_table(self):
         if self.path_to_output_table is not None:
@@ -127,8 +590,21 @@ class BayesianDistance(object):
             os.makedirs(self.dirname_table)
 
     def initialize_kda_tables(self):
+        """Load the KDA info tables and their parameters.
+
+        The tables and the parsed parameters of their init files are read
+        from a precompiled store in `path_to_bdc_cache` (see
+        `KDA_tables.load_kda_info_store`), which is rebuilt automatically if
+        the files in the 'KDA_info' directory change. If `kda_info_index` is
+        True, a spatial and velocity index of each table is built (see
+        `bdc_kda.KDAInfoIndex`), with which `check_KDA` only evaluates the
+        rows that can be associated with a source.
+        """
         dirname = os.path.dirname(
             os.path.dirname(os.path.realpath(__file__)))
+        store = load_kda_info_store(
+            os.path.join(dirname, 'KDA_info'),
+            path_to_cache=self.path_to_bdc_cache)
         if not self.kda_info_tables:
             files = os.listdir(os.path.join(dirname, 'KDA_info'))
             self.kda_info_tables = [
@@ -139,15 +615,18 @@ class BayesianDistance(object):
                 table for table in self.kda_info_tables
                 if table not in self.exclude_kda_info_tables]
 
-        self._kda_tables = []
-        keys = ['GLON', 'GLAT', 'VLSR', 'd_VLSR', 'p_far',
-                'cos_pa', 'sin_pa', 'aa', 'bb']
+        self._kda_tables, self._kda_parameters = [], []
+        self._kda_info_indices = []
         for tablename in self.kda_info_tables:
-            table = Table.read(os.path.join(
-                dirname, 'KDA_info', tablename + '.dat'), format='ascii')
-            table = table[keys]
-
-            self._kda_tables.append(table)
+            if tablename not in store:
+                raise Exception("Could not find KDA info table '{}'".format(
+                    tablename))
+            columns, parameters = store[tablename]
+            self._kda_tables.append(Table(columns, copy=False))
+            self._kda_parameters.append(parameters)
+            if self.kda_info_index:
+                self._kda_info_indices.append(
+                    KDAInfoIndex(columns, parameters))
 
     def initialize_prior_velocity_dispersion(self):
         try:
@@ -184,23 +663,22 @@ class BayesianDistance(object):
         if self.prob_pm is None:
             self.prob_pm = default_vals[self.version]['PM']
 
-        cwd = os.getcwd()
-        os.chdir(self.path_to_bdc)
-
+        #  the controls are written to the scratch directories of the BDC runs
+        #  instead of the (shared) BDC directory
         with open(os.path.join(
                 self.path_to_bdc, 'probability_controls.inp'), 'r') as fin:
             file_content = fin.readlines()
-        with open(os.path.join(
-                self.path_to_bdc, 'probability_controls.inp'), 'w') as fout:
-            for line in file_content:
-                if not line.startswith('!'):
-                    line = '{s}{a}{s}{b}{s}{c}{s}{d}'.format(
-                        s=s, a=self.prob_sa, b=self.prob_kd, c=self.prob_gl,
-                        d=self.prob_ps)
-                    if self.prob_pm is not None:
-                        line += '{s}{a}'.format(s=s, a=self.prob_pm)
-                fout.write(line)
-        os.chdir(cwd)
+        lines = []
+        for line in file_content:
+            if not line.startswith('!'):
+                line = '{s}{a}{s}{b}{s}{c}{s}{d}'.format(
+                    s=s, a=self.prob_sa, b=self.prob_kd, c=self.prob_gl,
+                    d=self.prob_ps)
+                if self.prob_pm is not None:
+                    line += '{s}{a}'.format(s=s, a=self.prob_pm)
+            lines.append(line)
+        self._probability_controls = ''.join(lines)
+        self.remove_scratch_dir()
 
         string = str("prob_sa: {a}\nprob_kd: {b}\n"
                      "prob_gl: {c}\nprob_ps: {d}\n".format(
@@ -228,19 +706,11 @@ class BayesianDistance(object):
         if self.colname_name is not None:
             self.colnr_name = self.input_table.colnames.index(self.colname_name)
 
-    def make_fortran_out(self, source):
-        """Create a fortran executable for the source.
-
-        Replaces the default input file in the fortran script of the Bayesian
-        distance calculator with the input file of the source, then creates a
-        Fortran executable file.
-        """
-        with open("{}.f".format(self.path_to_source), "w") as fout:
-            for line in self.bdc_script:
-                fout.write(line.replace('sources_info.inp',
-                                        '{}_sources_info.inp'.format(source)))
-        os.system('gfortran {}.f -o {}.out'.format(
-                self.path_to_source, self.path_to_source))
+        condition = (self.prior_velocity_dispersion and
+                     (self.colnr_vel_disp is None))
+        if condition:
+            self.colnr_vel_disp = False
+            warnings.warn(str("Did not specify 'colnr_vel_disp' or 'colname_vel_disp'. Setting 'prior_velocity_dispersion=False'."))
 
     def extract_string(self, s, first, last, incl=False):
         """Search for a substring inside a string.
@@ -323,7 +793,7 @@ class BayesianDistance(object):
 
     def extract_kinematic_distances(self, result_file_content):
         """"""
-        kinDist = [np.NAN, np.NAN]
+        kinDist = [np.nan, np.nan]
 
         flag = 'one'
         for line in result_file_content:
@@ -381,31 +851,460 @@ class BayesianDistance(object):
                 results.append(result)
         return results
 
+    def get_bdc_output_level(self):
+        """Output level of the BDC executable (v2.4).
+
+        0: one line summary per source; 1: summary and kinematic distances;
+        2: summary, print out and PDF files of each source. If
+        `bdc_output_level` is not set, the lowest level that provides all
+        results needed by the wrapper is used.
+        """
+        if self.bdc_output_level is not None:
+            return self.bdc_output_level
+        if self.plot_probability or self.save_pdfs():
+            return 2
+        return 1 if self.add_kinematic_distance else 0
+
+    def get_scratch_dir(self):
+        """Return the scratch directory of the current process.
+
+        Each (worker) process runs the BDC executable in its own scratch
+        directory in `path_to_scratch`, which is created the first time it is
+        needed (see `create_scratch_dir`). So the files of concurrent BDC runs
+        never end up in the same directory.
+        """
+        condition = ((self._scratch_dir is None) or
+                     (self._scratch_dir_pid != os.getpid()))
+        if condition:
+            self._scratch_dir = create_scratch_dir(
+                self.path_to_bdc, self._probability_controls,
+                path_to_scratch=self.path_to_scratch,
+                prefix='bdc_v{}_'.format(self.version))
+            self._scratch_dir_pid = os.getpid()
+        return self._scratch_dir
+
+    def remove_scratch_dir(self):
+        """Remove the scratch directory created by the current process."""
+        if (self._scratch_dir is not None) and\
+                (self._scratch_dir_pid == os.getpid()):
+            rmtree(self._scratch_dir, ignore_errors=True)
+        self._scratch_dir = None
+        self._scratch_dir_pid = None
+
+    def initialize_results_cache(self):
+        """Open the results cache and remove outdated entries.
+
+        Entries of the chosen BDC version that were calculated with another
+        Fortran source or other input data files of the BDC are removed.
+        """
+        self._model_hash = model_hash(
+            self.path_to_bdc, os.path.join(
+                self.path_to_bdc, self._p[self.version]['bdc_fortran']))
+        self.close_results_cache()
+        cache = self.get_results_cache()
+        n_removed = cache.invalidate(self.version, self._model_hash)
+        self.say("using results cache '{}' ({} entries, {} outdated entries "
+                 "removed)".format(self.path_to_results_cache, len(cache),
+                                   n_removed))
+
+    def use_results_cache(self):
+        """Check whether results can be taken from the results cache.
+
+        The cache only contains the distance results, so it is not used if the
+        PDFs of the sources are needed.
+        """
+        return ((self.path_to_results_cache is not None) and
+                not (self.plot_probability or self.save_pdfs()))
+
+    def get_results_cache(self):
+        """Return the connection of the current process to the cache."""
+        condition = ((self._results_cache is None) or
+                     (self._results_cache_pid != os.getpid()))
+        if condition:
+            self._results_cache = BDCResultCache(self.path_to_results_cache)
+            self._results_cache_pid = os.getpid()
+        return self._results_cache
+
+    def close_results_cache(self):
+        """Close the connection of the current process to the cache."""
+        if (self._results_cache is not None) and\
+                (self._results_cache_pid == os.getpid()):
+            self._results_cache.close()
+        self._results_cache = None
+        self._results_cache_pid = None
+
+    def get_cache_key(self, src):
+        """Key of the results of a source from `prepare_source` in the cache.
+
+        The key is a hash of the input values of the source (including the
+        KDA prior), the BDC version, the hash of the BDC model, the BDC
+        implementation and its build (see `get_engine` and `get_bdc_build`),
+        and all settings that change the results. The input values are
+        converted to floats, so the key does not depend on the NumPy version
+        (whose `repr` of scalars changed).
+        """
+        values = (
+            float(src['lon']), float(src['lat']), float(src['vel']),
+            self.get_e_vel(src['plusminus']), float(src['p_far']),
+            src['kda_ref'], self.version, self._model_hash,
+            self.get_engine(), self.get_bdc_build(),
+            self.get_bdc_output_level(),
+            self.prob_sa, self.prob_kd, self.prob_gl, self.prob_ps,
+            self.prob_pm, self.add_kinematic_distance)
+        return hashlib.sha256(repr(values).encode()).hexdigest()
+
+    def use_bdc_grid(self):
+        """Check whether distances are interpolated from the BDC grid.
+
+        The grid only contains the distance results, so it is not used if the
+        PDFs of the sources are needed.
+        """
+        return ((self.path_to_bdc_grid is not None) and
+                not (self.plot_probability or self.save_pdfs()))
+
+    def get_bdc_grid_meta(self):
+        """Settings with which the BDC grid has to be calculated."""
+        if self._model_hash is None:
+            self._model_hash = model_hash(
+                self.path_to_bdc, os.path.join(
+                    self.path_to_bdc, self._p[self.version]['bdc_fortran']))
+        return {'version': self.version, 'model': self._model_hash,
+                'p_far': float(self.bdc_grid_p_far),
+                'e_vel': float(self.default_e_vel),
+                'p_max': [self.prob_sa, self.prob_kd, self.prob_gl,
+                          self.prob_ps, self.prob_pm]}
+
+    def get_bdc_grid_positions(self, table, priors=None):
+        """Positions of the rows of a table that can be interpolated from the
+        BDC grid.
+
+        Only sources with the KDA prior and velocity uncertainty of the grid
+        are interpolated (see `lookup_bdc_grid`), so the grid only needs to
+        cover them. `priors` are the literature KDA priors of the rows (see
+        `determine_kda_priors`). Rows whose prior is determined from the
+        velocity dispersion are not included, since their p_far values are
+        only known after the kinematic distances were calculated.
+
+        Returns
+        -------
+        list
+            Longitudes, latitudes and velocities of the rows.
+
+        """
+        meta = self.get_bdc_grid_meta()
+        select = np.zeros(len(table), dtype='bool')
+        for idx, row in enumerate(table):
+            row = list(row)
+            lon, lat, vel =\
+                row[self.colnr_lon], row[self.colnr_lat], row[self.colnr_vel]
+            p_far, _ = self.determine_p_far_and_kda_ref(
+                row, lon, lat, vel,
+                prior=None if priors is None else priors[idx])
+            condition = ((p_far == 0.5) and
+                         self.prior_velocity_dispersion and
+                         (self.colnr_vel_disp is not None))
+            select[idx] = (not condition) and (p_far == meta['p_far']) and (
+                self.get_e_vel(self.determine_e_vel(row)) == meta['e_vel'])
+        return [np.asarray(table.columns[colnr], dtype='float64')[select]
+                for colnr in [self.colnr_lon, self.colnr_lat, self.colnr_vel]]
+
+    def initialize_bdc_grid(self, positions, n_sources=None):
+        """Load the BDC grid or calculate it for the input table.
+
+        An existing grid is reused if it was calculated with the same
+        settings, grid spacing and BDC model and covers the (l, b, v) range of
+        the sources that can be interpolated (see `get_bdc_grid_positions`);
+        otherwise the BDC is evaluated on a new grid, which is saved to
+        `path_to_bdc_grid`. The grid is not used if there are no such
+        sources, and an exception is raised if it would have more than
+        `bdc_grid_max_nodes` nodes.
+
+        Parameters
+        ----------
+        positions : list
+            Longitudes, latitudes and velocities of the sources (or their
+            minimum and maximum values).
+        n_sources : int
+            Number of the sources (the number of positions by default).
+        """
+        if self.version != '2.4':
+            raise Exception("'path_to_bdc_grid' is only supported for "
+                            "version '2.4'")
+        if not (self._use_bdc_numpy or (self.path_to_extension is not None)):
+            raise Exception("'path_to_bdc_grid' requires the BDC extension "
+                            "module or 'bdc_numpy = True'")
+
+        lon, lat, vel = [np.array(x, dtype='float64') for x in positions]
+        if n_sources is None:
+            n_sources = len(lon)
+        meta = self.get_bdc_grid_meta()
+        spacing = [float(x) for x in self.bdc_grid_spacing]
+
+        self._bdc_grid = None
+        if n_sources == 0:
+            warnings.warn(
+                "No source has the KDA prior 'bdc_grid_p_far' and the velocity "
+                "uncertainty 'default_e_vel' of the BDC grid; the grid is not "
+                "used.")
+            return
+        if os.path.exists(self.path_to_bdc_grid):
+            grid = BDCGrid.load(self.path_to_bdc_grid)
+            condition = (grid.matches(meta) and grid.covers(lon, lat, vel) and
+                         np.allclose([axis[1] - axis[0] for axis in grid.axes],
+                                     spacing))
+            if condition:
+                self._bdc_grid = grid
+                self.say("using BDC grid '{}' ({} nodes)".format(
+                    self.path_to_bdc_grid, grid.values['found'].size))
+                return
+
+        axes = [grid_axis(x, dx) for x, dx in zip([lon, lat, vel], spacing)]
+        n_nodes = int(np.prod([axis.size for axis in axes]))
+        if n_nodes > self.bdc_grid_max_nodes:
+            raise Exception(
+                "The BDC grid for the range of the sources would have {} "
+                "nodes (more than 'bdc_grid_max_nodes'); increase "
+                "'bdc_grid_spacing'".format(n_nodes))
+        if n_nodes > n_sources:
+            warnings.warn(
+                "The BDC grid has more nodes ({}) than there are sources to "
+                "interpolate ({}), so it takes longer to evaluate than the "
+                "sources themselves.".format(n_nodes, n_sources))
+        nodes = np.stack([x.ravel() for x in np.meshgrid(
+            *axes, indexing='ij')], axis=1)
+        self.say("evaluating BDC on grid with {} nodes...".format(len(nodes)))
+
+        from . import BD_multiprocessing
+        results_list = BD_multiprocessing.evaluate_grid(
+            self, nodes, use_ncpus=self.use_ncpus)
+        for item in results_list:
+            if not isinstance(item, dict):
+                raise Exception("Error for BDC grid: {}".format(item))
+
+        shape = tuple(axis.size for axis in axes)
+        values = {}
+        for key in results_list[0]:
+            value = np.concatenate([item[key] for item in results_list])
+            values[key] = value.reshape(shape + value.shape[1:])
+
+        self._bdc_grid = BDCGrid(axes, values, meta)
+        self._bdc_grid.save(self.path_to_bdc_grid)
+        self.say(">> saved BDC grid '{}'".format(self.path_to_bdc_grid))
+
+    def evaluate_grid_nodes(self, nodes):
+        """Results of the BDC for the (l, b, v) nodes of the BDC grid.
+
+        Nodes whose p_far value did not yield any distance results are
+        evaluated with p_far = 0.5, as in `determine_chunk_extension`.
+        """
+        meta = self.get_bdc_grid_meta()
+        n = len(nodes)
+        output = self.get_bdc_in_process().run(
+            nodes[:, 0], nodes[:, 1], nodes[:, 2], np.full(n, meta['e_vel']),
+            np.full(n, meta['p_far']), meta['p_max'], fallback=True)
+        return {key: output[key] for key in GRID_KEYS}
+
+    def lookup_bdc_grid(self, sources):
+        """Interpolate distances of sources from the BDC grid.
+
+        Only sources with the p_far value and velocity uncertainty of the grid
+        are interpolated.
+
+        Returns
+        -------
+        dict
+            Results and interpolation error for the indices of the sources
+            with valid interpolated results (see `BDCGrid.lookup`).
+
+        """
+        if self._bdc_grid is None:
+            return {}
+        meta = self._bdc_grid.meta
+        select = [i for i, src in enumerate(sources)
+                  if (src['p_far'] == meta['p_far']) and
+                  (self.get_e_vel(src['plusminus']) == meta['e_vel'])]
+        if not select:
+            return {}
+
+        output = self._bdc_grid.lookup(
+            *[[sources[i][key] for i in select]
+              for key in ['lon', 'lat', 'vel']],
+            tolerance=self.bdc_grid_tolerance)
+
+        results = {}
+        for k, i in enumerate(select):
+            if not output['valid'][k]:
+                continue
+            #  the nodes may have been rerun with p_far = 0.5
+            sources[i]['p_far'] = round(float(output['p_far'][k]), 2)
+            results[i] = (self.extract_results_extension(
+                sources[i], output, k), float(output['e_interp'][k]))
+        return results
+
+    def get_checkpoint_meta(self):
+        """Input table and settings identifying a run in its checkpoint."""
+        return {'n_sources': len(self.input_table),
+                'colnames': list(self.input_table.colnames),
+                'settings': [
+                    self.version, self.prob_sa, self.prob_kd, self.prob_gl,
+                    self.prob_ps, self.prob_pm, self.add_kinematic_distance,
+                    self.check_for_kda_solutions, self.kda_info_tables,
+                    self.exclude_kda_info_tables, self.kda_weight,
+                    self.prior_velocity_dispersion, self.max_e_vel,
+                    self.default_e_vel, self.use_bdc_grid(),
+                    self.bdc_grid_spacing, self.bdc_grid_p_far,
+                    self.bdc_grid_tolerance]}
+
+    def initialize_checkpoint(self):
+        """Open the checkpoint file of the run next to the output table.
+
+        If `resume` is set, the results of the input rows that were already
+        completed are read in from an existing checkpoint file.
+
+        Returns
+        -------
+        dict
+            Results of the completed input rows with their indices as keys.
+
+        """
+        self._checkpoint = Checkpoint(os.path.join(
+            self.dirname_table, self.table_filename + '_checkpoint.pickle'))
+        meta = self.get_checkpoint_meta()
+
+        completed = {}
+        if self.resume and self._checkpoint.exists():
+            meta_checkpoint, completed, _ = self._checkpoint.read()
+            if meta_checkpoint != meta:
+                raise Exception(
+                    "Checkpoint '{}' belongs to another input table or other "
+                    "settings; remove it or set 'resume = False'".format(
+                        self._checkpoint.path_to_checkpoint))
+            self.say("resuming from checkpoint '{}' ({} completed "
+                     "sources)".format(self._checkpoint.path_to_checkpoint,
+                                       len(completed)))
+
+        self._checkpoint.open(meta, resume=self.resume)
+        return completed
+
+    def append_checkpoint(self, indices, results):
+        """Add the results of completed input rows to the checkpoint."""
+        self._checkpoint.append(indices, results)
+
+    def save_pdfs(self):
+        """Check whether the PDFs of the sources need to be saved."""
+        return ((self.path_to_pdfs is not None) or
+                (self.path_to_pdf_archive is not None))
+
+    def initialize_pdf_output(self, n_sources):
+        """Create the PDF cube and/or archive for the PDFs of all sources."""
+        components = self._p[self.version]['pdf_components']
+        if self.path_to_pdfs is not None:
+            create_pdf_cube(self.path_to_pdfs, n_sources, len(components))
+            self.say("saving PDFs of all sources to '{}'".format(
+                self.path_to_pdfs))
+        if self.path_to_pdf_archive is not None:
+            for component in self.pdf_archive_components:
+                if component not in components:
+                    raise Exception(
+                        "Unknown PDF component '{}'; choose from {}".format(
+                            component, ', '.join(components)))
+            create_pdf_archive(self.path_to_pdf_archive, n_sources,
+                               self.pdf_archive_components)
+            self.say("saving PDFs of all sources to archive '{}'".format(
+                self.path_to_pdf_archive))
+        self.close_pdf_output()
+
+    def copy_duplicate_pdfs(self, indices, sources):
+        """Copy the PDFs of the `sources` rows to the duplicate `indices` rows.
+
+        In the PDF archive, the duplicate rows reference the same records.
+        """
+        if self.path_to_pdfs is not None:
+            cube = open_pdf_cube(self.path_to_pdfs, mode='r+')
+            cube[indices] = cube[sources]
+            cube.flush()
+            del cube
+        if self.path_to_pdf_archive is not None:
+            archive = PDFArchive(self.path_to_pdf_archive, mode='r+')
+            archive.link(indices, sources)
+            archive.close()
+
+    def store_pdfs(self, indices, pdfs):
+        """Write the PDFs of sources to the PDF cube and/or archive.
+
+        Each (worker) process memory-maps the PDF cube once and writes the
+        PDFs of its sources directly to their rows. Likewise, it opens the
+        PDF archive once and appends the PDFs to its own data file.
+        """
+        if self.path_to_pdfs is not None:
+            condition = ((self._pdf_cube is None) or
+                         (self._pdf_cube_pid != os.getpid()))
+            if condition:
+                self._pdf_cube = open_pdf_cube(self.path_to_pdfs, mode='r+')
+                self._pdf_cube_pid = os.getpid()
+            self._pdf_cube[indices] = pdfs
+
+        if self.path_to_pdf_archive is not None:
+            condition = ((self._pdf_archive is None) or
+                         (self._pdf_archive_pid != os.getpid()))
+            if condition:
+                self._pdf_archive = PDFArchive(
+                    self.path_to_pdf_archive, mode='a')
+                self._pdf_archive_pid = os.getpid()
+            components = list(self._p[self.version]['pdf_components'])
+            select = [components.index(component)
+                      for component in self.pdf_archive_components]
+            self._pdf_archive.write(indices, np.asarray(pdfs)[:, select])
+
+    def close_pdf_output(self):
+        """Close the PDF cube and archive opened by the current process."""
+        if (self._pdf_archive is not None) and\
+                (self._pdf_archive_pid == os.getpid()):
+            self._pdf_archive.close()
+        self._pdf_cube, self._pdf_cube_pid = None, None
+        self._pdf_archive, self._pdf_archive_pid = None, None
+
+    def get_bdc_files(self, source):
+        """Paths of the files the BDC may have written for a source."""
+        return [os.path.join(self.get_scratch_dir(), source + suffix)
+                for suffix in ('_sources_info.inp', ) +
+                self._p[self.version]['bdc_outputs']]
+
     def delete_all_temporary_files(self, source):
-        for filename in [f for f in os.listdir(self.path_to_bdc) if f.startswith(source)]:
-            os.remove(os.path.join(self.path_to_bdc, filename))
+        for filepath in self.get_bdc_files(source):
+            if os.path.exists(filepath):
+                os.remove(filepath)
 
-    def get_results(self, source, kda_ref=None, name=None):
+    def get_results(self, source, kda_ref=None, name=None,
+                    input_file_content=None, bdc_output=None):
         """
         Extract the distance results from the output file ({source_name}.prt)
         of the Bayesian distance calculator tool.
+
+        If `input_file_content` is not supplied, the BDC input line of the
+        source is read in from its {source_name}_sources_info.inp file. If
+        `bdc_output` is supplied, the summary and kinematic distances are
+        taken from these output lines of the BDC daemon instead of the files.
         """
-        suffix = self._p[self.version]['summary_suffix']
-        for filename in [f for f in os.listdir(self.path_to_bdc)
-                         if f.startswith(source) and f.endswith(suffix)]:
-            with open(os.path.join(self.path_to_bdc, filename), 'r') as fin:
-                result_file_content = fin.readlines()
-
-        for filename in [f for f in os.listdir(self.path_to_bdc)
-                         if f.startswith(source) and f.endswith("info.inp")]:
-            with open(os.path.join(self.path_to_bdc, filename), 'r') as fin:
+        result_file_content = self.get_summary_content(
+            source, bdc_output=bdc_output)
+
+        if input_file_content is None:
+            with open(os.path.join(self.get_scratch_dir(),
+                                   source + '_sources_info.inp'), 'r') as fin:
                 input_file_content = fin.readlines()
 
         if self.add_kinematic_distance:
             if self.version == '1.0':
                 kd_content = result_file_content.copy()
+            elif bdc_output is not None:
+                kd_content = bdc_output
+            elif self.get_bdc_output_level() == 1:
+                #  the kinematic distances are written to the summary file
+                with open(os.path.join(self.get_scratch_dir(), source + '_summary.prt'), 'r') as fin:
+                    kd_content = fin.readlines()
             elif self.version == '2.4':
-                with open(os.path.join(self.path_to_bdc, source + '.prt'), 'r') as fin:
+                with open(os.path.join(self.get_scratch_dir(), source + '.prt'), 'r') as fin:
                     kd_content = fin.readlines()
             kinDist = self.extract_kinematic_distances(kd_content)
         else:
@@ -416,8 +1315,8 @@ class BayesianDistance(object):
 
         if self.plot_probability:
             if self.save_temporary_files:
-                for filename in [f for f in os.listdir(self.path_to_bdc) if f.startswith(source)]:
-                    src = os.path.join(self.path_to_bdc, filename)
+                for src in filter(os.path.exists, self.get_bdc_files(source)):
+                    filename = os.path.basename(src)
                     if name is not None:
                         filename = filename.replace(source, name)
                     dst = os.path.join(
@@ -432,23 +1331,151 @@ class BayesianDistance(object):
         return results
 
     def run_bdc_script(self, source, input_string):
-        self.path_to_source = os.path.join(self.path_to_bdc, source)
-        filepath = '{}_sources_info.inp'.format(self.path_to_source)
-        with open(filepath, 'w') as fin:
+        scratch_dir = self.get_scratch_dir()
+        filepath = os.path.join(
+            scratch_dir, '{}_sources_info.inp'.format(source))
+        with self.stage('input_write'), open(filepath, 'w') as fin:
             fin.write(input_string)
-        self.make_fortran_out(source)
-        cwd = os.getcwd()
-        os.chdir(self.path_to_bdc)
-        os.system('./{}.out'.format(source))
-        os.chdir(cwd)
+        args = [self.path_to_executable, os.path.basename(filepath)]
+        if self.version == '2.4':
+            args.append(str(self.get_bdc_output_level()))
+        with self.stage('bdc_run'):
+            subprocess.call(args, cwd=scratch_dir)
 
-    def bdc_calculation_ok(self, source):
+    def get_bdc_daemon(self):
+        """Return the BDC daemon of the current process.
+
+        Each (worker) process starts its own daemon the first time it is
+        needed and keeps it alive for all subsequent sources.
+        """
+        condition = ((self._bdc_daemon is None) or
+                     (self._bdc_daemon_pid != os.getpid()) or
+                     not self._bdc_daemon.is_alive())
+        if condition:
+            self._bdc_daemon = BDCDaemon(
+                self.path_to_executable, self.get_scratch_dir(),
+                output_level=self.get_bdc_output_level())
+            self._bdc_daemon_pid = os.getpid()
+        return self._bdc_daemon
+
+    def close_bdc_daemon(self):
+        """Terminate the BDC daemon started by the current process."""
+        if (self._bdc_daemon is not None) and\
+                (self._bdc_daemon_pid == os.getpid()):
+            self._bdc_daemon.close()
+        self._bdc_daemon = None
+        self._bdc_daemon_pid = None
+
+    def get_bdc_async(self):
+        """Return the asyncio engine of the current process (see `AsyncBDC`).
+
+        At most `use_ncpus` BDC processes are run at the same time.
+        """
+        condition = ((self._bdc_async is None) or
+                     (self._bdc_async_pid != os.getpid()))
+        if condition:
+            max_processes = self.use_ncpus
+            if max_processes is None:
+                max_processes = int(0.75 * multiprocessing.cpu_count())
+            output_level = None
+            if self.version == '2.4':
+                output_level = self.get_bdc_output_level()
+            self._bdc_async = AsyncBDC(
+                self.path_to_executable, max_processes=max(1, max_processes),
+                output_level=output_level)
+            self._bdc_async_pid = os.getpid()
+        return self._bdc_async
+
+    def run_bdc_daemon(self, sources):
+        """Process sources with the BDC daemon and return its output lines."""
+        daemon = self.get_bdc_daemon()
+        return {src['source']: daemon.run_source(self.get_input_string(src))
+                for src in sources}
+
+    def get_bdc_in_process(self):
+        """Return the in-process BDC (NumPy implementation or extension)."""
+        if self._use_bdc_numpy:
+            if self._bdc_numpy is None:
+                self._bdc_numpy = BDCNumpy(self.path_to_bdc)
+            return self._bdc_numpy
+
+        if self._bdc_extension is None:
+            self._bdc_extension = BDCExtension(
+                self.path_to_extension, self.path_to_bdc)
+        return self._bdc_extension
+
+    def run_bdc_extension(self, sources):
+        """Process sources in-process with the BDC extension module.
+
+        If `bdc_numpy` is set, the NumPy implementation of the BDC is used
+        instead of the extension module.
+        """
+        return self.get_bdc_in_process().run(
+            [src['lon'] for src in sources], [src['lat'] for src in sources],
+            [src['vel'] for src in sources],
+            [self.get_e_vel(src['plusminus']) for src in sources],
+            [src['p_far'] for src in sources],
+            [self.prob_sa, self.prob_kd, self.prob_gl, self.prob_ps,
+             self.prob_pm], pdfs=self.save_pdfs(), fallback=True)
+
+    def extract_results_extension(self, src, output, i):
+        """Results of a source from the output of the BDC extension module.
+
+        The values are rounded like in the summary file of the BDC, so the
+        results are identical to the ones of `extract_results_v2p4`.
+        """
+        if not output['found'][i]:
+            return []
+
+        lon, lat = ['{:.2f}'.format(output[key][i]) for key in ['lon', 'lat']]
+
+        kin_dist = None
+        if self.add_kinematic_distance:
+            kin_dist = [np.nan, np.nan]
+            for k in range(output['n_kd'][i]):
+                kin_dist[k] = float('{:.2f}'.format(output['kin_dist'][i, k]))
+
+        results = []
+        for k in range(2):
+            dist, e_dist, prob = ['{:.2f}'.format(output[key][i, k])
+                                  for key in ['dist', 'e_dist', 'prob']]
+            c_u, c_v, c_w = self.get_cartesian_coords(
+                float(lon), float(lat), float(dist))
+
+            result = [2, dist, e_dist, prob, output['arm'][i, k],
+                      c_u, c_v, c_w, str(src['p_far'])]
+
+            if src['kda_ref'] is not None:
+                result += [src['kda_ref']]
+
+            if kin_dist is not None:
+                result += kin_dist
+
+            results.append(result)
+        return results
+
+    def get_summary_content(self, source, bdc_output=None):
+        """Read in the summary output of the BDC for a source.
+
+        For v2.4, lines with kinematic distances (output level 1 and daemon
+        output) are removed.
+        """
+        if bdc_output is None:
+            filepath = os.path.join(
+                self.get_scratch_dir(),
+                source + self._p[self.version]['summary_suffix'])
+            with open(filepath, 'r') as fin:
+                bdc_output = fin.readlines()
+
+        if self.version == '1.0':
+            return bdc_output
+        return [line for line in bdc_output
+                if 'Kinematic distance(s):' not in line]
+
+    def bdc_calculation_ok(self, source, bdc_output=None):
         """Check if BDC yielded any distance results."""
-        suffix = self._p[self.version]['summary_suffix']
-        for filename in [f for f in os.listdir(self.path_to_bdc)
-                         if f.startswith(source) and f.endswith(suffix)]:
-            with open(os.path.join(self.path_to_bdc, filename), 'r') as fin:
-                result_file_content = fin.readlines()
+        result_file_content = self.get_summary_content(
+            source, bdc_output=bdc_output)
         for line in result_file_content:
             if not line.startswith('!'):
                 return True
@@ -475,8 +1502,19 @@ class BayesianDistance(object):
 
         return plusminus
 
-    def determine_p_far_and_kda_ref(self, row, lon, lat, vel):
-        """Determine KDA prior and corresponding literature reference."""
+    def get_e_vel(self, plusminus):
+        """Velocity uncertainty of a BDC input string from `determine_e_vel`
+        (None for version '1.0', which has no velocity uncertainty)."""
+        if plusminus == '':
+            return None
+        return float(plusminus)
+
+    def determine_p_far_and_kda_ref(self, row, lon, lat, vel, prior=None):
+        """Determine KDA prior and corresponding literature reference.
+
+        `prior` is the result of `check_KDA` for the source if it was already
+        determined (see `determine_kda_priors`).
+        """
         p_far = 0.5
         kda_ref = None
 
@@ -489,6 +1527,8 @@ class BayesianDistance(object):
                 warnings.warn(
                     "KDA solutions need to be given as strings ('N', 'F')")
                 p_far = row[self.colnr_kda] * self.kda_weight
+        elif prior is not None:
+            p_far, kda_ref = prior
         elif self.check_for_kda_solutions:
             p_far, kda_ref = self.check_KDA(lon, lat, vel)
 
@@ -537,11 +1577,23 @@ class BayesianDistance(object):
         p_far = self.determine_pfar_from_vel_disp(dist_n, dist_f, vel_disp)
         return round(p_far, 2)
 
-    def determine(self, row, idx):
-        """Determine distance of lbv data point via the BDC."""
+    def prepare_source(self, row, idx, prior=None):
+        """Determine the BDC input parameters of an lbv data point.
+
+        `prior` is the literature KDA prior of the source if it was already
+        determined (see `determine_kda_priors`).
+
+        Returns
+        -------
+        dict
+            Contains the source name used for the BDC files, the index and
+            row of the input table, the name of the source, the lbv values, the KDA prior
+            (p_far) and the corresponding literature reference. If
+            `save_trace` is set, it also contains the trace of the source.
+
+        """
         row = list(row)
 
-        source = "SRC{}".format(str(idx).zfill(9))
         lon, lat, vel =\
             row[self.colnr_lon], row[self.colnr_lat], row[self.colnr_vel]
 
@@ -550,48 +1602,392 @@ class BayesianDistance(object):
             name = row[self.colnr_name]
 
         plusminus = self.determine_e_vel(row)
-        p_far, kda_ref = self.determine_p_far_and_kda_ref(row, lon, lat, vel)
+        start = time.perf_counter()
+        with self.stage('p_far_prior'):
+            p_far, kda_ref = self.determine_p_far_and_kda_ref(
+                row, lon, lat, vel, prior=prior)
+            p_far_source = self.get_p_far_source(p_far, kda_ref)
+            condition = ((p_far == 0.5) and
+                         self.prior_velocity_dispersion and
+                         (self.colnr_vel_disp is not None))
+            if condition:
+                p_far = self.determine_p_far_from_velocity_dispersion(
+                    row, lon, lat, vel)
+                p_far_source = 'velocity_dispersion'
+
+        src = {'source': "SRC{}".format(str(idx).zfill(9)), 'index': idx,
+               'row': row, 'name': name, 'lon': lon, 'lat': lat, 'vel': vel,
+               'plusminus': plusminus, 'p_far': p_far, 'kda_ref': kda_ref}
+        if self.save_trace:
+            src['trace'] = {
+                'p_far': p_far, 'p_far_source': p_far_source,
+                'fallback': False, 'origin': 'bdc',
+                'prior': time.perf_counter() - start, 'bdc': 0., 'parse': 0.}
+        return src
+
+    def get_dedup_key(self, row, prior=None):
+        """Quantised key of a row of the input table for deduplication.
+
+        Longitude, latitude, velocity and velocity uncertainty are rounded to
+        multiples of the corresponding `dedup_tolerance` values (or used as
+        they are for a tolerance of 0); the KDA prior and its reference need
+        to be identical, as well as the velocity dispersion if the prior is
+        determined from it. `prior` is the literature KDA prior of the row
+        (see `determine_kda_priors`).
+
+        The key is built from the columns of the row, so the velocity
+        dispersion prior is only calculated for the unique rows by
+        `prepare_source`.
+        """
+        row = list(row)
+        lon, lat, vel =\
+            row[self.colnr_lon], row[self.colnr_lat], row[self.colnr_vel]
+        values = [lon, lat, vel, self.get_e_vel(self.determine_e_vel(row))]
+        key = []
+        for value, tolerance in zip(values, self.dedup_tolerance):
+            if (tolerance > 0) and (value is not None):
+                value = int(np.round(value / tolerance))
+            key.append(value)
+
+        p_far, kda_ref = self.determine_p_far_and_kda_ref(
+            row, lon, lat, vel, prior=prior)
+        vel_disp = None
         condition = ((p_far == 0.5) and
                      self.prior_velocity_dispersion and
                      (self.colnr_vel_disp is not None))
         if condition:
-            p_far = self.determine_p_far_from_velocity_dispersion(
-                row, lon, lat, vel)
+            vel_disp = row[self.colnr_vel_disp]
+        return tuple(key) + (p_far, kda_ref, vel_disp)
+
+    def deduplicate_sources(self):
+        """Group rows of the input table with the same deduplication key.
+
+        Returns
+        -------
+        unique : numpy.ndarray
+            Indices of the first row of each group, for which the BDC is run.
+        inverse : numpy.ndarray
+            For each row of the input table, the position of its group in
+            `unique`.
 
-        input_string = "{a}\t{b}\t{c}\t{d}\t{e}{f}\t-\n".format(
-            a=source, b=lon, c=lat, d=vel, e=plusminus, f=p_far)
+        """
+        if len(self.dedup_tolerance) != 4:
+            raise Exception("'dedup_tolerance' needs to contain four values "
+                            "(lon, lat, vel, e_vel)")
+        groups = {}
+        unique = []
+        inverse = np.zeros(len(self.input_table), dtype='int64')
+        for idx, row in enumerate(self.input_table):
+            key = self.get_dedup_key(
+                row, prior=None if self._kda_priors is None
+                else self._kda_priors[idx])
+            if key not in groups:
+                groups[key] = len(unique)
+                unique.append(idx)
+            inverse[idx] = groups[key]
+        unique = np.array(unique, dtype='int64')
+
+        self.say("deduplication: {} unique of {} sources (ratio {:.2f})"
+                 .format(len(unique), len(inverse),
+                         len(inverse) / max(1, len(unique))))
+        return unique, inverse
+
+    def get_input_string(self, src):
+        """Line of the BDC input file for a source from `prepare_source`."""
+        return "{a}\t{b}\t{c}\t{d}\t{e}{f}\t-\n".format(
+            a=src['source'], b=src['lon'], c=src['lat'], d=src['vel'],
+            e=src['plusminus'], f=src['p_far'])
 
-        self.run_bdc_script(source, input_string)
+    def determine(self, row, idx):
+        """Determine distance of lbv data point via the BDC."""
+        return self.determine_chunk([row], [idx])[0]
 
-        #  rerun BDC calculation with p_far = 0.5 if chosen p_far value did not yield distance results
-        if (self.version == '2.4') and (p_far != 0.5):
-            if not self.bdc_calculation_ok(source):
-                self.delete_all_temporary_files(source)
+    def determine_chunk(self, rows, indices, priors=None):
+        """Determine distances of several lbv data points via one BDC run.
+
+        See `iter_determine_chunk`. If `profile` is set, the calculation is
+        profiled (see `profiling`).
+        """
+        with self.profiling():
+            return self.run_bdc_steps(
+                self.iter_determine_chunk(rows, indices, priors))
+
+    async def determine_chunk_async(self, rows, indices, priors=None):
+        """Coroutine determining distances of several lbv data points.
+
+        The BDC executable runs are awaited, so the chunks of several
+        concurrent coroutines are processed at the same time; at most
+        `use_ncpus` BDC processes are running at any time (see
+        `get_bdc_async`). Requires that `check_settings` and
+        `determine_column_indices` were called, as in `calculate_distances`.
+        See `iter_determine_chunk` for the parameters and returned results.
+        """
+        return await self.run_bdc_steps_async(
+            self.iter_determine_chunk(rows, indices, priors))
+
+    def iter_determine_chunk(self, rows, indices, priors=None):
+        """Determine distances of several lbv data points via one BDC run.
+
+        All sources are written to a single input file, so the BDC executable
+        is started (and reads in the spiral arm and parallax data) only once
+        for the whole chunk. For v2.4, sources whose p_far value did not yield
+        any distance results are rerun in a second BDC call with p_far = 0.5.
+        If `path_to_results_cache` is set, results of sources that were
+        already calculated with the same settings are taken from the cache.
+        If `path_to_bdc_grid` is set, distances are interpolated from the BDC
+        grid where possible and the interpolation error is added to the
+        results.
+
+        This is a generator that yields the BDC executable runs it needs (see
+        `iter_run_bdc`) and returns the results; it is driven by
+        `run_bdc_steps` or `run_bdc_steps_async`.
+
+        Parameters
+        ----------
+        rows : list
+            Rows of the input table.
+        indices : list
+            Indices of the rows in the input table.
+        priors : list
+            Literature KDA priors of the rows (see `determine_kda_priors`);
+            determined for each source with `check_KDA` if None.
+
+        Returns
+        -------
+        list
+            For each input row the list of its result rows.
+
+        """
+        if priors is None:
+            priors = len(rows) * [None]
+        sources = [self.prepare_source(row, idx, prior=prior)
+                   for row, idx, prior in zip(rows, indices, priors)]
+        self.count('sources', len(sources))
+
+        interpolated = {}
+        if self.use_bdc_grid():
+            interpolated = self.lookup_bdc_grid(sources)
+            self.count('interpolated', len(interpolated))
+            for i in interpolated:
+                if 'trace' in sources[i]:
+                    sources[i]['trace']['origin'] = 'grid'
+        exact = [src for i, src in enumerate(sources) if i not in interpolated]
+
+        if not exact:
+            results_exact = []
+        elif not self.use_results_cache():
+            results_exact = yield from self.iter_run_bdc(exact)
+        else:
+            #  the keys need to be determined before p_far is changed for
+            #  reruns
+            keys = [self.get_cache_key(src) for src in exact]
+            cache = self.get_results_cache()
+            cached = cache.get(keys)
+
+            missing = [i for i, key in enumerate(keys) if key not in cached]
+            self.count('cache_hits', len(keys) - len(missing))
+            for key, src in zip(keys, exact):
+                if (key in cached) and ('trace' in src):
+                    src['trace']['origin'] = 'cache'
+            if missing:
+                results_missing = yield from self.iter_run_bdc(
+                    [exact[i] for i in missing])
+                cache.put({keys[i]: results
+                           for i, results in zip(missing, results_missing)},
+                          self.version, self._model_hash)
+                cached.update(zip([keys[i] for i in missing], results_missing))
+            results_exact = [cached[key] for key in keys]
+        self.add_traces(sources)
+
+        if not self.use_bdc_grid():
+            return [[src['row'] + result for result in results]
+                    for src, results in zip(sources, results_exact)]
+
+        #  exact results have no interpolation error
+        results_exact = iter(results_exact)
+        results_chunk = []
+        for i, src in enumerate(sources):
+            if i in interpolated:
+                results, e_interp = interpolated[i]
+            else:
+                results, e_interp = next(results_exact), 0.
+            results_chunk.append([src['row'] + result + [e_interp]
+                                  for result in results])
+        return results_chunk
+
+    def run_bdc(self, sources):
+        """Calculate the distance results of sources from `prepare_source`.
+
+        See `iter_run_bdc`.
+        """
+        return self.run_bdc_steps(self.iter_run_bdc(sources))
+
+    def run_bdc_steps(self, steps):
+        """Drive a generator of BDC runs (see `iter_run_bdc`) and return its
+        return value."""
+        try:
+            request = next(steps)
+            while True:
+                request = steps.send(self.run_bdc_request(*request))
+        except StopIteration as e:
+            return e.value
+
+    async def run_bdc_steps_async(self, steps):
+        """Drive a generator of BDC runs (see `iter_run_bdc`) with the asyncio
+        engine and return its return value."""
+        try:
+            request = next(steps)
+            while True:
+                chunk, sources = request
+                with self.stage('input_write'):
+                    input_string = ''.join(
+                        self.get_input_string(src) for src in sources)
+                #  other coroutines run while the BDC run is awaited, so it
+                #  is not timed as a stage
+                wall = time.perf_counter()
+                await self.get_bdc_async().run(
+                    self.get_scratch_dir(), chunk, input_string)
+                if self.use_instrumentation():
+                    self.get_stats().add(
+                        'bdc_run', time.perf_counter() - wall)
+                self.count('bdc_runs')
+                request = steps.send({})
+        except StopIteration as e:
+            return e.value
+
+    def run_bdc_request(self, chunk, sources):
+        """Run the BDC for sources from `prepare_source`.
+
+        Returns
+        -------
+        dict
+            Output lines of the BDC daemon for the source names; empty if the
+            BDC executable wrote the output files instead.
 
-                p_far = 0.5
-                input_string = "{a}\t{b}\t{c}\t{d}\t{e}{f}\t-\n".format(
-                    a=source, b=lon, c=lat, d=vel, e=plusminus, f=p_far)
-                self.run_bdc_script(source, input_string)
+        """
+        self.count('bdc_runs')
+        if self.bdc_daemon:
+            with self.stage('bdc_run'):
+                return self.run_bdc_daemon(sources)
+        with self.stage('input_write'):
+            input_string = ''.join(
+                self.get_input_string(src) for src in sources)
+        self.run_bdc_script(chunk, input_string)
+        return {}
+
+    def iter_run_bdc(self, sources):
+        """Calculate the distance results of sources from `prepare_source`.
+
+        This is a generator that yields the name of the BDC input file and the
+        sources of each BDC run it needs, is sent the output of the run (see
+        `run_bdc_request`), and returns the results. For the extension module
+        and the NumPy implementation of the BDC, no runs are yielded.
+
+        Returns
+        -------
+        list
+            For each source the list of its results (without the row of the
+            input table).
+
+        """
+        if self._use_bdc_numpy or (self.path_to_extension is not None):
+            return self.determine_chunk_extension(sources)
+
+        if len(sources) == 1:
+            chunk = sources[0]['source']
+        else:
+            chunk = "CHUNK{}".format(str(sources[0]['index']).zfill(9))
 
-        rows = []
-        results = self.get_results(source, kda_ref=kda_ref, name=name)
-        for result in results:
-            rows.append(row + result)
+        start = time.perf_counter()
+        bdc_outputs = yield chunk, sources
+        self.add_trace_time(sources, 'bdc', time.perf_counter() - start)
+        self.record_scratch_usage()
 
-        return rows
+        #  rerun BDC calculation with p_far = 0.5 if chosen p_far value did not yield distance results
+        if self.version == '2.4':
+            with self.stage('parse'):
+                rerun = [src for src in sources if (src['p_far'] != 0.5) and
+                         not self.bdc_calculation_ok(
+                             src['source'],
+                             bdc_output=bdc_outputs.get(src['source']))]
+                for src in rerun:
+                    self.delete_all_temporary_files(src['source'])
+                    src['p_far'] = 0.5
+            if rerun:
+                self.count('fallback_reruns', len(rerun))
+                for src in rerun:
+                    if 'trace' in src:
+                        src['trace']['fallback'] = True
+                start = time.perf_counter()
+                bdc_outputs.update((yield chunk, rerun))
+                self.add_trace_time(rerun, 'bdc', time.perf_counter() - start)
+
+        if self.save_pdfs():
+            with self.stage('pdf_output'):
+                self.store_pdfs([src['index'] for src in sources], [
+                    read_pdf_files(
+                        os.path.join(self.get_scratch_dir(), src['source']),
+                        self._p[self.version]['pdf_components'])
+                    for src in sources])
+
+        results_chunk = []
+        with self.stage('parse'):
+            for src in sources:
+                start = time.perf_counter()
+                results_chunk.append(self.get_results(
+                    src['source'], kda_ref=src['kda_ref'], name=src['name'],
+                    input_file_content=[self.get_input_string(src)],
+                    bdc_output=bdc_outputs.get(src['source'])))
+                self.add_trace_time(
+                    [src], 'parse', time.perf_counter() - start)
+
+        self.delete_all_temporary_files(chunk)
+
+        return results_chunk
+
+    def determine_chunk_extension(self, sources):
+        """Determine distances of sources with the BDC extension module.
+
+        Sources whose p_far value did not yield any distance results are
+        evaluated with p_far = 0.5 in the same run, which gives the same
+        results as the rerun in `run_bdc`.
+        """
+        self.count('bdc_runs')
+        start = time.perf_counter()
+        with self.stage('bdc_run'):
+            output = self.run_bdc_extension(sources)
+        self.add_trace_time(sources, 'bdc', time.perf_counter() - start)
+
+        for i, src in enumerate(sources):
+            if (output['p_far'][i] == 0.5) and (src['p_far'] != 0.5):
+                self.count('fallback_reruns')
+                if 'trace' in src:
+                    src['trace']['fallback'] = True
+                src['p_far'] = 0.5
+
+        if self.save_pdfs():
+            with self.stage('pdf_output'):
+                self.store_pdfs(
+                    [src['index'] for src in sources], output['pdfs'])
+
+        results_chunk = []
+        with self.stage('parse'):
+            for i, src in enumerate(sources):
+                start = time.perf_counter()
+                results_chunk.append(
+                    self.extract_results_extension(src, output, i))
+                self.add_trace_time(
+                    [src], 'parse', time.perf_counter() - start)
+        return results_chunk
 
     def get_values_from_init_file(self, init_file):
         """Read in values from init file."""
-        import ast
-        import configparser
-        config = configparser.ConfigParser()
-        config.read(init_file)
+        self.set_kda_info_parameters(read_kda_info_ini(init_file))
 
-        for key, value in config['DEFAULT'].items():
-            try:
-                setattr(self, '_' + key, ast.literal_eval(value))
-            except ValueError:
-                raise Exception('Could not parse parameter {} from config file'.format(key))
+    def set_kda_info_parameters(self, parameters):
+        """Set the parameters of a KDA info table (see `read_kda_info_ini`)."""
+        for key, value in parameters.items():
+            setattr(self, '_' + key, value)
 
     def gaussian_weight(self, x, std=False):
         """Calculate the Gaussian weight.
@@ -610,12 +2006,12 @@ class BayesianDistance(object):
     def point_in_ellipse(self, table, lon, lat):
         """Adapted from: https://stackoverflow.com/questions/7946187/
         See also: https://math.stackexchange.com/questions/426150/"""
-        cos_pa = table['cos_pa'].data
-        sin_pa = table['sin_pa'].data
-        glon = table['GLON'].data
-        glat = table['GLAT'].data
-        aa = table['aa'].data
-        bb = table['bb'].data
+        cos_pa = np.asarray(table['cos_pa'])
+        sin_pa = np.asarray(table['sin_pa'])
+        glon = np.asarray(table['GLON'])
+        glat = np.asarray(table['GLAT'])
+        aa = np.asarray(table['aa'])
+        bb = np.asarray(table['bb'])
 
         a = (cos_pa * (lon - glon) + sin_pa * (lat - glat))**2
         b = (sin_pa * (lon - glon) - cos_pa * (lat - glat))**2
@@ -637,8 +2033,9 @@ class BayesianDistance(object):
 
         Parameters
         ----------
-        table : astropy.table.table.Table
-            Table containing sources with solved kinematic distance ambiguities.
+        table : astropy.table.table.Table or dict
+            Table (or columns) containing sources with solved kinematic
+            distance ambiguities.
         vel : float
             vlsr position of the coordinate.
 
@@ -650,8 +2047,8 @@ class BayesianDistance(object):
             Array of the weight values.
 
         """
-        vlsr = table['VLSR'].data.data
-        dvlsr = table['d_VLSR'].data.data
+        vlsr = np.asarray(table['VLSR'])
+        dvlsr = np.asarray(table['d_VLSR'])
 
         x = np.abs(vlsr - vel) / dvlsr
 
@@ -696,19 +2093,24 @@ class BayesianDistance(object):
 
     def check_KDA(self, lon, lat, vel):
         weights_kda, refs = np.array([]), []
-        dirname = os.path.dirname(
-            os.path.dirname(os.path.realpath(__file__)))
-
-        for table, tablename in zip(self._kda_tables, self.kda_info_tables):
-            path_to_ini = os.path.join(dirname, 'KDA_info', tablename + '.ini')
-            self.get_values_from_init_file(path_to_ini)
+        kda_info_indices = self._kda_info_indices or len(self._kda_tables) * [
+            None]
+
+        for table, parameters, kda_info_index in zip(
+                self._kda_tables, self._kda_parameters, kda_info_indices):
+            self.set_kda_info_parameters(parameters)
+            if kda_info_index is not None:
+                rows = kda_info_index.query(lon, lat, vel)
+                if len(rows) == 0:
+                    continue
+                table = kda_info_index.get_rows(rows)
             mask_pp, weight_pp = self.point_in_ellipse(table, lon, lat)
             mask_vlsr, weight_vlsr = self.get_weight_velocity(table, vel)
 
             mask_total = np.logical_and(mask_pp, mask_vlsr)
             weight_total = weight_pp * weight_vlsr
             weight_total = weight_total[mask_total]
-            p_far_values = table['p_far'].data
+            p_far_values = np.asarray(table['p_far'])
             p_far_values = p_far_values[mask_total]
 
             n_values = np.count_nonzero(mask_total)
@@ -728,25 +2130,152 @@ class BayesianDistance(object):
 
         return round(float(p_far), 2), ref
 
+    def check_KDA_batch(self, lon, lat, vel):
+        """Vectorised `check_KDA` for arrays of sources.
+
+        The weights of the candidate pairs of sources and rows of each KDA
+        info table (see `bdc_kda.KDAInfoIndex.iter_pairs`) are calculated
+        with `point_in_ellipse` and `get_weight_velocity` in chunks of a
+        bounded number of pairs. The weighted averages of the associated rows
+        are calculated for all sources with the same number of associated
+        rows at once, summing in the same order as `np.average`, and the
+        weights of the tables are combined as in `get_kda`, which is only
+        called for sources with ties. The results are identical to those of
+        `check_KDA`.
+
+        Returns
+        -------
+        list
+            p_far value and KDA reference of each source.
+
+        """
+        lon, lat, vel = (np.asarray(values, dtype=float)
+                         for values in (lon, lat, vel))
+        n_sources, n_tables = len(lon), len(self._kda_tables)
+        weights = np.zeros((n_sources, n_tables))
+        found = np.zeros((n_sources, n_tables), dtype=bool)
+        refs = []
+        kda_info_indices = self._kda_info_indices or [
+            KDAInfoIndex(table, parameters) for table, parameters in zip(
+                self._kda_tables, self._kda_parameters)]
+
+        for k, (parameters, kda_info_index) in enumerate(
+                zip(self._kda_parameters, kda_info_indices)):
+            self.set_kda_info_parameters(parameters)
+            refs.append(self._reference)
+            for sources, rows in kda_info_index.iter_pairs(lon, lat, vel):
+                table = kda_info_index.get_rows(rows)
+                mask_pp, weight_pp = self.point_in_ellipse(
+                    table, lon[sources], lat[sources])
+                mask_vlsr, weight_vlsr = self.get_weight_velocity(
+                    table, vel[sources])
+
+                mask_total = np.logical_and(mask_pp, mask_vlsr)
+                weight_total = (weight_pp * weight_vlsr)[mask_total]
+                p_far_values = table['p_far'][mask_total]
+                sources = sources[mask_total]
+                if not len(sources):
+                    continue
+
+                #  the associated rows of each source are consecutive
+                unique, first, n_values = np.unique(
+                    sources, return_index=True, return_counts=True)
+                found[unique, k] = True
+                single = n_values == 1
+                weights[unique[single], k] = self._weight_cat * p_far_values[
+                    first[single]] * weight_total[first[single]]
+                values = p_far_values * weight_total
+                for n in np.unique(n_values[~single]):
+                    group = n_values == n
+                    pairs = first[group][:, np.newaxis] + np.arange(n)
+                    weight_sum = weight_total[pairs].sum(axis=1)
+                    if np.any(weight_sum == 0.0):
+                        raise ZeroDivisionError(
+                            "Weights sum to zero, can't be normalized")
+                    weights[unique[group], k] = self._weight_cat * (
+                        np.multiply(values[pairs], weight_total[pairs]).sum(
+                            axis=1) / weight_sum)
+
+        #  `get_kda` for the sources with a single largest absolute weight
+        weights_abs = np.where(found, np.abs(weights), -np.inf)
+        ties = found & (weights_abs == weights_abs.max(axis=1, initial=-np.inf)[
+            :, np.newaxis])
+        unique = (ties.sum(axis=1) == 1) & np.all(
+            np.isfinite(weights) | ~found, axis=1)
+        largest = np.argmax(ties, axis=1)
+
+        results = []
+        for i in range(n_sources):
+            if not found[i].any():
+                weight_kda, ref = 0, '--'
+            elif unique[i]:
+                weight_kda, ref = weights[i, largest[i]], refs[largest[i]]
+            else:
+                weight_kda, ref = self.get_kda(
+                    weights[i, found[i]],
+                    [refs[k] for k in np.flatnonzero(found[i])])
+            p_far = 0.5 + weight_kda
+            results.append((round(float(p_far), 2), ref))
+        return results
+
+    def get_kda_priors(self, indices):
+        """Literature KDA priors of rows of the input table determined by
+        `calculate_distances` (None if they were not determined)."""
+        if self._kda_priors is None:
+            return None
+        return [self._kda_priors[idx] for idx in indices]
+
+    def determine_kda_priors(self, table):
+        """Literature KDA priors of the rows of a table in one pass.
+
+        Returns
+        -------
+        list
+            p_far value and KDA reference of each row (see
+            `check_KDA_batch`), which are passed to the BDC runs of the rows
+            instead of calling `check_KDA` for each source; None if the prior
+            is not determined from the KDA info tables or if none of
+            `kda_prior_batch`, `deduplicate` and the BDC grid is used.
+
+        """
+        condition = ((self.kda_prior_batch or self.deduplicate or
+                      self.use_bdc_grid()) and
+                     self.check_for_kda_solutions and (self.colnr_kda is None))
+        if not condition:
+            return None
+        with self.stage('p_far_prior'):
+            return self.check_KDA_batch(*[
+                table.columns[colnr] for colnr in
+                [self.colnr_lon, self.colnr_lat, self.colnr_vel]])
+
     def get_cartesian_coords(self, lon, lat, dist):
         from astropy.coordinates import SkyCoord
         from astropy import units as u
 
-        c = SkyCoord(l=lon*u.degree,
-                     b=lat*u.degree,
-                     distance=dist*u.kpc,
-                     frame='galactic')
-        c.representation_type = 'cartesian'
-        c_u = round(c.u.value, 4)
-        c_v = round(c.v.value, 4)
-        c_w = round(c.w.value, 4)
+        with self.stage('cartesian'):
+            c = SkyCoord(l=lon*u.degree,
+                         b=lat*u.degree,
+                         distance=dist*u.kpc,
+                         frame='galactic')
+            c.representation_type = 'cartesian'
+            c_u = round(c.u.value, 4)
+            c_v = round(c.v.value, 4)
+            c_w = round(c.w.value, 4)
 
         return c_u, c_v, c_w
 
     def calculate_distances(self):
+        self.initialize_run_report()
         self.check_settings()
+        if self.save_trace:
+            self._trace_writer = TraceWriter(self.get_trace_path())
         self.say('calculating Bayesian distance...')
 
+        if self.streaming:
+            n_sources = self.calculate_distances_streaming()
+            self.finish_run_report(n_sources)
+            return
+
         if self.input_table is None:
             self.input_table = Table.read(
                 self.path_to_input_table, format=self.table_format)
@@ -754,25 +2283,101 @@ class BayesianDistance(object):
             # self.input_table = self.input_table[62000:62001]
         self.determine_column_indices()
 
-        condition = (self.prior_velocity_dispersion and
-                     (self.colnr_vel_disp is None))
-        if condition:
-            self.colnr_vel_disp = False
-            warnings.warn(str("Did not specify 'colnr_vel_disp' or 'colname_vel_disp'. Setting 'prior_velocity_dispersion=False'."))
+        self._kda_priors = self.determine_kda_priors(self.input_table)
+        if self.use_bdc_grid():
+            self.initialize_bdc_grid(self.get_bdc_grid_positions(
+                self.input_table, self._kda_priors))
+
+        indices = list(range(len(self.input_table)))
+        if self.deduplicate:
+            unique, inverse = self.deduplicate_sources()
+            indices = [int(i) for i in unique]
+
+        completed, checkpoint = {}, None
+        if self.checkpoint or self.resume:
+            completed = self.initialize_checkpoint()
+            checkpoint = self.append_checkpoint
+        remaining = [i for i in indices if i not in completed]
+
+        #  when resuming, the PDFs of the completed sources are kept
+        if self.save_pdfs() and not completed:
+            self.initialize_pdf_output(len(self.input_table))
+        elif self.save_pdfs():
+            for path in [self.path_to_pdfs, self.path_to_pdf_archive]:
+                if (path is not None) and not os.path.exists(path):
+                    raise Exception(
+                        "Cannot resume without the PDFs of the completed "
+                        "sources in '{}'".format(path))
 
         from . import BD_multiprocessing
-        BD_multiprocessing.init([self, self.input_table])
-        results_list = BD_multiprocessing.func(use_ncpus=self.use_ncpus)
+        if self.bdc_async and (self.path_to_work_queue is not None):
+            raise Exception("'bdc_async' cannot be combined with "
+                            "'path_to_work_queue'")
+        if self.bdc_async:
+            chunks = determine_distances_async(
+                self, self.input_table, remaining,
+                chunk_size=self.bdc_chunk_size)
+        elif self.path_to_work_queue is not None:
+            use_ncpus = self.use_ncpus
+            if self.work_queue_workers is not None:
+                use_ncpus = self.work_queue_workers
+            chunks = BD_multiprocessing.determine_distances_queue(
+                self, self.input_table, remaining,
+                chunk_size=self.work_queue_chunk_size, use_ncpus=use_ncpus)
+        else:
+            chunks = BD_multiprocessing.determine_distances(
+                self, self.input_table, remaining,
+                chunk_size=self.bdc_chunk_size, use_ncpus=self.use_ncpus)
+        for chunk, results_chunk in chunks:
+            completed.update(zip(chunk, results_chunk))
+            #  only the sources without errors are added to the checkpoint
+            done = [k for k, item in enumerate(results_chunk)
+                    if isinstance(item, list)]
+            if (checkpoint is not None) and done:
+                checkpoint([chunk[k] for k in done],
+                           [results_chunk[k] for k in done])
+        self._kda_priors = None
+        self.close_bdc_daemon()
+        self.remove_scratch_dir()
+        self.close_pdf_output()
+        if self._checkpoint is not None:
+            self._checkpoint.close()
+
+        with self.stage('table_assembly'):
+            results_list = [completed[i] for i in indices]
+
+            if self.deduplicate:
+                #  fan the results out to all rows, each with its own row
+                #  values
+                n_cols = len(self.input_table.colnames)
+                results_list = [
+                    [list(row) + result[n_cols:] for result in results_list[i]]
+                    if isinstance(results_list[i], list) else results_list[i]
+                    for row, i in zip(self.input_table, inverse)]
+                duplicates = np.flatnonzero(unique[inverse] != np.arange(
+                    len(inverse)))
+                if self.save_pdfs() and duplicates.size:
+                    self.copy_duplicate_pdfs(
+                        duplicates, unique[inverse[duplicates]])
+        if self.path_to_results_cache is not None:
+            n_removed = self.get_results_cache().evict(
+                self.results_cache_size * 1024**2)
+            if n_removed:
+                self.say('removed {} old entries from results cache'.format(
+                    n_removed))
+            self.close_results_cache()
         print('SUCCESS\n')
 
-        for i, item in enumerate(results_list):
-            if not isinstance(item, list):
-                self.say("Error for distance with index {}: {}".format(i, item))
-                del results_list[i]
-                continue
+        with self.stage('table_assembly'):
+            for i, item in enumerate(results_list):
+                if not isinstance(item, list):
+                    self.say("Error for distance with index {}: {}".format(
+                        i, item))
+                    del results_list[i]
+                    continue
 
-        results_list = np.array([item for sublist in results_list
-                                 for item in sublist])
+            results_list = np.array([item for sublist in results_list
+                                     for item in sublist])
 
         if self.save_temporary_files:
             filepath = os.path.join(
@@ -783,6 +2388,107 @@ class BayesianDistance(object):
 
         self.create_astropy_table(results_list)
 
+        if (self._checkpoint is not None) and not self.save_temporary_files:
+            self._checkpoint.remove()
+        self._checkpoint = None
+        condition = ((self.path_to_work_queue is not None) and
+                     not self.save_temporary_files)
+        if condition:
+            WorkQueue(self.path_to_work_queue).remove()
+        self.finish_run_report(len(self.input_table))
+
+    def calculate_distances_streaming(self):
+        """Calculate distances with bounded memory for very large tables.
+
+        The input table is read in chunks of `stream_chunk_size` rows, whose
+        sources (including their priors) are processed by the worker
+        processes in tasks of `bdc_chunk_size` sources. The results of each
+        chunk are appended to the output table as soon as the chunk and all
+        preceding chunks are completed. While the workers process the tasks
+        of up to `stream_max_chunks` chunks, the next chunks are read and the
+        completed chunks are written, so only these chunks are held in memory.
+
+        Returns the number of sources.
+        """
+        condition = (self.deduplicate or self.checkpoint or self.resume or
+                     self.bdc_async or (self.path_to_work_queue is not None))
+        if condition:
+            raise Exception("'streaming' cannot be combined with "
+                            "'deduplicate', 'checkpoint', 'resume', "
+                            "'bdc_async' or 'path_to_work_queue'")
+        if get_reader_format(self.table_format) is None:
+            raise Exception(
+                "'streaming' requires a 'table_format' supported by the fast "
+                "ascii reader of Astropy: 'ascii', 'csv' or "
+                "'ascii.{{{}}}'".format(','.join(STREAM_FORMATS)))
+
+        source = self.input_table
+        if source is None:
+            source = self.path_to_input_table
+
+        def chunks():
+            return iter_table_chunks(
+                source, self.table_format, max(1, int(self.stream_chunk_size)))
+
+        #  the first chunk defines the columns of the input table
+        offset, self.input_table = next(chunks())
+        self.input_table = self.input_table[:0]
+        self.determine_column_indices()
+
+        #  the grid and the PDF output need the ranges and number of sources
+        if self.use_bdc_grid() or self.save_pdfs():
+            n_sources, ranges = 0, [[np.inf, -np.inf] for _ in range(3)]
+            n_grid = 0
+            for offset, chunk in chunks():
+                n_sources += len(chunk)
+                if not self.use_bdc_grid():
+                    continue
+                positions = self.get_bdc_grid_positions(
+                    chunk, self.determine_kda_priors(chunk))
+                n_grid += len(positions[0])
+                if not len(positions[0]):
+                    continue
+                for limits, values in zip(ranges, positions):
+                    limits[0] = min(limits[0], np.min(values))
+                    limits[1] = max(limits[1], np.max(values))
+            if self.use_bdc_grid():
+                self.initialize_bdc_grid(ranges, n_sources=n_grid)
+            if self.save_pdfs():
+                self.initialize_pdf_output(n_sources)
+
+        from . import BD_multiprocessing
+        chunk_size = max(1, int(self.bdc_chunk_size))
+        tasks_per_chunk = -(-max(1, int(self.stream_chunk_size)) // chunk_size)
+        writer = TableWriter(self.path_to_table, self.table_format)
+        n_sources = 0
+        for offset, results_list in BD_multiprocessing.stream(
+                self, chunks(), chunk_size=chunk_size,
+                use_ncpus=self.use_ncpus, max_pending=max(
+                    1, self.stream_max_chunks) * tasks_per_chunk):
+            for i, item in enumerate(results_list):
+                if not isinstance(item, list):
+                    self.say("Error for distance with index {}: {}".format(
+                        offset + i, item))
+            with self.profiling(), self.stage('table_assembly'):
+                table = self.get_results_table(np.array(
+                    [item for sublist in results_list
+                     if isinstance(sublist, list) for item in sublist]))
+            with self.stage('table_write'):
+                writer.write(table)
+            n_sources += len(results_list)
+        writer.close()
+
+        self.close_bdc_daemon()
+        self.remove_scratch_dir()
+        self.close_pdf_output()
+        if self.path_to_results_cache is not None:
+            self.get_results_cache().evict(self.results_cache_size * 1024**2)
+            self.close_results_cache()
+        print('SUCCESS\n')
+        self.say(">> saved table '{}' in {} ({} sources)\n".format(
+                 self.table_file, self.dirname_table, n_sources))
+        return n_sources
+
     def galactocentric_distance(self, glon, dist_los, glat=None):
         """Calculate galactocentric distance.
 
@@ -808,6 +2514,18 @@ class BayesianDistance(object):
     def create_astropy_table(self, results):
         self.say('creating Astropy table...')
 
+        with self.profiling(), self.stage('table_assembly'):
+            self.table_results = self.get_results_table(results)
+
+        self.say(">> saved table '{}' in {}\n".format(
+                 self.table_file, self.dirname_table))
+
+        with self.stage('table_write'):
+            self.table_results.write(
+                self.path_to_table, format=self.table_format, overwrite=True)
+
+    def get_results_table(self, results):
+        """Astropy table of the result rows of sources."""
         added_colnames = ['comp', 'dist', 'e_dist', 'prob', 'arm',
                           'c_u', 'c_v', 'c_w', 'p_far']
 
@@ -823,31 +2541,34 @@ class BayesianDistance(object):
         if self.add_kinematic_distance:
             added_colnames += ['kDist_1', 'kDist_2']
             added_dtype += ['f4', 'f4']
+        if self.use_bdc_grid():
+            added_colnames += ['e_interp']
+            added_dtype += ['f4']
 
         names = self.input_table.colnames + added_colnames
         dtype = dtypeinput_table + added_dtype
 
-        self.table_results = Table(data=results, names=names, dtype=dtype)
+        if len(results) == 0:
+            table = Table(names=names, dtype=dtype)
+        else:
+            table = Table(data=results, names=names, dtype=dtype)
 
         if self.add_galactocentric_distance:
             rgal = self.galactocentric_distance(
-                np.radians(self.table_results[self.colname_lon].data),
-                self.table_results['dist'].data,
-                glat=np.radians(self.table_results[self.colname_lat].data))
-            self.table_results.add_column(Column(data=rgal, name='rgal'))
+                np.radians(table[self.colname_lon].data),
+                table['dist'].data,
+                glat=np.radians(table[self.colname_lat].data))
+            table.add_column(Column(data=rgal, name='rgal'))
 
         for key in ['c_u', 'c_v', 'c_w', 'rgal']:
-            if key in self.table_results.colnames:
-                self.table_results[key].format = "{0:.3f}"
-        for key in ['dist', 'e_dist', 'prob', 'p_far', 'kDist_1', 'kDist_2']:
-            if key in self.table_results.colnames:
-                self.table_results[key].format = "{0:.2f}"
-
-        self.say(">> saved table '{}' in {}\n".format(
-                 self.table_file, self.dirname_table))
+            if key in table.colnames:
+                table[key].format = "{0:.3f}"
+        for key in ['dist', 'e_dist', 'prob', 'p_far', 'kDist_1', 'kDist_2',
+                    'e_interp']:
+            if key in table.colnames:
+                table[key].format = "{0:.2f}"
 
-        self.table_results.write(self.path_to_table, format=self.table_format,
-                                 overwrite=True)
+        return table
 
     def choose_distance(self, probabilities, distances, dist_errors):
         """Choose distance from alternative solutions.
@@ -993,30 +2714,30 @@ class BayesianDistance(object):
                 return max_dist
 
         distKD, probKD = np.loadtxt(
-            os.path.join(self.path_to_bdc, '{}_kinematic_distance_pdf.dat'.format(source)),
+            os.path.join(self.get_scratch_dir(), '{}_kinematic_distance_pdf.dat'.format(source)),
             usecols=(0, 1), skiprows=2, unpack=True)
 
         if self.version == '1.0':
             distGL, probGL = np.loadtxt(
-                os.path.join(self.path_to_bdc, '{}_latitude_pdf.dat'.format(source)),
+                os.path.join(self.get_scratch_dir(), '{}_latitude_pdf.dat'.format(source)),
                 usecols=(0, 1), skiprows=2, unpack=True)
 
             distSA, probSA = np.loadtxt(
-                os.path.join(self.path_to_bdc, '{}_spiral_arm_pdf.dat'.format(source)),
+                os.path.join(self.get_scratch_dir(), '{}_spiral_arm_pdf.dat'.format(source)),
                 usecols=(0, 1), skiprows=2, unpack=True)
         elif self.version == '2.4':
             distSA, probSA = np.loadtxt(
-                os.path.join(self.path_to_bdc, '{}_arm_latitude_pdf.dat'.format(source)),
+                os.path.join(self.get_scratch_dir(), '{}_arm_latitude_pdf.dat'.format(source)),
                 usecols=(0, 1), skiprows=2, unpack=True)
 
             distGL, probGL = distSA, probSA
 
         arm_ranges_lower, arm_ranges_upper = np.loadtxt(
-            os.path.join(self.path_to_bdc, '{}_arm_ranges.dat'.format(source)),
+            os.path.join(self.get_scratch_dir(), '{}_arm_ranges.dat'.format(source)),
             usecols=(0, 1), skiprows=2, unpack=True)
 
         spiral_arms = np.genfromtxt(
-            os.path.join(self.path_to_bdc, '{}_arm_ranges.dat'.format(source)),
+            os.path.join(self.get_scratch_dir(), '{}_arm_ranges.dat'.format(source)),
             skip_header=2, usecols=2, dtype='str')
 
         skip_spiral_arm_ranges = False
@@ -1032,11 +2753,11 @@ class BayesianDistance(object):
             skip_spiral_arm_ranges = True
 
         distPS, probPS = np.loadtxt(
-            os.path.join(self.path_to_bdc, '{}_parallaxes_pdf.dat'.format(source)),
+            os.path.join(self.get_scratch_dir(), '{}_parallaxes_pdf.dat'.format(source)),
             usecols=(0, 1), skiprows=2, unpack=True)
 
         distFD, probFD = np.loadtxt(
-            os.path.join(self.path_to_bdc, '{}_final_distance_pdf.dat'.format(source)),
+            os.path.join(self.get_scratch_dir(), '{}_final_distance_pdf.dat'.format(source)),
             usecols=(0, 1), skiprows=2, unpack=True)
 
         max_dist = 0
@@ -1,8 +1,19 @@
+import ast
+import configparser
+import hashlib
+import json
 import os
+import warnings
 import numpy as np
 from astropy.table import Table
 from astropy import units as u
 
+from .bdc_build import default_cache_dir
+
+#  columns of the KDA info tables that are used for the P_far prior
+KDA_INFO_KEYS = ['GLON', 'GLAT', 'VLSR', 'd_VLSR', 'p_far',
+                 'cos_pa', 'sin_pa', 'aa', 'bb']
+
 
 def kda_info_table(t, glon='', glat='', vlsr='', dvlsr='', kda='',
                    a='', b='', pa='', factor_dvlsr=1., factor_a=1., factor_b=1.,
@@ -144,3 +155,131 @@ def kda_info_table_ini(reference, weight_cat=1, threshold_spatial=1,
     )
 
     return text_ini
+
+
+def read_kda_info_ini(path_to_ini):
+    """Read the parameters of a KDA info table from its init file.
+
+    Returns
+    -------
+    dict
+        Parameters ('reference', 'weight_cat', 'threshold_spatial',
+        'threshold_spectral', 'size' and 'linewidth') with their parsed
+        values.
+
+    """
+    config = configparser.ConfigParser()
+    config.read(path_to_ini)
+
+    parameters = {}
+    for key, value in config['DEFAULT'].items():
+        try:
+            parameters[key] = ast.literal_eval(value)
+        except ValueError:
+            raise Exception('Could not parse parameter {} from config file'.format(key))
+    return parameters
+
+
+def kda_info_signature(path_to_kda_info):
+    """Names, sizes and modification times of the KDA info tables and their
+    init files; the store of the tables is rebuilt if they change."""
+    signature = []
+    for name in sorted(os.listdir(path_to_kda_info)):
+        if name.endswith(('.dat', '.ini')):
+            stat = os.stat(os.path.join(path_to_kda_info, name))
+            signature.append([name, stat.st_size, stat.st_mtime_ns])
+    return signature
+
+
+def build_kda_info_store(path_to_kda_info, path_to_store=None):
+    """Collect all KDA info tables and their parameters in a single file.
+
+    The columns `KDA_INFO_KEYS` of the tables are saved as NumPy arrays in an
+    uncompressed .npz file together with the parsed parameters of the init
+    files and the signature of the source files (see `kda_info_signature`).
+    The file is written to a temporary file first and then moved in place,
+    so concurrent builds do not interfere with each other.
+
+    Parameters
+    ----------
+    path_to_kda_info : str
+        Directory containing the KDA info tables ('<name>.dat') and their
+        init files ('<name>.ini').
+    path_to_store : str
+        Path of the .npz file. The tables are only collected, but not saved,
+        if None.
+
+    Returns
+    -------
+    dict
+        Columns ({column name: numpy.ndarray}) and parameters of the tables,
+        with the table names as keys.
+
+    """
+    signature = kda_info_signature(path_to_kda_info)
+    store, arrays = {}, {}
+    for name in sorted(name[:-4] for name, _, _ in signature
+                       if name.endswith('.ini')):
+        table = Table.read(os.path.join(
+            path_to_kda_info, name + '.dat'), format='ascii')
+        columns = {key: np.asarray(table[key]) for key in KDA_INFO_KEYS}
+        parameters = read_kda_info_ini(
+            os.path.join(path_to_kda_info, name + '.ini'))
+        store[name] = (columns, parameters)
+        for key, values in columns.items():
+            arrays['{}/{}'.format(name, key)] = values
+
+    if path_to_store is not None:
+        meta = {'signature': signature,
+                'parameters': {name: store[name][1] for name in store}}
+        path_to_tmp = '{}.{}.tmp.npz'.format(path_to_store, os.getpid())
+        try:
+            os.makedirs(os.path.dirname(path_to_store) or '.', exist_ok=True)
+            np.savez(path_to_tmp, meta=np.array(json.dumps(meta)), **arrays)
+            os.replace(path_to_tmp, path_to_store)
+        except OSError as e:
+            warnings.warn("Could not save the KDA info store '{}': {}".format(
+                path_to_store, e))
+            if os.path.exists(path_to_tmp):
+                os.remove(path_to_tmp)
+    return store
+
+
+def load_kda_info_store(path_to_kda_info, path_to_cache=None):
+    """Load the KDA info tables and their parameters from their store.
+
+    The store is kept in `path_to_cache` under a name containing a hash of
+    the absolute path of `path_to_kda_info`; it is (re)built with
+    `build_kda_info_store` if it does not exist yet or if one of the tables
+    or init files was added, removed or modified since it was built.
+
+    Parameters
+    ----------
+    path_to_kda_info : str
+        Directory containing the KDA info tables and their init files.
+    path_to_cache : str
+        Directory of the store. Defaults to `default_cache_dir()`.
+
+    Returns
+    -------
+    dict
+        Columns ({column name: numpy.ndarray}) and parameters of the tables,
+        with the table names as keys.
+
+    """
+    if path_to_cache is None:
+        path_to_cache = default_cache_dir()
+    path_to_kda_info = os.path.abspath(path_to_kda_info)
+    path_to_store = os.path.join(path_to_cache, 'kda_info-{}.npz'.format(
+        hashlib.sha256(path_to_kda_info.encode()).hexdigest()[:16]))
+
+    try:
+        with np.load(path_to_store) as data:
+            meta = json.loads(str(data['meta']))
+            if meta['signature'] == kda_info_signature(path_to_kda_info):
+                return {name: ({key: data['{}/{}'.format(name, key)]
+                                for key in KDA_INFO_KEYS}, parameters)
+                        for name, parameters in meta['parameters'].items()}
+    except (OSError, ValueError, KeyError):
+        pass
+    return build_kda_info_store(path_to_kda_info, path_to_store)
@@ -0,0 +1,143 @@
+import asyncio
+import collections
+import os
+
+from tqdm import tqdm
+
+#  number of chunks per BDC process whose results have not been yielded yet
+TASKS_PER_PROCESS = 4
+
+
+class AsyncBDC(object):
+    def __init__(self, path_to_executable, max_processes=1,
+                 output_level=None):
+        """Run the BDC executable in concurrent subprocesses with asyncio.
+
+        Since the BDC calculations happen in the external Fortran processes,
+        a single Python process can keep several of them busy: the processes
+        are started with `asyncio.create_subprocess_exec` and their output
+        files are parsed as soon as they exit. A semaphore limits the number
+        of BDC processes running at the same time.
+
+        Parameters
+        ----------
+        path_to_executable : str
+            Path to the compiled BDC.
+        max_processes : int
+            Maximum number of concurrently running BDC processes.
+        output_level : int
+            Output level passed to the BDC (v2.4); not passed if None.
+        """
+        self.path_to_executable = path_to_executable
+        self.max_processes = max(1, int(max_processes))
+        self.output_level = output_level
+        self._semaphore = None
+        self._loop = None
+
+    def get_semaphore(self):
+        """Return the semaphore of the running event loop."""
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._semaphore = asyncio.Semaphore(self.max_processes)
+            self._loop = loop
+        return self._semaphore
+
+    async def run(self, scratch_dir, name, input_string):
+        """Run the BDC executable for the sources of an input file.
+
+        The input is written to '{name}_sources_info.inp' in `scratch_dir`
+        and the BDC writes its output files to the same directory. If the
+        coroutine is cancelled, the BDC process is killed.
+
+        Returns
+        -------
+        int
+            Return code of the BDC process.
+
+        """
+        async with self.get_semaphore():
+            filename = '{}_sources_info.inp'.format(name)
+            with open(os.path.join(scratch_dir, filename), 'w') as fout:
+                fout.write(input_string)
+            args = [self.path_to_executable, filename]
+            if self.output_level is not None:
+                args.append(str(self.output_level))
+            process = await asyncio.create_subprocess_exec(
+                *args, cwd=scratch_dir)
+            try:
+                return await process.wait()
+            except asyncio.CancelledError:
+                process.kill()
+                await process.wait()
+                raise
+
+
+def determine_distances(bd, table, indices, chunk_size=1, max_pending=None):
+    """Determine the distances of rows of a table with the asyncio engine.
+
+    The chunks of rows are processed by concurrent coroutines (see
+    `BayesianDistance.determine_chunk_async`) in an event loop owned by this
+    generator, which only runs while the generator waits for the next
+    result.
+
+    Parameters
+    ----------
+    bd : BayesianDistance
+        Object determining the distances.
+    table : astropy.table.Table
+        Input table.
+    indices : list
+        Indices of the rows that are processed.
+    chunk_size : int
+        Number of rows per BDC run.
+    max_pending : int
+        Maximum number of chunks whose results have not been yielded yet;
+        `TASKS_PER_PROCESS` per BDC process by default.
+
+    Yields
+    ------
+    chunk : list
+        Indices of the rows of a chunk, in the order of `indices`.
+    results : list
+        Results of the rows; the exception if the chunk failed.
+
+    """
+    chunk_size = max(1, int(chunk_size))
+    if max_pending is None:
+        max_pending = TASKS_PER_PROCESS * bd.get_bdc_async().max_processes
+
+    loop = asyncio.new_event_loop()
+    pending = collections.deque()
+    offsets = iter(range(0, len(indices), chunk_size))
+    try:
+        with tqdm(total=-(-len(indices) // chunk_size), unit='it',
+                  unit_scale=True, leave=True) as progress:
+            while True:
+                for k in offsets:
+                    chunk = [int(idx) for idx in indices[k:k + chunk_size]]
+                    pending.append((chunk, loop.create_task(
+                        bd.determine_chunk_async(
+                            [list(table[idx]) for idx in chunk], chunk,
+                            bd.get_kda_priors(chunk)))))
+                    if len(pending) >= max_pending:
+                        break
+                if not pending:
+                    break
+                chunk, task = pending.popleft()
+                try:
+                    with bd.profiling():
+                        result = loop.run_until_complete(task)
+                except Exception as e:
+                    result = len(chunk) * [e]
+                #  the coroutines record their stages and traces in the run
+                #  report of `bd`
+                bd.merge_stats(bd.pop_stats())
+                progress.update()
+                yield chunk, result
+    finally:
+        for chunk, task in pending:
+            task.cancel()
+        if pending:
+            loop.run_until_complete(asyncio.gather(
+                *[task for chunk, task in pending], return_exceptions=True))
+        loop.close()
@@ -0,0 +1,116 @@
+import hashlib
+import os
+import subprocess
+
+
+def default_cache_dir():
+    """Return the default directory for the compiled BDC executables."""
+    cache_home = os.environ.get(
+        'XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache'))
+    return os.path.join(cache_home, 'BD_wrapper')
+
+
+def get_compiler_version(compiler='gfortran'):
+    """Return the version string of the Fortran compiler."""
+    try:
+        output = subprocess.run(
+            [compiler, '--version'], stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT, check=True).stdout
+    except (OSError, subprocess.CalledProcessError):
+        raise Exception(
+            "Could not run Fortran compiler '{}'".format(compiler))
+    return output.decode(errors='replace').splitlines()[0]
+
+
+def build_hash(path_to_fortran, compiler='gfortran', flags=()):
+    """Content hash of the Fortran source and the compiler settings.
+
+    Parameters
+    ----------
+    path_to_fortran : str or list
+        Path(s) to the Fortran source file(s) of the BDC.
+    compiler : str
+        Name of or path to the Fortran compiler.
+    flags : list
+        Compiler flags (e.g. optimisation flags).
+
+    Returns
+    -------
+    str
+        Hexadecimal digest that changes whenever the Fortran source, the
+        compiler (version) or the compiler flags change.
+
+    """
+    if isinstance(path_to_fortran, str):
+        path_to_fortran = [path_to_fortran]
+    sha = hashlib.sha256()
+    for path in path_to_fortran:
+        with open(path, 'rb') as fin:
+            sha.update(fin.read())
+    sha.update(get_compiler_version(compiler).encode())
+    sha.update(' '.join([compiler] + list(flags)).encode())
+    return sha.hexdigest()[:16]
+
+
+def get_bdc_executable(path_to_fortran, compiler='gfortran', flags=('-O2',),
+                       path_to_cache=None, verbose=False):
+    """Return the path to a compiled BDC executable, building it if needed.
+
+    The executable is stored in a subdirectory of `path_to_cache` whose name
+    contains a hash of the Fortran source and the compiler settings, so it is
+    reused across runs and worker processes and only rebuilt if the Fortran
+    source or the compiler flags change. The executable is compiled to a
+    temporary file first and then moved in place, so concurrent builds of the
+    same configuration do not interfere with each other.
+
+    Parameters
+    ----------
+    path_to_fortran : str
+        Path to the Fortran source file of the BDC.
+    compiler : str
+        Name of or path to the Fortran compiler.
+    flags : list
+        Compiler flags (e.g. optimisation flags).
+    path_to_cache : str
+        Directory in which the compiled executables are stored. Defaults to
+        `default_cache_dir()`.
+    verbose : bool
+        Print a message if the executable needs to be compiled.
+
+    Returns
+    -------
+    str
+        Path to the compiled executable.
+
+    """
+    if path_to_cache is None:
+        path_to_cache = default_cache_dir()
+    flags = list(flags)
+
+    name = os.path.splitext(os.path.basename(path_to_fortran))[0]
+    dirname = os.path.join(path_to_cache, '{}-{}'.format(
+        name, build_hash(path_to_fortran, compiler=compiler, flags=flags)))
+    path_to_executable = os.path.join(dirname, name + '.out')
+
+    if os.path.exists(path_to_executable):
+        return path_to_executable
+
+    if verbose:
+        print("compiling '{}' with '{}'...".format(
+            os.path.basename(path_to_fortran), ' '.join([compiler] + flags)))
+
+    os.makedirs(dirname, exist_ok=True)
+    path_to_tmp = '{}.{}.tmp'.format(path_to_executable, os.getpid())
+    try:
+        result = subprocess.run(
+            [compiler] + flags + [path_to_fortran, '-o', path_to_tmp],
+            stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        if result.returncode != 0:
+            raise Exception("Compilation of '{}' failed:\n{}".format(
+                path_to_fortran, result.stdout.decode(errors='replace')))
+        os.replace(path_to_tmp, path_to_executable)
+    finally:
+        if os.path.exists(path_to_tmp):
+            os.remove(path_to_tmp)
+
+    return path_to_executable
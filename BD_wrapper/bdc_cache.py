@@ -0,0 +1,147 @@
+import hashlib
+import os
+import pickle
+import sqlite3
+import time
+
+from .bdc_scratch import is_bdc_input
+
+
+def model_hash(path_to_bdc, path_to_fortran):
+    """Content hash of the BDC source code and its input data files.
+
+    Parameters
+    ----------
+    path_to_bdc : str
+        Directory containing the BDC input files (Galaxy model, spiral arm
+        and parallax data).
+    path_to_fortran : str
+        Path to the Fortran source file of the BDC.
+
+    Returns
+    -------
+    str
+        Hexadecimal digest that changes whenever the Fortran source or one
+        of the input data files changes.
+
+    """
+    sha = hashlib.sha256()
+    filenames = sorted(filter(is_bdc_input, os.listdir(path_to_bdc)))
+    for path in [path_to_fortran] + [
+            os.path.join(path_to_bdc, f) for f in filenames]:
+        sha.update(os.path.basename(path).encode())
+        with open(path, 'rb') as fin:
+            sha.update(fin.read())
+    return sha.hexdigest()[:16]
+
+
+class BDCResultCache(object):
+    def __init__(self, path_to_cache, timeout=60.):
+        """On-disk cache of the BDC results of individual sources.
+
+        The results are stored in an SQLite database under a key that
+        identifies the input values of a source and the BDC settings (see
+        `BayesianDistance.get_cache_key`). Each entry also records the BDC
+        version and the hash of the BDC model it was calculated with, so
+        outdated entries can be removed with `invalidate`, and the time it was
+        last used, so the cache can be limited in size with `evict`.
+
+        Parameters
+        ----------
+        path_to_cache : str
+            Path to the SQLite database file; created if it does not exist.
+        timeout : float
+            Seconds to wait for a lock held by another process.
+        """
+        dirname = os.path.dirname(path_to_cache)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        self.path_to_cache = path_to_cache
+        #  the connection of a thread may be closed by the main thread
+        self.connection = sqlite3.connect(
+            path_to_cache, timeout=timeout, check_same_thread=False)
+        #  concurrent readers do not block the writing worker process
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        with self.connection:
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS results ('
+                'key TEXT PRIMARY KEY, version TEXT, model TEXT, value BLOB, '
+                'size INTEGER, last_used REAL)')
+            self.connection.execute(
+                'CREATE INDEX IF NOT EXISTS results_last_used '
+                'ON results (last_used)')
+
+    def __len__(self):
+        return self.connection.execute(
+            'SELECT COUNT(*) FROM results').fetchone()[0]
+
+    def get(self, keys):
+        """Return a dictionary with the cached results of the given keys."""
+        results = {}
+        for key in keys:
+            row = self.connection.execute(
+                'SELECT value FROM results WHERE key = ?', (key, )).fetchone()
+            if row is not None:
+                results[key] = pickle.loads(row[0])
+        if results:
+            with self.connection:
+                self.connection.executemany(
+                    'UPDATE results SET last_used = ? WHERE key = ?',
+                    [(time.time(), key) for key in results])
+        return results
+
+    def put(self, results, version, model):
+        """Store results (dictionary with the keys as keys) in the cache."""
+        rows = []
+        for key, value in results.items():
+            value = pickle.dumps(value)
+            rows.append((key, version, model, value, len(value), time.time()))
+        with self.connection:
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?)',
+                rows)
+
+    def invalidate(self, version, model):
+        """Remove entries of a BDC version calculated with another model.
+
+        Returns
+        -------
+        int
+            Number of removed entries.
+
+        """
+        with self.connection:
+            return self.connection.execute(
+                'DELETE FROM results WHERE version = ? AND model != ?',
+                (version, model)).rowcount
+
+    def evict(self, max_size):
+        """Remove the least recently used entries above `max_size` bytes.
+
+        Returns
+        -------
+        int
+            Number of removed entries.
+
+        """
+        total = self.connection.execute(
+            'SELECT COALESCE(SUM(size), 0) FROM results').fetchone()[0]
+        remove = []
+        for key, size in self.connection.execute(
+                'SELECT key, size FROM results ORDER BY last_used'):
+            if total <= max_size:
+                break
+            remove.append((key, ))
+            total -= size
+        with self.connection:
+            self.connection.executemany(
+                'DELETE FROM results WHERE key = ?', remove)
+        return len(remove)
+
+    def clear(self):
+        """Remove all entries."""
+        with self.connection:
+            self.connection.execute('DELETE FROM results')
+
+    def close(self):
+        self.connection.close()
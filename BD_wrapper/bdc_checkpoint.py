@@ -0,0 +1,94 @@
+import os
+import pickle
+import time
+
+
+class Checkpoint(object):
+    def __init__(self, path_to_checkpoint, fsync_interval=60.):
+        """Append-only checkpoint file of the results of a distance run.
+
+        The first record of the file contains metadata identifying the run
+        (number of sources, columns and settings); each further record
+        contains the indices of a chunk of completed input rows and their
+        results. Records are pickled one after another, so a record that was
+        only partly written when the run was interrupted is simply ignored.
+
+        Parameters
+        ----------
+        path_to_checkpoint : str
+            Path to the checkpoint file.
+        fsync_interval : float
+            Minimum number of seconds between forcing the written records to
+            disk; records are flushed to the operating system immediately.
+        """
+        self.path_to_checkpoint = path_to_checkpoint
+        self.fsync_interval = fsync_interval
+        self._fout = None
+        self._last_fsync = 0.
+
+    def exists(self):
+        return os.path.exists(self.path_to_checkpoint)
+
+    def read(self):
+        """Read in the checkpoint file.
+
+        Returns
+        -------
+        meta : dict
+            Metadata of the run.
+        results : dict
+            Results of the completed input rows with their indices as keys.
+        size : int
+            Size of the complete records in bytes.
+
+        """
+        meta, results = None, {}
+        size = 0
+        with open(self.path_to_checkpoint, 'rb') as fin:
+            try:
+                meta = pickle.load(fin)
+                size = fin.tell()
+                while True:
+                    indices, results_chunk = pickle.load(fin)
+                    results.update(zip(indices, results_chunk))
+                    size = fin.tell()
+            except Exception:
+                #  an incomplete last record can raise other errors than
+                #  EOFError and UnpicklingError, depending on where it was
+                #  cut off
+                pass
+        return meta, results, size
+
+    def open(self, meta, resume=False):
+        """Open the checkpoint file for appending records.
+
+        Unless `resume` is set, the file is started anew with `meta`. When
+        resuming, an incomplete last record is removed first.
+        """
+        self.close()
+        if resume and self.exists():
+            size = self.read()[2]
+            self._fout = open(self.path_to_checkpoint, 'ab')
+            self._fout.truncate(size)
+        else:
+            self._fout = open(self.path_to_checkpoint, 'wb')
+            pickle.dump(meta, self._fout)
+            self._fout.flush()
+
+    def append(self, indices, results):
+        """Append the results of completed input rows."""
+        pickle.dump(([int(i) for i in indices], results), self._fout)
+        self._fout.flush()
+        if time.time() - self._last_fsync > self.fsync_interval:
+            os.fsync(self._fout.fileno())
+            self._last_fsync = time.time()
+
+    def close(self):
+        if self._fout is not None:
+            self._fout.close()
+        self._fout = None
+
+    def remove(self):
+        self.close()
+        if self.exists():
+            os.remove(self.path_to_checkpoint)
@@ -0,0 +1,76 @@
+import subprocess
+
+
+class BDCDaemon(object):
+    def __init__(self, path_to_executable, cwd, output_level=1):
+        """Long-running BDC process that is fed with sources over pipes.
+
+        The BDC executable (v2.4) is started with '-' as sources file, which
+        makes it read in the Galaxy model, spiral arm and parallax data only
+        once and then process source lines from its standard input until the
+        pipe is closed. For each source the summary lines (including the
+        kinematic distances) are written to standard output, terminated by a
+        '! END' line.
+
+        Parameters
+        ----------
+        path_to_executable : str
+            Path to the compiled BDC executable.
+        cwd : str
+            Working directory of the BDC process, containing the BDC input
+            files (galaxy_data_Univ.inp, probability_controls.inp, ...).
+        output_level : int
+            Output level of the BDC: 0 (summary lines), 1 (summary lines
+            and kinematic distances) or 2 (also print out and PDF files of
+            each source in `cwd`).
+        """
+        self.path_to_executable = path_to_executable
+        self.cwd = cwd
+        self.process = subprocess.Popen(
+            [path_to_executable, '-', str(output_level)], cwd=cwd,
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+            universal_newlines=True, bufsize=1)
+
+    def is_alive(self):
+        return self.process.poll() is None
+
+    def run_source(self, input_string):
+        """Process one source and return the output lines of the BDC.
+
+        Parameters
+        ----------
+        input_string : str
+            Line of the BDC input file describing the source.
+
+        Returns
+        -------
+        list
+            Output lines of the BDC for the source, without the terminating
+            '! END' line.
+
+        """
+        if not input_string.endswith('\n'):
+            input_string += '\n'
+        try:
+            self.process.stdin.write(input_string)
+            self.process.stdin.flush()
+        except BrokenPipeError:
+            raise Exception('BDC daemon process terminated unexpectedly')
+
+        lines = []
+        while True:
+            line = self.process.stdout.readline()
+            if not line:
+                raise Exception(
+                    'BDC daemon process terminated unexpectedly while '
+                    'processing: {}'.format(input_string.strip()))
+            if line.startswith('! END'):
+                return lines
+            lines.append(line)
+
+    def close(self):
+        """Close the input pipe, which terminates the BDC process."""
+        if self.process.stdin is not None and not self.process.stdin.closed:
+            self.process.stdin.close()
+        self.process.wait()
+        self.process.stdout.close()
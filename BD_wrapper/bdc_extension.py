@@ -0,0 +1,226 @@
+import importlib.machinery
+import importlib.util
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+
+import numpy as np
+
+from .bdc_build import build_hash, default_cache_dir
+
+#  order of the component PDFs returned by 'bdc_batch'
+PDF_COMPONENTS = ('kinematic_distance', 'arm', 'latitude', 'arm_latitude',
+                  'parallaxes', 'final_distance')
+
+MODULE_NAME = 'bdc_v2p4'
+
+#  data directories with which the BDC model was read in by the extension
+#  modules loaded in the current process
+_initialized = {}
+#  the BDC keeps its model data and work arrays in static variables, which
+#  are shared by all threads of a process
+_lock = threading.Lock()
+
+
+def strip_main_program(fortran_source):
+    """Remove the main program from the source code of the BDC."""
+    lines = fortran_source.splitlines()
+    for start, line in enumerate(lines):
+        if re.match(r'^\s+program\s', line, re.IGNORECASE):
+            break
+    else:
+        return fortran_source
+
+    for end in range(start, len(lines)):
+        if re.match(r'^\s+end\s*$', lines[end], re.IGNORECASE):
+            break
+    return '\n'.join(lines[:start] + lines[end + 1:]) + '\n'
+
+
+def get_bdc_extension(path_to_fortran, path_to_interface,
+                      compiler='gfortran', flags=('-O2',), path_to_cache=None,
+                      verbose=False):
+    """Return the path to the compiled BDC extension, building it if needed.
+
+    The extension module is built with f2py from the entry points in
+    `path_to_interface` and the subroutines of the BDC in `path_to_fortran`
+    (without its main program), with static local variables in all
+    subroutines ('-fno-automatic'). Like the BDC executables, it is cached in a
+    subdirectory of `path_to_cache` whose name contains a hash of the Fortran
+    sources, the compiler settings and the NumPy version.
+
+    Parameters
+    ----------
+    path_to_fortran : str
+        Path to the Fortran source file of the BDC.
+    path_to_interface : str
+        Path to the Fortran source file containing the entry points of the
+        extension module.
+    compiler : str
+        Name of or path to the Fortran compiler.
+    flags : list
+        Compiler flags (e.g. optimisation flags).
+    path_to_cache : str
+        Directory in which the compiled extension is stored. Defaults to
+        `default_cache_dir()`.
+    verbose : bool
+        Print a message if the extension needs to be compiled.
+
+    Returns
+    -------
+    str
+        Path to the compiled extension module.
+
+    """
+    if path_to_cache is None:
+        path_to_cache = default_cache_dir()
+    #  the per-source calculation was part of the main program of the BDC,
+    #  whose variables are static; keep the local variables of the
+    #  subroutines static, too, so that results do not depend on the stack
+    flags = list(flags) + ['-fno-automatic']
+
+    name = os.path.splitext(os.path.basename(path_to_fortran))[0]
+    dirname = os.path.join(path_to_cache, '{}-{}-{}'.format(
+        name, MODULE_NAME, build_hash(
+            [path_to_fortran, path_to_interface], compiler=compiler,
+            flags=flags + ['numpy-{}'.format(np.__version__)])))
+    path_to_extension = os.path.join(
+        dirname, MODULE_NAME + importlib.machinery.EXTENSION_SUFFIXES[0])
+
+    if os.path.exists(path_to_extension):
+        return path_to_extension
+
+    if verbose:
+        print("compiling extension module of '{}' with '{}'...".format(
+            os.path.basename(path_to_fortran), ' '.join([compiler] + flags)))
+
+    os.makedirs(dirname, exist_ok=True)
+    path_to_build = tempfile.mkdtemp(dir=dirname)
+    try:
+        with open(path_to_fortran, 'r') as fin:
+            fortran_source = strip_main_program(fin.read())
+        path_to_library = os.path.join(path_to_build, 'bdc_lib.f')
+        with open(path_to_library, 'w') as fout:
+            fout.write(fortran_source)
+
+        env = dict(os.environ, FC=compiler, F77=compiler, F90=compiler)
+        result = subprocess.run(
+            [sys.executable, '-m', 'numpy.f2py', '-c', '-m', MODULE_NAME,
+             path_to_interface, path_to_library,
+             'only:', 'bdc_init', 'bdc_batch', ':',
+             '--opt={}'.format(' '.join(flags))],
+            cwd=path_to_build, env=env, stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT)
+
+        built = [f for f in os.listdir(path_to_build)
+                 if f.startswith(MODULE_NAME) and
+                 f.endswith(importlib.machinery.EXTENSION_SUFFIXES[0])]
+        if (result.returncode != 0) or not built:
+            raise Exception("Compilation of extension module failed:\n{}".format(
+                result.stdout.decode(errors='replace')[-2000:]))
+        os.replace(os.path.join(path_to_build, built[0]), path_to_extension)
+    finally:
+        shutil.rmtree(path_to_build, ignore_errors=True)
+
+    return path_to_extension
+
+
+def load_bdc_extension(path_to_extension):
+    """Import the compiled BDC extension module."""
+    spec = importlib.util.spec_from_file_location(
+        MODULE_NAME, path_to_extension)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class BDCExtension(object):
+    def __init__(self, path_to_extension, path_to_bdc):
+        """In-process BDC (v2.4) via its compiled extension module.
+
+        The Galaxy model, spiral arm and parallax data are read in once per
+        process from the input files in `path_to_bdc`; afterwards sources are
+        processed without any input/output files or subprocesses.
+
+        Parameters
+        ----------
+        path_to_extension : str
+            Path to the compiled extension module (see `get_bdc_extension`).
+        path_to_bdc : str
+            Directory containing the BDC input files (galaxy_data_Univ.inp,
+            parallax_data.inp, spiral arm files, ...).
+        """
+        self.path_to_extension = path_to_extension
+        self.path_to_bdc = path_to_bdc
+        self.module = load_bdc_extension(path_to_extension)
+
+        with _lock:
+            if _initialized.get(path_to_extension) != path_to_bdc:
+                if len(path_to_bdc) > 256:
+                    raise Exception(
+                        "Path to BDC input files is too long: {}".format(
+                            path_to_bdc))
+                self.module.bdc_init(path_to_bdc)
+                _initialized[path_to_extension] = path_to_bdc
+
+    def run(self, lon, lat, vel, e_vel, p_far, p_max, pdfs=False,
+            fallback=False):
+        """Calculate the distances of several sources.
+
+        Parameters
+        ----------
+        lon, lat, vel, e_vel, p_far : array_like
+            Galactic longitudes and latitudes [deg], velocities and their
+            uncertainties [km/s] and KDA priors of the sources.
+        p_max : list
+            Maximum probabilities of the SA, KD, GL, PS and PM components.
+        pdfs : bool
+            Also return the component PDFs of the sources.
+        fallback : bool
+            Recalculate sources whose p_far value does not yield any distance
+            results with p_far = 0.5 in the same evaluation. Only the
+            kinematic distance PDF depends on p_far, so all other component
+            PDFs are reused.
+
+        Returns
+        -------
+        dict
+            Arrays of the rounded coordinates ('lon', 'lat'), the number and
+            values of kinematic distances ('n_kd', 'kin_dist'), flags whether
+            distances were found ('found'), the p_far values of the results
+            ('p_far'), and the distances, uncertainties, integrated
+            probabilities and arms of the first and second peak ('dist',
+            'e_dist', 'prob', 'arm'; shape (n, 2)). If `pdfs` is set,
+            'pdfs' contains the component PDFs (shape (n, 6, 1001); see
+            `PDF_COMPONENTS`) and 'dist_bins' the corresponding distances.
+
+        """
+        for value in p_max:
+            if not 0 <= value <= 1:
+                raise Exception(
+                    "Maximum probabilities need to be between 0 and 1")
+
+        arrays = [np.atleast_1d(np.asarray(values, dtype='float64'))
+                  for values in (lon, lat, vel, e_vel, p_far)]
+        nb = 1001 if pdfs else 1
+        with _lock:
+            (lon, lat, n_kd, kin_dist, n_res, dist, e_dist, prob, arm, flag,
+             pdf_values, p_far) = self.module.bdc_batch(
+                 *arrays, *p_max, nb, int(fallback))
+
+        #  arm names are written with the quality flags ('?', '??') appended
+        arm = np.array(
+            [[(a[:3] + q).decode().strip() for a, q in zip(row_a, row_q)]
+             for row_a, row_q in zip(arm, flag)], dtype='object')
+
+        results = {'lon': lon, 'lat': lat, 'n_kd': n_kd, 'kin_dist': kin_dist,
+                   'found': n_res > 0, 'p_far': p_far, 'dist': dist,
+                   'e_dist': e_dist, 'prob': prob, 'arm': arm}
+        if pdfs:
+            results['pdfs'] = pdf_values
+            results['dist_bins'] = 0.025 * np.arange(1, 1002)
+        return results
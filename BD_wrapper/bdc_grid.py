@@ -0,0 +1,162 @@
+import itertools
+import os
+
+import numpy as np
+
+#  results of the BDC stored for each node of the grid
+GRID_KEYS = ('found', 'p_far', 'n_kd', 'kin_dist', 'dist', 'e_dist', 'prob',
+             'arm')
+
+
+def grid_axis(values, spacing):
+    """Regular grid axis covering `values`, aligned to multiples of `spacing`.
+
+    The axis has at least two nodes.
+    """
+    start = np.floor(np.min(values) / spacing) * spacing
+    stop = np.ceil(np.max(values) / spacing) * spacing
+    n_nodes = max(2, int(round((stop - start) / spacing)) + 1)
+    return np.round(start + spacing * np.arange(n_nodes), 6)
+
+
+class BDCGrid(object):
+    def __init__(self, axes, values, meta):
+        """Results of the BDC on a regular (l, b, v) grid.
+
+        The distances, their uncertainties, the integrated probabilities and
+        the kinematic distances of sources are interpolated trilinearly from
+        the eight grid nodes surrounding them (see `lookup`).
+
+        Parameters
+        ----------
+        axes : list
+            Longitude and latitude [deg] and velocity [km/s] axes of the grid.
+        values : dict
+            Results of the BDC for the grid nodes (see `GRID_KEYS`), each with
+            the shape of the grid in the first three axes.
+        meta : dict
+            Settings with which the grid was calculated ('version', 'model',
+            'p_far', 'e_vel', 'p_max').
+        """
+        self.axes = [np.asarray(axis, dtype='float64') for axis in axes]
+        self.values = values
+        self.meta = meta
+
+    @classmethod
+    def load(cls, path_to_grid):
+        """Read in a grid saved with `save`."""
+        with np.load(path_to_grid) as data:
+            axes = [data['axis_{}'.format(i)] for i in range(3)]
+            values = {key: data[key] for key in GRID_KEYS}
+            meta = {'version': str(data['meta_version']),
+                    'model': str(data['meta_model']),
+                    'p_far': float(data['meta_p_far']),
+                    'e_vel': float(data['meta_e_vel']),
+                    'p_max': data['meta_p_max'].tolist()}
+        values['arm'] = values['arm'].astype('object')
+        return cls(axes, values, meta)
+
+    def save(self, path_to_grid):
+        """Save the grid as a NumPy `.npz` file."""
+        dirname = os.path.dirname(path_to_grid)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        data = {'axis_{}'.format(i): axis for i, axis in enumerate(self.axes)}
+        data.update(self.values)
+        data['arm'] = self.values['arm'].astype('U')
+        data.update({'meta_' + key: value
+                     for key, value in self.meta.items()})
+        with open(path_to_grid, 'wb') as fout:
+            np.savez_compressed(fout, **data)
+
+    def matches(self, meta):
+        """Check whether the grid was calculated with the given settings."""
+        return all(np.all(np.asarray(self.meta[key]) == np.asarray(value))
+                   for key, value in meta.items())
+
+    def covers(self, lon, lat, vel):
+        """Check whether all positions lie within the grid."""
+        return all((np.min(x) >= axis[0]) and (np.max(x) <= axis[-1])
+                   for x, axis in zip([lon, lat, vel], self.axes))
+
+    def lookup(self, lon, lat, vel, tolerance=0.1):
+        """Interpolate the BDC results at the given positions.
+
+        The results of a position are only valid if the eight surrounding grid
+        nodes agree, i.e. they all yielded distances (with the same p_far
+        value), their spiral arm assignments and numbers of kinematic distances
+        are identical, and the distances of each peak differ by at most
+        `tolerance` (kpc). Otherwise, e.g. at a switch between arms or peaks,
+        or outside of the grid, the BDC has to be run for the source.
+
+        Parameters
+        ----------
+        lon, lat, vel : array_like
+            Galactic longitudes and latitudes [deg] and velocities [km/s].
+        tolerance : float
+            Maximum difference of the distances of a peak at the surrounding
+            grid nodes [kpc].
+
+        Returns
+        -------
+        dict
+            Interpolated results with the same keys as the output of
+            `BDCExtension.run`; 'valid' flags the positions with valid
+            results and 'e_interp' gives the maximum difference between the
+            interpolated distance of the first peak and its values at the
+            surrounding grid nodes [kpc] as an estimate of the interpolation
+            error.
+
+        """
+        positions = [np.atleast_1d(np.asarray(x, dtype='float64'))
+                     for x in (lon, lat, vel)]
+        n = positions[0].size
+
+        inside = np.ones(n, dtype='bool')
+        lower, frac = [], []
+        for x, axis in zip(positions, self.axes):
+            spacing = axis[1] - axis[0]
+            i = np.floor((x - axis[0]) / spacing).astype('int64')
+            #  positions on the last node are interpolated in the last cell
+            i[x == axis[-1]] = axis.size - 2
+            inside &= (i >= 0) & (i <= axis.size - 2)
+            i = np.clip(i, 0, axis.size - 2)
+            lower.append(i)
+            frac.append(np.clip((x - axis[i]) / spacing, 0, 1))
+
+        #  values at the eight surrounding grid nodes
+        corners = {key: [] for key in GRID_KEYS}
+        weights = []
+        for offsets in itertools.product([0, 1], repeat=3):
+            node = tuple(i + o for i, o in zip(lower, offsets))
+            weights.append(np.prod(
+                [t if o else 1 - t for t, o in zip(frac, offsets)], axis=0))
+            for key in GRID_KEYS:
+                corners[key].append(self.values[key][node])
+        weights = np.array(weights)
+        corners = {key: np.array(value) for key, value in corners.items()}
+
+        def interpolate(key):
+            w = weights.reshape(weights.shape + (1, ) *
+                                (corners[key].ndim - weights.ndim))
+            return np.sum(w * corners[key], axis=0)
+
+        def identical(key):
+            return np.all(corners[key] == corners[key][0], axis=tuple(
+                [0] + list(range(2, corners[key].ndim))))
+
+        valid = (inside & np.all(corners['found'], axis=0) &
+                 identical('p_far') & identical('n_kd') & identical('arm'))
+        spread = np.max(corners['dist'], axis=0) -\
+            np.min(corners['dist'], axis=0)
+        valid &= np.all(spread <= tolerance, axis=1)
+
+        results = {'lon': positions[0], 'lat': positions[1],
+                   'found': valid, 'valid': valid,
+                   'p_far': corners['p_far'][0], 'n_kd': corners['n_kd'][0],
+                   'arm': corners['arm'][0]}
+        for key in ['kin_dist', 'dist', 'e_dist', 'prob']:
+            results[key] = interpolate(key)
+        results['e_interp'] = np.max(np.abs(
+            corners['dist'][..., 0] - results['dist'][:, 0]), axis=0)
+        return results
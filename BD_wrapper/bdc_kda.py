@@ -0,0 +1,276 @@
+import math
+
+import numpy as np
+
+from .KDA_tables import KDA_INFO_KEYS
+
+#  rows whose search box covers more grid cells than this along an axis are
+#  candidates of every query
+MAX_CELLS = 16
+#  relative margin of the search boxes, which covers the rounding errors of
+#  the weights at the thresholds
+MARGIN = 1e-6
+#  maximum number of candidate pairs of sources and rows evaluated at once
+MAX_PAIRS = 2**20
+
+
+def max_x_squared(threshold, std=False):
+    """Largest squared argument x**2 for which the weight of
+    `BayesianDistance.gaussian_weight` (capped at 1) reaches `threshold`.
+
+    Returns
+    -------
+    float
+        Inf if all weights reach the threshold and -1 if none does.
+
+    """
+    if threshold <= 0:
+        return np.inf
+    if threshold > 1:
+        return -1.
+    if std:
+        return 1 - 2 * math.log(threshold)
+    return (1 - math.log2(threshold)) / 4
+
+
+class KDAInfoIndex(object):
+    def __init__(self, columns, parameters, cell_size=None):
+        """Spatial and velocity index of a KDA info table.
+
+        The rows of the table can only be associated with a source if their
+        spatial weight (`BayesianDistance.point_in_ellipse`) reaches
+        `threshold_spatial` and their velocity weight
+        (`BayesianDistance.get_weight_velocity`) reaches
+        `threshold_spectral`. The first condition confines the source to a
+        box around the ellipse of the row, whose half width is the extent of
+        the ellipse along its major axis at the threshold, the second to a
+        velocity window around the velocity of the row.
+
+        The rows are sorted into the cells of a regular longitude-latitude
+        grid covered by their boxes, so `query` only needs to check the rows
+        of the grid cell of a source against their boxes and velocity
+        windows. The candidates are a superset of the associated rows, whose
+        weights are then calculated exactly as for the full table, so the
+        P_far prior does not change.
+
+        Parameters
+        ----------
+        columns : dict
+            Columns `KDA_INFO_KEYS` of the table.
+        parameters : dict
+            Parameters of the table (see `KDA_tables.read_kda_info_ini`).
+        cell_size : float
+            Size of the grid cells [deg]. Defaults to four times the median
+            half width of the boxes.
+        """
+        self.columns = {key: np.asarray(columns[key]) for key in KDA_INFO_KEYS}
+        n_rows = len(self.columns['GLON'])
+
+        #  squared bounds of the normalised distances of `point_in_ellipse`
+        #  and `get_weight_velocity`
+        max_epsilon = max_x_squared(
+            parameters['threshold_spatial'], parameters['size'] == 'std')
+        if parameters['size'] != 'std':
+            max_epsilon *= 4
+        max_x_vel = max_x_squared(
+            parameters['threshold_spectral'], parameters['linewidth'] == 'std')
+
+        self._empty = max_epsilon < 0 or max_x_vel < 0
+        self._radius = None
+        self._window = None
+        self._cells = None
+        self._cell_rows = None
+        self._cell_keys = None
+        self._cell_size = None
+        self._wide = np.arange(n_rows)
+        if self._empty:
+            return
+
+        if np.isfinite(max_x_vel):
+            self._window = np.sqrt(max_x_vel) * np.abs(
+                self.columns['d_VLSR']) * (1 + MARGIN)
+        if not np.isfinite(max_epsilon):
+            return
+
+        #  the squared distance to the centre of the ellipse is at most
+        #  max(aa, bb) * epsilon / (cos_pa**2 + sin_pa**2); rows with negative
+        #  squared axes get no box
+        aa, bb = self.columns['aa'], self.columns['bb']
+        with np.errstate(divide='ignore', invalid='ignore'):
+            radius = np.sqrt(max_epsilon * np.maximum(aa, bb) / (
+                self.columns['cos_pa']**2 + self.columns['sin_pa']**2)) * (
+                    1 + MARGIN)
+        radius[(aa < 0) | (bb < 0)] = np.inf
+        glon, glat = self.columns['GLON'], self.columns['GLAT']
+        #  rows with NaN values cannot be associated with any source
+        valid = ~(np.isnan(radius) | np.isnan(glon) | np.isnan(glat))
+        finite = valid & np.isfinite(radius) & np.isfinite(glon) &\
+            np.isfinite(glat)
+        self._radius = radius
+
+        if cell_size is None:
+            cell_size = 4 * np.median(radius[finite]) if finite.any() else 1.
+        self._cell_size = cell_size if cell_size > 0 else 1.
+        #  first and last cell covered by the boxes along both axes
+        with np.errstate(invalid='ignore'):
+            ix0, ix1, iy0, iy1 = (np.where(finite, np.floor(
+                (values + sign * radius) / self._cell_size), 0).astype(int)
+                for values in (glon, glat) for sign in (-1, 1))
+        nx, ny = ix1 - ix0 + 1, iy1 - iy0 + 1
+        gridded = finite & (nx <= MAX_CELLS) & (ny <= MAX_CELLS)
+        self._wide = np.flatnonzero(valid & ~gridded)
+
+        #  cells covered by the gridded rows with the range of their rows (in
+        #  ascending order) in `_cell_rows`
+        rows = np.flatnonzero(gridded)
+        counts = nx[rows] * ny[rows]
+        row_of_cell = np.repeat(rows, counts)
+        k = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts,
+                                                counts)
+        cell_x = ix0[row_of_cell] + k // ny[row_of_cell]
+        cell_y = iy0[row_of_cell] + k % ny[row_of_cell]
+        order = np.lexsort((row_of_cell, cell_y, cell_x))
+        cell_x, cell_y = cell_x[order], cell_y[order]
+        row_of_cell = row_of_cell[order]
+        starts = np.flatnonzero(np.r_[True, (np.diff(cell_x) != 0) |
+                                      (np.diff(cell_y) != 0)])
+        stops = np.r_[starts[1:], len(row_of_cell)]
+        self._cell_rows = row_of_cell
+        self._cells = dict(zip(
+            zip(cell_x[starts].tolist(), cell_y[starts].tolist()),
+            zip(starts.tolist(), stops.tolist())))
+
+        #  ascending keys of the cells for the lookup of arrays of sources
+        #  (see `get_cell_ranges`), unless they would overflow
+        if len(starts):
+            x0, y0 = int(cell_x[0]), int(cell_y.min())
+            nx, ny = int(cell_x[-1]) - x0 + 1, int(cell_y.max()) - y0 + 1
+            if nx * ny < 2**62:
+                self._cell_keys = (
+                    (cell_x[starts] - x0) * ny + cell_y[starts] - y0,
+                    starts, stops, (x0, y0, nx, ny))
+
+    def query(self, lon, lat, vel):
+        """Candidate rows that may be associated with a source.
+
+        Returns
+        -------
+        numpy.ndarray
+            Indices of the candidate rows in ascending order.
+
+        """
+        if self._empty:
+            return self._wide[:0]
+        rows = self._wide
+        if (self._cells is not None) and math.isfinite(lon) and\
+                math.isfinite(lat):
+            cell = self._cells.get((math.floor(lon / self._cell_size),
+                                    math.floor(lat / self._cell_size)))
+            if cell is not None:
+                cell = self._cell_rows[cell[0]:cell[1]]
+                rows = np.sort(np.concatenate([cell, rows])) if len(rows)\
+                    else cell
+        if len(rows) == 0:
+            return rows
+
+        if self._radius is not None:
+            radius = self._radius[rows]
+            rows = rows[(np.abs(lon - self.columns['GLON'][rows]) <= radius) &
+                        (np.abs(lat - self.columns['GLAT'][rows]) <= radius)]
+        if self._window is not None:
+            rows = rows[np.abs(vel - self.columns['VLSR'][rows]) <=
+                        self._window[rows]]
+        return rows
+
+    def get_cell_ranges(self, lon, lat):
+        """Ranges of the rows of the grid cells of arrays of sources in
+        `_cell_rows` (empty for sources outside the grid)."""
+        starts = np.zeros(len(lon), dtype=int)
+        stops = np.zeros(len(lon), dtype=int)
+        if self._cells is None:
+            return starts, stops
+        with np.errstate(invalid='ignore'):
+            cx = np.floor(lon / self._cell_size)
+            cy = np.floor(lat / self._cell_size)
+        if self._cell_keys is None:
+            for i in np.flatnonzero(np.isfinite(cx) & np.isfinite(cy)):
+                cell = self._cells.get((int(cx[i]), int(cy[i])))
+                if cell is not None:
+                    starts[i], stops[i] = cell
+            return starts, stops
+
+        keys, cell_starts, cell_stops, (x0, y0, nx, ny) = self._cell_keys
+        inside = np.flatnonzero((cx >= x0) & (cx < x0 + nx) &
+                                (cy >= y0) & (cy < y0 + ny))
+        source_keys = (cx[inside].astype(int) - x0) * ny +\
+            cy[inside].astype(int) - y0
+        k = np.minimum(np.searchsorted(keys, source_keys), len(keys) - 1)
+        found = keys[k] == source_keys
+        starts[inside[found]] = cell_starts[k[found]]
+        stops[inside[found]] = cell_stops[k[found]]
+        return starts, stops
+
+    def iter_pairs(self, lon, lat, vel, max_pairs=MAX_PAIRS):
+        """Candidate pairs of sources and rows for arrays of sources.
+
+        The same candidates as for `query` are determined for all sources at
+        once. The pairs are yielded in chunks of the candidates of
+        consecutive sources, with at most `max_pairs` pairs before the boxes
+        and velocity windows are applied (unless a single source has more
+        candidates).
+
+        Yields
+        ------
+        sources : numpy.ndarray
+            Indices of the sources of the pairs, in ascending order.
+        rows : numpy.ndarray
+            Indices of the candidate rows of the pairs, in ascending order
+            for each source.
+
+        """
+        lon, lat, vel = (np.asarray(values, dtype=float)
+                         for values in (lon, lat, vel))
+        if self._empty or not len(lon):
+            return
+        starts, stops = self.get_cell_ranges(lon, lat)
+        counts = stops - starts + len(self._wide)
+        #  chunks of consecutive sources with at most `max_pairs` pairs
+        ends = np.cumsum(counts)
+        first = 0
+        while first < len(lon):
+            last = max(first + 1, int(np.searchsorted(
+                ends, ends[first] - counts[first] + max_pairs, side='right')))
+            chunk = np.arange(first, last)
+            first = last
+
+            n_cell = stops[chunk] - starts[chunk]
+            sources = np.repeat(chunk, n_cell)
+            k = np.arange(n_cell.sum()) - np.repeat(
+                np.cumsum(n_cell) - n_cell, n_cell)
+            rows = self._cell_rows[np.repeat(starts[chunk], n_cell) + k] if\
+                len(k) else np.zeros(0, dtype=int)
+            if len(self._wide):
+                sources = np.concatenate([
+                    sources, np.repeat(chunk, len(self._wide))])
+                rows = np.concatenate([
+                    rows, np.tile(self._wide, len(chunk))])
+                order = np.lexsort((rows, sources))
+                sources, rows = sources[order], rows[order]
+
+            if self._radius is not None:
+                radius = self._radius[rows]
+                keep = (np.abs(lon[sources] - self.columns['GLON'][rows]) <=
+                        radius) &\
+                    (np.abs(lat[sources] - self.columns['GLAT'][rows]) <=
+                     radius)
+                sources, rows = sources[keep], rows[keep]
+            if self._window is not None:
+                keep = np.abs(vel[sources] - self.columns['VLSR'][rows]) <=\
+                    self._window[rows]
+                sources, rows = sources[keep], rows[keep]
+            if len(sources):
+                yield sources, rows
+
+    def get_rows(self, rows):
+        """Columns of the table for the given rows."""
+        return {key: values[rows] for key, values in self.columns.items()}
@@ -0,0 +1,1211 @@
+import os
+
+import numpy as np
+
+from .bdc_extension import PDF_COMPONENTS
+
+#  spiral arm segments of BDC v2.4 (see subroutine get_arm_segments)
+ARM_NAMES = ('Out', 'Per', 'Loc', 'CrN', 'CrF', 'SgN', 'SgF', 'CtN', 'CtF',
+             'ScN', 'ScF', 'OSC', 'N1N', 'N1F', 'N4N', 'N4F', '3kN', '3kF',
+             'AqS', 'CnN', 'CnX', 'AqR', 'LoS')
+
+#  important numerical parameters of BDC v2.4 (see calc_source_distance)
+NUM_BINS = 1001  # number of distance bins
+BIN_SIZE = 0.025  # kpc
+SIG_VEL = 5.  # km/s; Virial velocity uncertainty
+ELL_DIF_MAX = 5.  # deg; max. longitude difference for arm probabilities
+WIDTH_MIN = 0.17  # kpc; arm width for R < WIDTH_RREF
+WIDTH_RREF = 3.5  # kpc
+WIDTH_SLOPE = 0.036  # kpc/kpc
+SIGZ = 0.03  # kpc; z-height of arms for R < RSIGZ
+RSIGZ = 7.  # kpc
+SIGZDOT = 0.036  # kpc/kpc
+SIG_GMC = 0.05  # kpc; radius difference for sources in a GMC
+SMOOTH_KPC = 0.5  # kpc; boxcar width for smoothing the arm PDF
+MAX_NUM_PEAKS = 25
+MAX_ITER = 50  # max. number of passes of the Gaussian fitting
+
+DEG_TO_RAD = np.pi / 180.
+SQRT_1_TWOPI = np.sqrt(1. / (2. * np.pi))
+
+
+def read_data_lines(path_to_file):
+    """Return the data lines of a BDC input file (without '!' comments)."""
+    with open(path_to_file, 'r') as fin:
+        return [line for line in fin
+                if line.strip() and not line.startswith('!')]
+
+
+def univ_rc_from_note(r, a2, a3, Ro):
+    """Persic "Universal" rotation curve (see Univ_RC_from_note)."""
+    lam = (a3 / 1.5)**5
+    rho = r / (a2 * Ro)
+    log_lam = np.log10(lam)
+
+    term1 = 200. * lam**0.41
+    top = 0.75 * np.exp(-0.4 * lam)
+    bot = 0.47 + 2.25 * lam**0.4
+    term2 = np.sqrt(0.80 + 0.49 * log_lam + (top / bot))
+
+    #  the Fortran code uses the single precision constant 0.44 here
+    top = 1.97 * rho**1.22
+    bot = (rho**2 + 0.61)**1.43
+    term3 = (0.72 + float(np.float32(0.44)) * log_lam) * (top / bot)
+
+    top = rho**2
+    bot = rho**2 + 2.25 * lam**0.4
+    term4 = 1.6 * np.exp(-0.4 * lam) * (top / bot)
+
+    return (term1 / term2) * np.sqrt(term3 + term4)
+
+
+def gauss_prob(c_d, c_s, d):
+    """Normalized Gaussian probability density (see gauss_prob)."""
+    prefactor = SQRT_1_TWOPI / np.abs(c_s)
+    arg = (d - c_d)**2 / (2. * c_s**2)
+    return np.where(arg < 20.7, prefactor * np.exp(-np.minimum(arg, 20.7)), 0.)
+
+
+def asym_conservative_prob(c_d, c_s, c_s_avg, d):
+    """Error tolerant probability density (see asym_conservative_prob)."""
+    prefactor = SQRT_1_TWOPI / np.abs(c_s_avg)
+    rsq = ((d - c_d) / c_s)**2
+    exp_term = np.where(rsq < 41.4, np.exp(-np.minimum(rsq, 41.4) / 2.), 0.)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(rsq < 1e9, prefactor * (1. - exp_term) / rsq, 0.)
+
+
+def condition_pdf(pdf, p_max):
+    """Normalize PDFs and add a flat background (see condition_pdf).
+
+    Parameters
+    ----------
+    pdf : numpy.ndarray
+        PDFs with shape (n, NUM_BINS).
+    p_max : float or numpy.ndarray
+        Fraction(s) of the total probability contained in the PDFs.
+
+    Returns
+    -------
+    numpy.ndarray
+        Conditioned PDFs.
+
+    """
+    p_max = np.broadcast_to(np.asarray(p_max, dtype='float64'), pdf.shape[:1])
+    if np.any((p_max < 0) | (p_max > 1)):
+        raise Exception("Invalid P_max value(s): {}".format(p_max))
+
+    #  running sums, so that the PDFs are summed in the same order as in BDC
+    pdf_sum = np.add.accumulate(pdf, axis=1)[:, -1] * BIN_SIZE
+    has_sum = pdf_sum > 1e-99
+    scale = np.where(has_sum, p_max / np.where(has_sum, pdf_sum, 1.), 1.)
+    background = (1. - p_max) / (BIN_SIZE * NUM_BINS)
+    return np.where(has_sum[:, np.newaxis],
+                    scale[:, np.newaxis] * pdf + background[:, np.newaxis],
+                    1. / (BIN_SIZE * NUM_BINS))
+
+
+def smooth(pdf):
+    """Boxcar smoothing of PDFs with width SMOOTH_KPC (see smooth)."""
+    dist_bins = BIN_SIZE * np.arange(1, 3)
+    n_smooth = int(SMOOTH_KPC / (dist_bins[1] - dist_bins[0]) + 0.5)
+    if n_smooth % 2 == 0:
+        n_smooth += 1
+    n_half = n_smooth // 2
+
+    #  edge bins are not smoothed
+    n_inner = pdf.shape[1] - 2 * n_half
+    total = np.zeros((pdf.shape[0], n_inner))
+    for i in range(n_smooth):
+        total = total + pdf[:, i:i + n_inner]
+
+    smoothed = pdf.copy()
+    smoothed[:, n_half:n_half + n_inner] = total / n_smooth
+    return smoothed
+
+
+def find_angle(t_l, t_d, a_l_1, a_d_1, a_l_2, a_d_2):
+    """Minimum angle between a ray and an arm segment (see find_angle)."""
+    def clip(value):
+        return np.where(np.abs(value) < 1e-9,
+                        np.where(value < 0, -1e-9, 1e-9), value)
+
+    t_dx = t_d * np.sin(t_l * DEG_TO_RAD)
+    t_dy = t_d * np.cos(t_l * DEG_TO_RAD)
+    a_dx = (a_d_2 * np.sin(a_l_2 * DEG_TO_RAD) -
+            a_d_1 * np.sin(a_l_1 * DEG_TO_RAD))
+    a_dy = (a_d_2 * np.cos(a_l_2 * DEG_TO_RAD) -
+            a_d_1 * np.cos(a_l_1 * DEG_TO_RAD))
+
+    t_dx, a_dx = clip(t_dx), clip(a_dx)
+    angle_1 = np.abs(np.arctan(t_dy / t_dx) - np.arctan(a_dy / a_dx))
+    t_dy, a_dy = clip(t_dy), clip(a_dy)
+    angle_2 = np.abs(np.arctan(t_dx / t_dy) - np.arctan(a_dx / a_dy))
+    return np.minimum(angle_1, angle_2)
+
+
+def running_sum(values, axis=0):
+    """Sum in sequential order, like the loops of the Fortran code.
+
+    NumPy uses pairwise summation along the contiguous axis, so sums over
+    single vectors are taken with `np.add.accumulate`, and the summed axis
+    is made the slowest varying one otherwise.
+    """
+    values = np.moveaxis(values, axis, 0)
+    if values.ndim > 1 and values[0].size > 1:
+        return np.add.reduce(np.ascontiguousarray(values), axis=0)
+    return np.add.accumulate(values, axis=0)[-1]
+
+
+def gaussian_profile(peak_flux, center, fwhm, dist):
+    """Gaussian components of the model (see gaussian_profile).
+
+    The arguments are broadcast against each other; components with
+    non-positive peak values are set to zero (see calc_model).
+    """
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        arg = (dist - center)**2 / (2. * fwhm**2 / (8. * np.log(2.)))
+        flux = np.where(arg < 20.7, peak_flux * np.exp(
+            -np.where(arg < 20.7, arg, 0.)), 0.)
+    return np.where(peak_flux > 0, flux, 0.)
+
+
+def calc_model(params, dist, profiles=None):
+    """Baseline plus Gaussian components (see calc_model).
+
+    Parameters
+    ----------
+    params : numpy.ndarray
+        Model parameters with shape (n_models, n_params).
+    dist : numpy.ndarray
+        Distance bins.
+    profiles : numpy.ndarray
+        Precalculated Gaussian components with shape (n_models, n_gaussians,
+        n_bins).
+
+    Returns
+    -------
+    numpy.ndarray
+        Model values with shape (n_models, n_bins).
+
+    """
+    if profiles is None:
+        components = params[:, 2:, np.newaxis]
+        profiles = gaussian_profile(components[:, 0::3], components[:, 1::3],
+                                    components[:, 2::3], dist)
+    flux = params[:, 0, np.newaxis] + params[:, 1, np.newaxis] * dist
+    for n_g in range(profiles.shape[1]):
+        flux = flux + profiles[:, n_g]
+    return flux
+
+
+def invert_matrix(a):
+    """Gauss-Jordan matrix inversion with full pivoting (see MINV).
+
+    The IBM SSP routine is followed step by step, so that the results are
+    identical to the ones of the BDC. A singular matrix is returned
+    partially inverted.
+    """
+    a = a.copy()
+    n = a.shape[0]
+    l_k, m_k = np.arange(n), np.arange(n)
+
+    for k in range(n):
+        #  search for the largest element (in column-major order)
+        sub = np.abs(a[k:, k:]).T.ravel()
+        j, i = divmod(int(np.argmax(sub)), n - k)
+        l_k[k], m_k[k] = k + i, k + j
+        biga = a[k + i, k + j]
+
+        #  interchange rows and columns
+        j = l_k[k]
+        if j > k:
+            hold = -a[k]
+            a[k] = a[j]
+            a[j] = hold
+        i = m_k[k]
+        if i > k:
+            hold = -a[:, k]
+            a[:, k] = a[:, i]
+            a[:, i] = hold
+
+        if biga == 0:
+            return a
+
+        #  divide column by minus pivot
+        column = a[:, k] / (-biga)
+        column[k] = a[k, k]
+        a[:, k] = column
+        #  reduce matrix (all elements outside of row and column k)
+        row = a[k].copy()
+        a = a[:, k, np.newaxis] * row + a
+        a[k] = row / biga
+        a[:, k] = column
+        a[k, k] = 1. / biga
+
+    #  final row and column interchange
+    for k in range(n - 2, -1, -1):
+        i = l_k[k]
+        if i > k:
+            hold = a[:, k].copy()
+            a[:, k] = -a[:, i]
+            a[:, i] = hold
+        j = m_k[k]
+        if j > k:
+            hold = a[k].copy()
+            a[k] = -a[j]
+            a[j] = hold
+
+    return a
+
+
+def least_squares_fit(params, paramids, resids, partials, res_err):
+    """One linearized least-squares step (see LEAST_SQUARES_FIT).
+
+    Returns the new parameter values and the matrix inversion check
+    (0 if the inversion worked).
+    """
+    solved = np.flatnonzero(paramids)
+    new_params = params.copy()
+    if solved.size == 0:
+        return new_params, 0
+
+    c = partials[:, solved] / res_err[:, np.newaxis]
+    s = resids / res_err
+
+    b = running_sum(c[:, :, np.newaxis] * c[:, np.newaxis, :])
+    b_store = b.copy()
+    b_abs = np.abs(b[b != 0])
+    b_min = min(0., np.log10(b_abs.min())) if b_abs.size else 0.
+    b_max = max(0., np.log10(b_abs.max())) if b_abs.size else 0.
+    b_adjust = 10.**((b_max + b_min) / 2.)
+
+    b = invert_matrix(b / b_adjust) / b_adjust
+
+    #  check that the inversion worked (B^-1 B has to be the unit matrix)
+    ident = running_sum(b[:, :, np.newaxis] * b_store[np.newaxis, :, :],
+                        axis=1)
+    itest2 = 0
+    for i, j in zip(*np.nonzero(np.abs(ident - np.eye(solved.size)) > 1e-6)):
+        itest2 = -1 if i == j else 1
+    if itest2 != 0:
+        return new_params, itest2
+
+    product = np.zeros((solved.size, len(s)))
+    for i in range(solved.size):
+        product = product + b[:, i, np.newaxis] * c[:, i]
+    new_params[solved] = running_sum(product * s, axis=1) + params[solved]
+    return new_params, itest2
+
+
+def fit_multiple_gaussians(params, paramids, dist, data):
+    """Fit Gaussian components to a PDF (see fit_multiple_gaussians).
+
+    Returns the distances, uncertainties and normalized integrated
+    probabilities of the Gaussian components.
+    """
+    params = params.copy()
+    params_original = params.copy()
+    num_data = len(data)
+    num_solved_for = np.count_nonzero(paramids)
+    wiggled = np.flatnonzero(paramids == 1)
+    rows = np.arange(1, wiggled.size + 1)
+    rows_gauss = rows[wiggled >= 2]
+    n_gauss = (wiggled[wiggled >= 2] - 2) // 3
+
+    def calc_sigma_pdf(resids, res_err):
+        sigsq = running_sum((resids / res_err)**2)
+        num_deg_freedom = num_data - num_solved_for
+        if num_deg_freedom > 1:
+            return np.sqrt(sigsq / num_deg_freedom)
+        return 0.
+
+    resids = data - calc_model(params[np.newaxis], dist)[0]
+    res_err = np.full(num_data, 1. / num_data)
+    sigma_pdf = calc_sigma_pdf(resids, res_err)
+
+    iterpass, itest2, converged = 1, 0, False
+    while iterpass < MAX_ITER and not converged and itest2 == 0:
+        iterpass += 1
+
+        #  numerical partial derivatives; parameters are changed by 1 part
+        #  in 10^4, but never by less than 10^-8. Only the Gaussian component
+        #  of a changed parameter needs to be recalculated.
+        del_params = np.maximum(np.abs(params[wiggled]) * 1e-4, 1e-8)
+        params_wiggled = np.tile(params, (wiggled.size + 1, 1))
+        params_wiggled[rows, wiggled] = params[wiggled] + del_params
+
+        profiles = gaussian_profile(params[2::3, np.newaxis],
+                                    params[3::3, np.newaxis],
+                                    params[4::3, np.newaxis], dist)
+        profiles = np.repeat(profiles[np.newaxis], wiggled.size + 1, axis=0)
+        i_amp = 2 + 3 * n_gauss
+        profiles[rows_gauss, n_gauss] = gaussian_profile(
+            params_wiggled[rows_gauss, i_amp, np.newaxis],
+            params_wiggled[rows_gauss, i_amp + 1, np.newaxis],
+            params_wiggled[rows_gauss, i_amp + 2, np.newaxis], dist)
+
+        flux = calc_model(params_wiggled, dist, profiles)
+        partials = np.zeros((num_data, len(params)))
+        partials[:, wiggled] = ((flux[1:] - flux[0]) /
+                                del_params[:, np.newaxis]).T
+
+        res_err = res_err * sigma_pdf
+
+        new_params, itest2 = least_squares_fit(
+            params, paramids, resids, partials, res_err)
+
+        if itest2 == 0:
+            #  apply the changes with a gain of 0.1 and a maximum fractional
+            #  change of 0.2 per iteration (see update_params)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                delta = new_params - params
+                fractional_change = np.abs(delta / params)
+                delta = np.where(fractional_change > 0.2,
+                                 delta * 0.2 / fractional_change, delta)
+            params = params + 0.1 * delta
+            converged = not np.any(fractional_change > 0.01)
+
+            resids = data - calc_model(params[np.newaxis], dist)[0]
+            sigma_pdf = calc_sigma_pdf(resids, res_err)
+
+    #  if the matrix inversion failed, restore the original parameter values
+    #  but limit the widths to 0.5 kpc
+    if itest2 > 0:
+        params = params_original
+        widths = params[4::3]
+        params[4::3] = np.where(widths > 0.5, 0.5, widths)
+
+    amp, center, fwhm = params[2::3], params[3::3], params[4::3]
+    factor = np.sqrt(np.pi / (4. * np.log(2.)))
+    peak_int = factor * amp * fwhm
+    with np.errstate(divide='ignore', invalid='ignore'):
+        peak_int = peak_int / running_sum(peak_int)
+    return center, fwhm / 2.3548, peak_int
+
+
+def find_probability_peaks(prob_dist, dist_bins):
+    """Local peaks of a PDF and their widths (see find_probability_peaks)."""
+    p_min = 1.01 / (NUM_BINS * BIN_SIZE)
+    p_cen, p_low, p_high = prob_dist[1:-1], prob_dist[:-2], prob_dist[2:]
+    is_peak = ((p_cen >= p_low) & (p_cen >= p_high) & (p_cen > p_min) &
+               (p_low > 0) & (p_high > 0))
+    indices = np.flatnonzero(is_peak)[:MAX_NUM_PEAKS] + 1
+
+    peak_prob = prob_dist[indices]
+    peaks = dist_bins[indices]
+    peaks_width = np.zeros(indices.size)
+    for n_p, index in enumerate(indices):
+        onesig_amp = np.exp(-0.5) * peak_prob[n_p]
+        below = prob_dist <= onesig_amp
+        #  the BDC steps one bin beyond the distance grid if the PDF does
+        #  not drop below the threshold; use the extrapolated grid then
+        upper = np.flatnonzero(below[index:])
+        upper = index + upper[0] if upper.size else NUM_BINS
+        lower = np.flatnonzero(below[:index + 1])
+        lower = lower[-1] if lower.size else -1
+        sig_low = abs(peaks[n_p] - (upper + 1) * BIN_SIZE)
+        sig_high = abs((lower + 1) * BIN_SIZE - peaks[n_p])
+        peaks_width[n_p] = min(sig_low, sig_high)
+    return peak_prob, peaks, peaks_width
+
+
+def edit_peaks(peak_prob, peaks, peaks_width):
+    """Discard unimportant peaks of a PDF (see edit_peaks)."""
+    num_peaks = peak_prob.size
+    if num_peaks < 2:
+        return peak_prob, peaks, peaks_width
+
+    peak_min = 0.01 * max(peak_prob.max(), 0.)
+    use_peak = np.zeros(num_peaks, dtype='bool')
+    for n in range(num_peaks):
+        if peak_prob[n] > peak_min:
+            if n > 0:
+                width_max = max(peaks_width[n - 1], peaks_width[n])
+                delta = abs(peaks[n] - peaks[n - 1])
+                use_peak[n] = (delta > 0.25) and (delta > 0.25 * width_max)
+            else:
+                use_peak[n] = True
+    return peak_prob[use_peak], peaks[use_peak], peaks_width[use_peak]
+
+
+class BDCNumpy(object):
+    def __init__(self, path_to_bdc, chunk_size=16):
+        """Vectorised NumPy implementation of the BDC (v2.4).
+
+        The distance PDFs of a batch of sources are calculated as arrays of
+        shape (n_sources, 1001) on the distance grid of the BDC. The Galaxy
+        model, spiral arm segments and parallax data are read in from the
+        input files in `path_to_bdc`. The results follow the Fortran code
+        step by step, so they agree with the ones of the BDC executable up
+        to floating point rounding.
+
+        Parameters
+        ----------
+        path_to_bdc : str
+            Directory containing the BDC input files (galaxy_data_Univ.inp,
+            parallax_data.inp, spiral arm files, ...).
+        chunk_size : int
+            Number of sources that are processed at once; limits the size of
+            the (n_sources, n_bins, n_arm_entries) arrays.
+        """
+        self.path_to_bdc = path_to_bdc
+        self.chunk_size = chunk_size
+        self.dist_bins = BIN_SIZE * np.arange(1, NUM_BINS + 1)
+        self.par_bins = 1. / self.dist_bins
+
+        self.read_galaxy_parameters()
+        self.read_arm_segments()
+        self.read_parallaxes()
+
+    def read_galaxy_parameters(self):
+        """Read in the Galactic/Solar parameters (galaxy_data_Univ.inp)."""
+        lines = read_data_lines(
+            os.path.join(self.path_to_bdc, 'galaxy_data_Univ.inp'))
+        values = [line.split() for line in lines]
+        self.Ro = float(values[0][0])
+        self.a2, self.a3 = float(values[2][0]), float(values[2][1])
+        self.Uo, self.Vo, self.Wo = [float(v[0]) for v in values[3:6]]
+        self.Us, self.Vs, self.Ws = [float(v[0]) for v in values[6:9]]
+        self.glong_min = float(values[9][0])
+        self.glong_max = float(values[10][0])
+        self.To = univ_rc_from_note(self.Ro, self.a2, self.a3, self.Ro)
+
+    def read_arm_segments(self):
+        """Read in the (l,b,v,R,beta,d) traces of the spiral arm segments.
+
+        Also precomputes the interpolated arm points used for the arm
+        probabilities, the warping and the arm distance PDFs.
+        """
+        self.arms = []
+        for name in ARM_NAMES:
+            lines = read_data_lines(os.path.join(
+                self.path_to_bdc, '{}_lbvRBD.2019'.format(name)))
+            values = np.array([line.split()[:6] for line in lines[:300]],
+                              dtype='float64')
+            #  azimuths have to be in counter-clockwise order
+            reverse = [values[1, 4] > values[0, 4],
+                       values[-1, 4] > values[-2, 4]]
+            if reverse[0] != reverse[1]:
+                raise Exception(
+                    "Spiral arm segment '{}' has mixed azimuth orders".format(
+                        name))
+            if reverse[0]:
+                values = values[::-1]
+
+            arm = dict(zip(['ell', 'bee', 'vel', 'Rgc', 'beta', 'dist'],
+                           values.T.copy()))
+            arm['name'] = name
+            arm['valid'] = (arm['Rgc'] > 0) & (arm['dist'] > 0)
+            arm['ell_min'] = arm['ell'].min()
+            arm['ell_max'] = arm['ell'].max()
+            arm['lbv_points'] = [self._lbv_points(arm, ell_gt_180)
+                                 for ell_gt_180 in (False, True)]
+            arm['warp_points'] = [self._warp_points(arm, ambiguity)
+                                  for ambiguity in (0., -360.)]
+            arm['prob_points'] = self._prob_points(arm)
+            self.arms.append(arm)
+
+    @staticmethod
+    def _lbv_points(arm, ell_gt_180):
+        """Interpolated (l,b,v) points of an arm (see assign_arm_probabilities).
+
+        The longitudes of segments crossing 0 deg are unwrapped depending on
+        whether the target longitude is larger than 180 deg.
+        """
+        raddeg = 180. / np.pi
+        segments, points = [], []
+        for n_e in range(len(arm['ell']) - 1):
+            e0, e1 = arm['ell'][n_e], arm['ell'][n_e + 1]
+            diff_e = e1 - e0
+            if ell_gt_180:
+                if diff_e > 180:
+                    e0 = e0 + 360.
+                if diff_e < -180:
+                    e1 = e1 + 360.
+            else:
+                if diff_e > 180:
+                    e1 = e1 - 360.
+                if diff_e < -180:
+                    e0 = e0 - 360.
+            diff_e = e1 - e0
+
+            b0, b1 = arm['bee'][n_e], arm['bee'][n_e + 1]
+            v0, v1 = arm['vel'][n_e], arm['vel'][n_e + 1]
+            R0, R1 = arm['Rgc'][n_e], arm['Rgc'][n_e + 1]
+            d0, d1 = arm['dist'][n_e], arm['dist'][n_e + 1]
+            if (abs(diff_e) <= 0.001) or not (
+                    R0 > 0 and R1 > 0 and d0 > 0 and d1 > 0):
+                continue
+
+            n_i = max(int(abs(10. * diff_e) + 1), 2)
+            d_e = diff_e / (n_i - 1)
+            e_step = np.arange(n_i) * d_e
+            Rgc = R0 + (R1 - R0) / diff_e * e_step
+            dist = d0 + (d1 - d0) / diff_e * e_step
+
+            sigma_z = np.where(Rgc < RSIGZ, SIGZ, SIGZ + SIGZDOT * (Rgc - RSIGZ))
+            width = np.where(Rgc > WIDTH_RREF,
+                             WIDTH_MIN + (Rgc - WIDTH_RREF) * WIDTH_SLOPE,
+                             WIDTH_MIN)
+
+            segments.append((e0, d0, e1, d1, (e0 + e1) / 2.))
+            points.append(np.array([
+                np.full(n_i, len(segments) - 1), e0 + e_step,
+                b0 + (b1 - b0) / diff_e * e_step,
+                v0 + (v1 - v0) / diff_e * e_step,
+                (sigma_z / dist) * raddeg, (width / dist) * raddeg]))
+
+        segments = np.array(segments).reshape(-1, 5).T
+        points = (np.concatenate(points, axis=1) if points
+                  else np.zeros((6, 0)))
+        return segments, points
+
+    @staticmethod
+    def _warp_points(arm, ambiguity):
+        """Points of the arm segments used for the warping (see calc_arm_b).
+
+        Returns the in-plane coordinates and the latitudes of 10 points per
+        segment (NaN for duplicate entries).
+        """
+        diff_e = arm['ell'][:-1] - arm['ell'][1:] + ambiguity
+        valid = np.abs(diff_e) > 0.001
+        diff_e = np.where(valid, diff_e, 1.)[:, np.newaxis]
+        step = np.arange(1, 11) * (0.1 * diff_e)
+
+        def interpolate(key):
+            values = arm[key]
+            slope = (values[:-1] - values[1:])[:, np.newaxis] / diff_e
+            return values[:-1, np.newaxis] + slope * step
+
+        Rgc, beta, bee = [interpolate(key) for key in ['Rgc', 'beta', 'bee']]
+        x_m = Rgc * np.sin(beta * DEG_TO_RAD)
+        y_m = Rgc * np.cos(beta * DEG_TO_RAD)
+        x_m[~valid] = np.nan
+        return x_m, y_m, bee
+
+    @staticmethod
+    def _prob_points(arm):
+        """Points of the arm segments used for Prob(d|arm) (see calc_arm_prob).
+
+        Returns the Galactocentric coordinates and radii of 10 points per
+        segment (NaN for duplicate entries).
+        """
+        diff_e = arm['ell'][:-1] - arm['ell'][1:]
+        valid = np.abs(diff_e) > 0.001
+        ambiguity = np.zeros_like(diff_e)
+        ambiguity[np.abs(diff_e - 360.) < 180] = -360.
+        ambiguity[np.abs(diff_e + 360.) < 180] = 360.
+        diff_e = np.where(valid, diff_e + ambiguity, 1.)[:, np.newaxis]
+        step = np.arange(1, 11) * (0.1 * diff_e)
+
+        def interpolate(key):
+            values = arm[key]
+            slope = (values[:-1] - values[1:])[:, np.newaxis] / diff_e
+            return values[:-1, np.newaxis] + slope * step
+
+        Rgc, beta, dist, bee = [
+            interpolate(key) for key in ['Rgc', 'beta', 'dist', 'bee']]
+        cos_bee = np.cos(bee * DEG_TO_RAD)
+        x_m = Rgc * np.sin(beta * DEG_TO_RAD) * cos_bee
+        y_m = Rgc * np.cos(beta * DEG_TO_RAD) * cos_bee
+        z_m = dist * np.sin(bee * DEG_TO_RAD)
+        x_m[~valid] = np.nan
+        return x_m, y_m, z_m, Rgc
+
+    def read_parallaxes(self):
+        """Read in the trigonometric parallaxes (parallax_data.inp).
+
+        Only sources with a fractional parallax uncertainty < 20% are used.
+        """
+        lines = read_data_lines(
+            os.path.join(self.path_to_bdc, 'parallax_data.inp'))
+        values = np.array([line.split()[2:8] for line in lines],
+                          dtype='float64').reshape(-1, 6)
+        values = values[values[:, 5] / values[:, 4] < 0.2][:1000]
+        (self.ref_ell, self.ref_bee, self.ref_vlsr, _,
+         self.ref_par, self.ref_punc) = values.T
+
+        #  distance PDFs of the parallax sources (see calc_source_distance)
+        self.ref_pdfs = gauss_prob(
+            self.ref_par[:, np.newaxis], self.ref_punc[:, np.newaxis],
+            self.par_bins[np.newaxis, :])
+
+    def longitude_range(self, ell):
+        """Flag sources within the longitude range of the Galaxy model."""
+        accept = (self.glong_min >= 0) & (ell >= self.glong_min) & (
+            ell <= self.glong_max)
+        if self.glong_min < 0:
+            accept |= (ell >= self.glong_min) & (ell <= self.glong_max)
+            epm = ell - 360.
+            accept |= (epm >= self.glong_min) & (epm <= self.glong_max)
+        return accept
+
+    def revised_vlsr(self, ell, bee, v_lsr, dist):
+        """Vlsr corrected for the Solar and source motions.
+
+        See subroutine calc_revised_Vlsr; arrays are broadcast against each
+        other.
+        """
+        ell_rad = ell * DEG_TO_RAD
+        cos_l, sin_l = np.cos(ell_rad), np.sin(ell_rad)
+        cos_b, sin_b = np.cos(bee * DEG_TO_RAD), np.sin(bee * DEG_TO_RAD)
+
+        v_helio = v_lsr - (15.32 * sin_l + 10.27 * cos_l) * cos_b - 7.74 * sin_b
+        v_newlsr = v_helio + (self.Vo * sin_l + self.Uo * cos_l) * cos_b + \
+            self.Wo * sin_b
+
+        d_proj = dist * cos_b
+        r_proj = np.sqrt(self.Ro**2 + d_proj**2 - 2. * self.Ro * d_proj * cos_l)
+        sin_beta = d_proj * sin_l / r_proj
+        cos_beta = (self.Ro - d_proj * cos_l) / r_proj
+        beta = np.arctan2(sin_beta, cos_beta)
+
+        gamma = np.pi - ell_rad - beta
+        v_fixed = v_newlsr - (self.Vs * np.sin(gamma) -
+                              self.Us * np.cos(gamma)) * cos_b - \
+            self.Ws * sin_b
+        return v_fixed, r_proj
+
+    def kinematic_distance(self, v_proj, ell, Rs):
+        """Near and far kinematic distances (see kinematic_distance_Univ)."""
+        ell_rad = ell * DEG_TO_RAD
+        cos_l, sin_l = np.cos(ell_rad), np.sin(ell_rad)
+        Rocosl = self.Ro * cos_l
+        Tr = univ_rc_from_note(Rs, self.a2, self.a3, self.Ro)
+
+        rootterm = Rocosl**2 + (
+            Tr * sin_l / (self.To * sin_l / self.Ro + v_proj / self.Ro))**2 - \
+            self.Ro**2
+        root = np.sqrt(np.where(rootterm < 0, 0., rootterm))
+
+        inner = ((ell >= 0) & (ell < 90)) | ((ell > 270) & (ell < 360))
+        outer = (ell >= 90) & (ell <= 270)
+        d_near = np.where(inner, Rocosl - root,
+                          np.where(outer, Rocosl + root, np.nan))
+        d_far = np.where(inner, Rocosl + root, d_near)
+        return d_near, d_far
+
+    def calc_kinematic_distances(self, ell, bee, v_lsr, farnear):
+        """Iteratively calculate kinematic distances (see calc_Dk_Univ)."""
+        cos_b = np.cos(bee * DEG_TO_RAD)
+        dk = np.full(ell.shape, 3.)
+        active = np.ones(ell.shape, dtype='bool')
+        for _ in range(100):
+            if not active.any():
+                break
+            v_fixed, r_proj = self.revised_vlsr(
+                ell[active], bee[active], v_lsr[active], dk[active])
+            d_near, d_far = self.kinematic_distance(
+                v_fixed * cos_b[active], ell[active], r_proj)
+
+            dk_new = d_far if farnear else d_near
+            dk_new = np.where((d_near <= 0) & (d_far > 0), d_far, dk_new)
+            dk_new = np.where((d_far <= 0) & (d_near > 0), d_near, dk_new)
+
+            converged = ~(np.abs(dk_new - dk[active]) > 0.01)
+            dk[active] = dk_new
+            active[np.flatnonzero(active)[converged]] = False
+        return dk
+
+    def assign_arm_probabilities(self, ell, bee, v_lsr, v_lsr_unc):
+        """Probabilities P(arm|l,b,v) for all arm segments.
+
+        See subroutine assign_arm_probabilities; returns an array of shape
+        (n_sources, n_arms).
+        """
+        sig_vel_dif = np.sqrt((np.sqrt(2.) * SIG_VEL)**2 + v_lsr_unc**2)
+        probabilities = np.zeros((ell.size, len(self.arms)))
+        for i_a, arm in enumerate(self.arms):
+            for ell_gt_180 in (False, True):
+                idx = np.flatnonzero((ell > 180) == ell_gt_180)
+                segments, points = arm['lbv_points'][ell_gt_180]
+                if idx.size == 0 or points.shape[1] == 0:
+                    continue
+                e0, d0, e1, d1, e_mid = segments
+                seg, p_ell, p_bee, p_vel, sig_bee, sig_ell = points
+                seg = seg.astype('int')
+
+                src_ell = ell[idx, np.newaxis]
+                near = np.abs(src_ell - e_mid) < ELL_DIF_MAX
+                cos_angle = np.abs(np.cos(
+                    find_angle(src_ell, 10., e0, d0, e1, d1)))
+                cos_angle = np.where(cos_angle > 0.1, cos_angle, 0.1)
+                sig_ell = sig_ell / cos_angle[:, seg]
+
+                dell = np.abs(src_ell - p_ell)
+                dbee = np.abs(bee[idx, np.newaxis] - p_bee)
+                dvel = np.abs(v_lsr[idx, np.newaxis] - p_vel)
+                sig_v = sig_vel_dif[idx, np.newaxis]
+                close = (near[:, seg] & (dell <= 3. * sig_ell) &
+                         (dbee <= 3. * sig_bee) & (dvel <= 3. * sig_v))
+                pos_ssq = (dell**2 / (2. * sig_ell**2) +
+                           dbee**2 / (2. * sig_bee**2) +
+                           dvel**2 / (2. * sig_v**2))
+                prob = np.where(close, np.exp(-pos_ssq), 0.)
+                probabilities[idx, i_a] = prob.max(axis=1)
+        return probabilities
+
+    @staticmethod
+    def closest_arm_entry(arm, beta_src_deg):
+        """Index of the arm entry with the azimuth closest to the source.
+
+        Azimuth differences are checked for 360 deg ambiguities (see
+        calc_arm_b).
+        """
+        valid = np.flatnonzero(arm['valid'])
+        dif = beta_src_deg[..., np.newaxis] - arm['beta'][valid]
+        del_beta = np.abs(dif)
+        np.minimum(del_beta, np.abs(dif - 360.), out=del_beta)
+        np.abs(np.add(dif, 360., out=dif), out=dif)
+        np.minimum(del_beta, dif, out=del_beta)
+        return valid[np.argmin(del_beta, axis=-1)]
+
+    @staticmethod
+    def window(points, i_a_min, offsets):
+        """Gather the points of the arm segments around the closest entry.
+
+        Segments outside of the arm are filled with NaN values.
+        """
+        segments = i_a_min[..., np.newaxis] + offsets
+        valid = (segments >= 0) & (segments < points[0].shape[0])
+        segments = np.clip(segments, 0, points[0].shape[0] - 1)
+        return [np.where(valid[..., np.newaxis], p[segments], np.nan)
+                for p in points]
+
+    def get_warping(self, ell, bee, geometry):
+        """Latitudes of the warped arms along the lines of sight.
+
+        See subroutine get_warping; returns lists of the sorted distances and
+        latitudes of the arms passing close to the line of sight.
+        """
+        x_src, y_src, z_src, r_src, beta_src_deg = geometry
+        n_src = ell.size
+        del_min = np.full((n_src, NUM_BINS, len(self.arms)), 999.)
+        b_min = np.zeros((n_src, NUM_BINS, len(self.arms)))
+
+        for i_a, arm in enumerate(self.arms):
+            idx = np.flatnonzero((ell >= arm['ell_min']) &
+                                 (ell <= arm['ell_max']))
+            if idx.size == 0:
+                continue
+            i_a_min = self.closest_arm_entry(arm, beta_src_deg[idx])
+            del_ell_1 = np.abs(ell[idx, np.newaxis] - arm['ell'][i_a_min])
+            del_ell_2 = np.abs(del_ell_1 - 360.)
+
+            #  the second set of points allows for a 360 deg ambiguity
+            near_arm = [(del_ell_1 < 3.) & ~(del_ell_2 < 3.), del_ell_2 < 3.]
+            for ambiguity, use in enumerate(near_arm):
+                if not use.any():
+                    continue
+                i_src, i_bin = np.nonzero(use)
+                x_m, y_m, bee_t = self.window(
+                    arm['warp_points'][ambiguity], i_a_min[i_src, i_bin],
+                    np.arange(-3, 3))
+                del_x = x_src[idx[i_src], i_bin, np.newaxis, np.newaxis] - x_m
+                del_y = y_src[idx[i_src], i_bin, np.newaxis, np.newaxis] - y_m
+                del_in = np.sqrt(del_x**2 + del_y**2).reshape(i_src.size, -1)
+                del_in = np.where(np.isnan(del_in), np.inf, del_in)
+                best = np.argmin(del_in, axis=1)
+                found = del_in[np.arange(i_src.size), best] < 999.
+                del_min[idx[i_src[found]], i_bin[found], i_a] = del_in[
+                    np.arange(i_src.size), best][found]
+                b_min[idx[i_src[found]], i_bin[found], i_a] = bee_t.reshape(
+                    i_src.size, -1)[np.arange(i_src.size), best][found]
+
+        #  closest arm for each distance bin
+        i_arm = np.argmin(del_min, axis=2)
+        d_min = np.take_along_axis(del_min, i_arm[..., np.newaxis], 2)[..., 0]
+        b_min = np.take_along_axis(b_min, i_arm[..., np.newaxis], 2)[..., 0]
+
+        d_store, b_store = [], []
+        for i in range(n_src):
+            d_values, b_values = [], []
+            for i_a in range(len(self.arms)):
+                d_arm = np.where(i_arm[i] == i_a, d_min[i], np.inf)
+                n_p = np.argmin(d_arm)
+                if d_arm[n_p] < 0.25:
+                    d_values.append(self.dist_bins[n_p])
+                    b_values.append(b_min[i, n_p])
+            #  sort by distance from the Sun (same algorithm as in the BDC)
+            for n_d in range(len(d_values)):
+                for m_d in range(n_d + 1, len(d_values)):
+                    if d_values[m_d] < d_values[n_d]:
+                        d_values[n_d], d_values[m_d] = d_values[m_d], d_values[n_d]
+                        b_values[n_d], b_values[m_d] = b_values[m_d], b_values[n_d]
+            d_store.append(np.array(d_values))
+            b_store.append(np.array(b_values))
+        return d_store, b_store
+
+    def latitude_pdf(self, ell, bee, d_store, b_store):
+        """Latitude PDFs including the warping (see lat_prob_warped)."""
+        pi = 3.141592654
+        degrad = pi / 180.
+        dist = self.dist_bins
+        prob = np.zeros((ell.size, NUM_BINS))
+        for i in range(ell.size):
+            cosl = np.cos(ell[i] * degrad)
+            Rgc = np.sqrt(self.Ro**2 + dist**2 - 2. * self.Ro * dist * cosl)
+            sigma_z = np.where(Rgc < RSIGZ, SIGZ, SIGZ + SIGZDOT * (Rgc - RSIGZ))
+
+            #  interpolate_warping
+            d, b = d_store[i], b_store[i]
+            b_warp = np.zeros(NUM_BINS)
+            if d.size >= 1:
+                n_b = np.minimum(np.searchsorted(d, dist, side='left'),
+                                 d.size - 1)
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    first = (dist / d[0]) * b[0]
+                    j = np.maximum(n_b - 1, 0)
+                    k = np.minimum(j + 1, d.size - 1)
+                    inner = b[j] + ((dist - d[j]) / (d[k] - d[j])) * (
+                        b[k] - b[j])
+                b_warp = np.where(n_b == 0, first, inner)
+
+            del_z = ((bee[i] - b_warp) * degrad) * dist
+            prefact = np.sqrt(1. / (2. * pi)) / sigma_z
+            arg = del_z**2 / (2. * sigma_z**2)
+            prob[i] = prefact * np.exp(-arg) * dist
+        return prob
+
+    def arm_pdf(self, ell, arm_probabilities, geometry):
+        """Spiral arm PDFs P(d) = P(d|arm) * P(arm) (see arm_model_prob).
+
+        Returns the PDFs and the indices of the most probable arm in each
+        distance bin (-1 if no arm has a probability > 0.01).
+        """
+        x_src, y_src, z_src, r_src, beta_src_deg = geometry
+        n_src = ell.size
+        prob_max = np.full((n_src, NUM_BINS), 0.01)
+        arm_max = np.full((n_src, NUM_BINS), -1)
+
+        for i_a, arm in enumerate(self.arms):
+            idx = np.flatnonzero(arm_probabilities[:, i_a] > 0.01)
+            if idx.size == 0:
+                continue
+            i_a_min = self.closest_arm_entry(arm, beta_src_deg[idx])
+            del_ell_1 = np.abs(ell[idx, np.newaxis] - arm['ell'][i_a_min])
+            near_arm = (del_ell_1 < ELL_DIF_MAX) | (
+                np.abs(del_ell_1 - 360.) < ELL_DIF_MAX)
+
+            prob = np.zeros((idx.size, NUM_BINS))
+            i_src, i_bin = np.nonzero(near_arm)
+            if i_src.size:
+                i_ell_dif_max = int(ELL_DIF_MAX + 0.5)
+                x_m, y_m, z_m, Rgc_t = self.window(
+                    arm['prob_points'], i_a_min[i_src, i_bin],
+                    np.arange(-i_ell_dif_max, i_ell_dif_max))
+                sel = idx[i_src], i_bin
+                del_x = x_src[sel][:, np.newaxis, np.newaxis] - x_m
+                del_y = y_src[sel][:, np.newaxis, np.newaxis] - y_m
+                del_z = z_src[sel][:, np.newaxis, np.newaxis] - z_m
+                del_dist = np.sqrt(del_x**2 + del_y**2 + del_z**2).reshape(
+                    i_src.size, -1)
+                del_dist = np.where(np.isnan(del_dist), np.inf, del_dist)
+                best = np.argmin(del_dist, axis=1)
+                rows = np.arange(i_src.size)
+                found = del_dist[rows, best] < 999.
+
+                del_min = np.where(found, del_dist[rows, best], 999.)
+                del_min_in = np.sqrt(
+                    del_x**2 + del_y**2).reshape(i_src.size, -1)[rows, best]
+                del_min_z = del_z.reshape(i_src.size, -1)[rows, best]
+                Rgc_min = np.where(
+                    found, Rgc_t.reshape(i_src.size, -1)[rows, best], 999e9)
+
+                Rsrc = r_src[sel]
+                del_min = np.where(Rsrc < Rgc_min, -del_min, del_min)
+                width = np.where(
+                    Rsrc > WIDTH_RREF,
+                    WIDTH_MIN + (Rsrc - WIDTH_RREF) * WIDTH_SLOPE, WIDTH_MIN)
+                with np.errstate(invalid='ignore'):
+                    prob_in = gauss_prob(0., width, del_min_in)
+                    prob_z = gauss_prob(0., width / 3., del_min_z)
+                prob[i_src, i_bin] = np.where(
+                    np.abs(del_min) < 2., prob_in * prob_z, 0.)
+
+            prob = prob * arm_probabilities[idx, i_a][:, np.newaxis]
+            larger = prob > prob_max[idx]
+            prob_max[idx] = np.where(larger, prob, prob_max[idx])
+            arm_max[idx] = np.where(larger, i_a, arm_max[idx])
+        return prob_max, arm_max
+
+    def kinematic_pdf(self, ell, bee, v_lsr, v_lsr_unc, far_prob,
+                      dk_near, dk_far):
+        """Kinematic distance PDFs (see Dk_prob_density)."""
+        ell, bee, v_lsr = [values[:, np.newaxis] for values in (ell, bee, v_lsr)]
+        dist = self.dist_bins
+        sin_ell = np.sin(ell * DEG_TO_RAD)
+        cos_ell = np.cos(ell * DEG_TO_RAD)
+        cos_bee = np.cos(bee * DEG_TO_RAD)
+
+        d_proj = dist * cos_bee
+        Rs = np.sqrt(self.Ro**2 + d_proj**2 - 2. * self.Ro * d_proj * cos_ell)
+        Tr = univ_rc_from_note(Rs, self.a2, self.a3, self.Ro)
+        V_mod = np.where(Rs > 0.01 * self.Ro,
+                         Tr * sin_ell * (self.Ro / Rs) - self.To * sin_ell, 0.)
+        v_lsr_rev, _ = self.revised_vlsr(ell, bee, v_lsr, dist)
+
+        d_mid = np.where((dk_near > 0) & (dk_far > dk_near),
+                         0.5 * (dk_near + dk_far), 999.)[:, np.newaxis]
+
+        #  larger peculiar motions in the bar region and in the Perseus arm
+        sig_vel = np.sqrt(SIG_VEL**2 + v_lsr_unc**2)[:, np.newaxis]
+        vel_pec = np.minimum((6. - Rs) * 12.5, 25.)
+        sig_vel_incr = np.where(Rs < 6., np.sqrt(sig_vel**2 + vel_pec**2),
+                                sig_vel)
+        Xgc = dist * sin_ell * cos_bee
+        Ygc = self.Ro - dist * cos_ell * cos_bee
+        perseus = (Xgc >= 1.) & (Xgc <= 3.2) & (Ygc >= 8.8) & (Ygc <= 10.)
+        sig_vel_incr = np.where(perseus, np.sqrt(sig_vel_incr**2 + 20.**2),
+                                sig_vel_incr)
+
+        prob = asym_conservative_prob(V_mod, sig_vel_incr, sig_vel, v_lsr_rev)
+
+        #  weight by the near/far probability in quadrants 1 and 4
+        p_far = far_prob[:, np.newaxis]
+        weighted = np.where(dist <= d_mid, prob * (1. - p_far), prob * p_far)
+        return np.where((ell < 90) | (ell > 270), weighted, prob)
+
+    def parallax_prior(self, ell, bee, v_lsr, v_lsr_unc):
+        """Parallax-source association PDFs (unnormalized)."""
+        dist_prior = np.zeros((ell.size, NUM_BINS))
+        dist_par = 1. / self.ref_par
+        drho = np.abs(ell[:, np.newaxis] - self.ref_ell) * DEG_TO_RAD * dist_par
+        dzee = np.abs(bee[:, np.newaxis] - self.ref_bee) * DEG_TO_RAD * dist_par
+        dvel = np.abs(v_lsr[:, np.newaxis] - self.ref_vlsr)
+        sig_vel_dif = np.sqrt(SIG_VEL**2 + v_lsr_unc**2)[:, np.newaxis]
+
+        close = ((drho <= 3. * SIG_GMC) & (dzee <= 3. * SIG_GMC) &
+                 (dvel <= 3. * sig_vel_dif))
+        ssq = (drho**2 / (2. * SIG_GMC**2) + dzee**2 / (2. * SIG_GMC**2) +
+               dvel**2 / (2. * sig_vel_dif**2))
+        weight = np.where(close, np.exp(-ssq), 0.)
+
+        p_bin_sq = self.par_bins**2
+        for n_p in np.flatnonzero(close.any(axis=0)):
+            rows = np.flatnonzero(close[:, n_p])
+            dist_prior[rows] = dist_prior[rows] + (
+                weight[rows, n_p, np.newaxis] * self.ref_pdfs[n_p]) * p_bin_sq
+        return dist_prior
+
+    def run(self, lon, lat, vel, e_vel, p_far, p_max, pdfs=False,
+            fallback=False):
+        """Calculate the distances of several sources.
+
+        Takes the same arguments and returns the same results as
+        `BDCExtension.run`.
+
+        Parameters
+        ----------
+        lon, lat, vel, e_vel, p_far : array_like
+            Galactic longitudes and latitudes [deg], velocities and their
+            uncertainties [km/s] and KDA priors of the sources.
+        p_max : list
+            Maximum probabilities of the SA, KD, GL, PS and PM components.
+        pdfs : bool
+            Also return the component PDFs of the sources.
+        fallback : bool
+            Recalculate sources whose p_far value does not yield any distance
+            results with p_far = 0.5 in the same evaluation.
+
+        Returns
+        -------
+        dict
+            See `BDCExtension.run`.
+
+        """
+        for value in p_max:
+            if not 0 <= value <= 1:
+                raise Exception(
+                    "Maximum probabilities need to be between 0 and 1")
+
+        arrays = [np.atleast_1d(np.asarray(values, dtype='float64'))
+                  for values in (lon, lat, vel, e_vel, p_far)]
+        n = arrays[0].size
+        results = {
+            'lon': arrays[0].copy(), 'lat': arrays[1].copy(),
+            'n_kd': np.zeros(n, dtype='int'), 'kin_dist': np.zeros((n, 2)),
+            'found': np.zeros(n, dtype='bool'), 'p_far': np.zeros(n),
+            'dist': np.zeros((n, 2)),
+            'e_dist': np.zeros((n, 2)), 'prob': np.zeros((n, 2)),
+            'arm': np.full((n, 2), '...', dtype='object')}
+        if pdfs:
+            results['pdfs'] = np.zeros((n, len(PDF_COMPONENTS), NUM_BINS))
+            results['dist_bins'] = self.dist_bins.copy()
+
+        for start in range(0, n, self.chunk_size):
+            chunk = slice(start, start + self.chunk_size)
+            self.run_chunk([values[chunk] for values in arrays], p_max,
+                           {key: value[chunk] for key, value in results.items()
+                            if key != 'dist_bins'}, fallback=fallback)
+        return results
+
+    def run_chunk(self, arrays, p_max, results, fallback=False):
+        """Calculate the distances of a chunk of sources.
+
+        The results are written into the (sliced) arrays of `results`.
+        """
+        ell, bee, v_lsr, v_lsr_unc, far_prob = arrays
+        p_max_sa, p_max_kd, p_max_gl, p_max_ps, p_max_pm = p_max
+        far_prob = np.clip(far_prob, 0., 1.)
+        accept = self.longitude_range(ell)
+
+        arm_probabilities = self.assign_arm_probabilities(
+            ell, bee, v_lsr, v_lsr_unc)
+        sum_arm_probs = running_sum(arm_probabilities, axis=1)
+
+        #  kinematic distances (for information only)
+        dk_near = self.calc_kinematic_distances(ell, bee, v_lsr, False)
+        dk_far = self.calc_kinematic_distances(ell, bee, v_lsr, True)
+        has_near = dk_near > 0
+        has_far = dk_far > dk_near
+        results['n_kd'][:] = has_near.astype('int') + has_far
+        results['kin_dist'][:, 0] = np.where(
+            has_near, dk_near, np.where(has_far, dk_far, 0.))
+        results['kin_dist'][:, 1] = np.where(has_near & has_far, dk_far, 0.)
+
+        #  pathological values: reset kinematic distance to 5 kpc
+        pathological = ~(dk_near > 0) & ~(dk_far > 0)
+        dk_near = np.where(pathological, 5., dk_near)
+        dk_far = np.where(pathological, 0., dk_far)
+
+        #  source positions for all distance bins
+        ell_rad = (ell * DEG_TO_RAD)[:, np.newaxis]
+        bee_rad = (bee * DEG_TO_RAD)[:, np.newaxis]
+        x_src = self.dist_bins * np.sin(ell_rad)
+        y_src = self.Ro - self.dist_bins * np.cos(ell_rad)
+        z_src = self.dist_bins * np.sin(bee_rad)
+        r_src = np.sqrt(x_src**2 + y_src**2)
+        beta_src_deg = np.arctan2(x_src, y_src) / DEG_TO_RAD
+        geometry = x_src, y_src, z_src, r_src, beta_src_deg
+
+        d_store, b_store = self.get_warping(ell, bee, geometry)
+
+        #  parallax-source association PDF
+        if self.ref_par.size >= 1 and p_max_ps > 0:
+            dist_prior = self.parallax_prior(ell, bee, v_lsr, v_lsr_unc)
+        else:
+            dist_prior = np.zeros((ell.size, NUM_BINS))
+        dist_prior = condition_pdf(dist_prior, p_max_ps)
+
+        prob_arm, arm_max_bin = self.arm_pdf(ell, arm_probabilities, geometry)
+        if p_max_sa == 0:
+            prob_arm[:] = 0.
+        prob_arm[~accept] = 0.
+
+        prob_lat = self.latitude_pdf(ell, bee, d_store, b_store)
+        if p_max_gl == 0:
+            prob_lat[:] = 0.
+
+        #  normalize the component PDFs
+        prob_arm = smooth(prob_arm)
+        p_max_arm = np.minimum(p_max_sa, sum_arm_probs)
+        prob_arm = condition_pdf(prob_arm, p_max_arm)
+        prob_lat = condition_pdf(prob_lat, p_max_gl)
+        if p_max_sa == 0:
+            prob_armlat = condition_pdf(prob_lat, p_max_gl)
+        else:
+            prob_armlat = condition_pdf(prob_arm * prob_lat, p_max_arm)
+        #  proper motions are not measured, so their PDFs are flat
+        prob_pm = condition_pdf(np.zeros((ell.size, NUM_BINS)), p_max_pm)
+
+        def final_pdfs(rows, far_prob):
+            """Kinematic distance and final PDFs for a prior far_prob."""
+            prob_dk = self.kinematic_pdf(
+                ell[rows], bee[rows], v_lsr[rows], v_lsr_unc[rows], far_prob,
+                dk_near[rows], dk_far[rows])
+            if p_max_kd == 0:
+                prob_dk[:] = 0.
+            prob_dk = condition_pdf(prob_dk, p_max_kd)
+
+            #  combined "Milky Way" model and final PDFs
+            use = ((prob_armlat[rows] > 1e-9) & (prob_dk > 1e-9) &
+                   (prob_pm[rows] > 1e-9) & (prob_pm[rows] > 1e-9))
+            prob_mw = np.where(use, prob_armlat[rows] * prob_dk *
+                               prob_pm[rows] * prob_pm[rows], 0.)
+            prob_mw = condition_pdf(prob_mw, 1.)
+            use = (dist_prior[rows] > 1e-9) & (prob_mw > 1e-9)
+            return prob_dk, condition_pdf(
+                np.where(use, dist_prior[rows] * prob_mw, 0.), 1.)
+
+        rows = np.arange(ell.size)
+        prob_dk, prob_dist = final_pdfs(rows, far_prob)
+        results['p_far'][:] = far_prob
+        for i in rows:
+            self.fit_peaks(i, prob_dist[i], dk_near[i], sum_arm_probs[i],
+                           arm_max_bin[i], results)
+
+        #  only the kinematic distance PDF depends on the prior, so the
+        #  other PDFs are reused for the flat prior
+        if fallback:
+            rows = np.flatnonzero(~results['found'] & (far_prob != 0.5))
+            if rows.size:
+                prob_dk[rows], prob_dist[rows] = final_pdfs(
+                    rows, np.full(rows.size, 0.5))
+                results['p_far'][rows] = 0.5
+            for i in rows:
+                self.fit_peaks(i, prob_dist[i], dk_near[i], sum_arm_probs[i],
+                               arm_max_bin[i], results)
+
+        if 'pdfs' in results:
+            for i, pdf in enumerate([prob_dk, prob_arm, prob_lat, prob_armlat,
+                                     dist_prior, prob_dist]):
+                results['pdfs'][:, i] = pdf
+
+    def fit_peaks(self, i, prob_dist, dk_near, sum_arm_probs, arm_max_bin,
+                  results):
+        """Fit the peaks of the final PDF of source `i` of a chunk.
+
+        The results of the two greatest peaks are written into `results`.
+        """
+        arm_names = np.array(ARM_NAMES + ('...', ), dtype='object')
+        peak_prob, peaks, peaks_width = edit_peaks(
+            *find_probability_peaks(prob_dist, self.dist_bins))
+        if peak_prob.size == 0:
+            return
+
+        num_params = 2 + 3 * peak_prob.size
+        params = np.zeros(num_params)
+        params[2::3], params[3::3] = peak_prob, peaks
+        params[4::3] = 2.3548 * peaks_width
+        paramids = np.ones(num_params, dtype='int')
+        paramids[1] = 0
+        #  for sources with very odd (l,b,v) values use the initial guesses
+        odd_source = dk_near > 25
+        if odd_source:
+            paramids[:] = 0
+
+        peak_dist, peak_dunc, peak_int = fit_multiple_gaussians(
+            params, paramids, self.dist_bins, prob_dist)
+
+        #  two greatest integrated probability peaks
+        order = []
+        for _ in range(min(2, peak_int.size)):
+            n_max, p_int_max = -1, 0.
+            for n_p, value in enumerate(peak_int):
+                if value > p_int_max and n_p not in order:
+                    n_max, p_int_max = n_p, value
+            if n_max < 0:
+                break
+            order.append(n_max)
+        if not order:
+            return
+
+        questionable = ''
+        if sum_arm_probs < 0.1:
+            questionable = '?'
+        if odd_source:
+            questionable = '??'
+
+        results['found'][i] = True
+        for k, n_p in enumerate(order):
+            distance = peak_dist[n_p]
+            arm = '...'
+            if np.isfinite(distance):
+                arm = arm_names[arm_max_bin[np.argmin(
+                    np.abs(distance - self.dist_bins))]]
+            results['dist'][i, k] = distance
+            results['e_dist'][i, k] = peak_dunc[n_p]
+            results['prob'][i, k] = peak_int[n_p]
+            results['arm'][i, k] = arm + questionable
@@ -0,0 +1,216 @@
+import json
+import os
+import threading
+import zlib
+
+import numpy as np
+
+#  distances of the 1001 bins of the PDFs of the BDC
+DIST_BINS = 0.025 * np.arange(1, 1002)
+
+
+def create_pdf_cube(path_to_pdfs, n_sources, n_components):
+    """Create the PDF cube of a run, initialized with NaN values.
+
+    The cube is stored as a `.npy` file of shape
+    (n_sources, n_components, 1001), whose first axis corresponds to the
+    rows of the input table.
+    """
+    dirname = os.path.dirname(path_to_pdfs)
+    if dirname:
+        os.makedirs(dirname, exist_ok=True)
+    cube = np.lib.format.open_memmap(
+        path_to_pdfs, mode='w+', dtype='float64',
+        shape=(n_sources, n_components, DIST_BINS.size))
+    cube[:] = np.nan
+    cube.flush()
+
+
+def open_pdf_cube(path_to_pdfs, mode='r'):
+    """Memory-map the PDF cube of a run.
+
+    Parameters
+    ----------
+    path_to_pdfs : str
+        Path to the `.npy` file of the PDF cube.
+    mode : str
+        'r' for read-only access, 'r+' to write PDFs into the cube.
+
+    Returns
+    -------
+    numpy.memmap
+        PDFs of shape (n_sources, n_components, 1001); the distances of the
+        bins are given by `DIST_BINS`. Sources without PDFs contain NaN values.
+
+    """
+    return np.load(path_to_pdfs, mmap_mode=mode)
+
+
+def read_pdf_files(path_to_source, components):
+    """Read in the PDF files written by the BDC executable for a source.
+
+    Parameters
+    ----------
+    path_to_source : str
+        Path to the BDC files of the source without the suffix, i.e. the
+        PDFs are read from '{path_to_source}_{component}_pdf.dat'.
+    components : list
+        Names of the PDF components.
+
+    Returns
+    -------
+    numpy.ndarray
+        PDFs of shape (n_components, 1001); NaN for missing files.
+
+    """
+    pdfs = np.full((len(components), DIST_BINS.size), np.nan)
+    for i, component in enumerate(components):
+        filepath = '{}_{}_pdf.dat'.format(path_to_source, component)
+        if os.path.exists(filepath):
+            pdfs[i] = np.loadtxt(filepath, usecols=1, skiprows=2)
+    return pdfs
+
+
+def create_pdf_archive(path_to_archive, n_sources, components):
+    """Create an empty PDF archive for the sources of a run.
+
+    The archive is a directory containing an index ('index.npy') with the
+    data file, offset and size of the record of each source (-1 if missing),
+    the metadata ('meta.json') and the data files ('part-{pid}.bin'), to
+    which each (worker) process appends its records (see `PDFArchive`).
+
+    Parameters
+    ----------
+    path_to_archive : str
+        Directory of the archive. Existing data files are removed.
+    n_sources : int
+        Number of sources (rows of the input table).
+    components : list
+        Names of the stored PDF components.
+
+    """
+    os.makedirs(path_to_archive, exist_ok=True)
+    for filename in os.listdir(path_to_archive):
+        if filename.startswith('part-') and filename.endswith('.bin'):
+            os.remove(os.path.join(path_to_archive, filename))
+
+    with open(os.path.join(path_to_archive, 'meta.json'), 'w') as fout:
+        json.dump({'components': list(components),
+                   'n_bins': int(DIST_BINS.size)}, fout)
+
+    index = np.lib.format.open_memmap(
+        os.path.join(path_to_archive, 'index.npy'), mode='w+',
+        dtype='int64', shape=(n_sources, 3))
+    index[:] = -1
+    index.flush()
+
+
+class PDFArchive(object):
+    def __init__(self, path_to_archive, mode='r'):
+        """Compressed archive of the PDFs of the sources of a run.
+
+        The PDFs of the BDC are conditioned with a constant floor, so they
+        are smooth but not sparse. Each PDF is quantized to 16 bit relative
+        to its maximum (i.e. with an error < 1e-5 of the maximum), the
+        differences of neighbouring bins are stored and the record of a
+        source is compressed with zlib. An index gives the data file and
+        offset of each record, so the PDFs of any source are read without
+        scanning the archive.
+
+        Parameters
+        ----------
+        path_to_archive : str
+            Directory of the archive (see `create_pdf_archive`).
+        mode : str
+            'r' to read PDFs, 'a' to append PDFs of the current thread, 'r+'
+            to link records of sources (see `link`).
+        """
+        self.path_to_archive = path_to_archive
+        with open(os.path.join(path_to_archive, 'meta.json'), 'r') as fin:
+            meta = json.load(fin)
+        self.components = meta['components']
+        self.n_bins = meta['n_bins']
+        self.dist_bins = DIST_BINS
+
+        self.index = np.load(os.path.join(path_to_archive, 'index.npy'),
+                             mmap_mode='r' if mode == 'r' else 'r+')
+        self._part = None
+        self._fin = {}
+        if mode == 'a':
+            #  the native thread ID is unique among the running threads of
+            #  all processes of the host
+            self._part = threading.get_native_id()
+            self._fout = open(self.get_part_path(self._part), 'ab')
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, i):
+        """PDFs of the source in row `i` (shape (n_components, 1001)).
+
+        NaN values are returned for sources that are not in the archive.
+        """
+        part, offset, size = self.index[i]
+        if part < 0:
+            return np.full((len(self.components), self.n_bins), np.nan)
+
+        if part not in self._fin:
+            self._fin[part] = open(self.get_part_path(part), 'rb')
+        fin = self._fin[part]
+        fin.seek(offset)
+        return self.decode(fin.read(size))
+
+    def get_part_path(self, part):
+        return os.path.join(self.path_to_archive, 'part-{}.bin'.format(part))
+
+    def encode(self, pdfs):
+        """Compressed record of the PDFs of a source."""
+        pdfs = np.asarray(pdfs, dtype='float64')
+        scale = np.max(pdfs, axis=1)
+        scale[~(scale > 0)] = 1
+        quantized = np.round(pdfs / scale[:, np.newaxis] * 65535)
+        #  missing PDFs (NaN values) are stored with a NaN scale
+        scale[np.isnan(pdfs).any(axis=1)] = np.nan
+        quantized = np.nan_to_num(quantized).astype('uint16')
+        #  the differences wrap around and are restored by the cumulative sum
+        diffs = np.diff(quantized, axis=1, prepend=np.uint16(0))
+        return zlib.compress(
+            scale.astype('float32').tobytes() + diffs.tobytes())
+
+    def decode(self, record):
+        """PDFs of a source from its compressed record."""
+        record = zlib.decompress(record)
+        n_comp = len(self.components)
+        scale = np.frombuffer(record, dtype='float32', count=n_comp)
+        diffs = np.frombuffer(record, dtype='uint16', offset=4 * n_comp)
+        quantized = np.cumsum(
+            diffs.reshape(n_comp, self.n_bins), axis=1, dtype='uint16')
+        return quantized / 65535. * scale[:, np.newaxis].astype('float64')
+
+    def write(self, indices, pdfs):
+        """Append the PDFs of sources and enter them in the index."""
+        entries = []
+        for i, pdfs_source in zip(indices, pdfs):
+            record = self.encode(pdfs_source)
+            entries.append((i, self._fout.tell(), len(record)))
+            self._fout.write(record)
+        #  the data needs to be on disk before it is referenced in the index
+        self._fout.flush()
+        for i, offset, size in entries:
+            self.index[i] = [self._part, offset, size]
+
+    def link(self, indices, sources):
+        """Enter the records of the `sources` rows for the `indices` rows.
+
+        The PDFs are not copied; the rows share the same record.
+        """
+        self.index[indices] = self.index[sources]
+
+    def close(self):
+        for fin in self._fin.values():
+            fin.close()
+        self._fin = {}
+        if self._part is not None:
+            self._fout.close()
+        if self.index.mode == 'r+':
+            self.index.flush()
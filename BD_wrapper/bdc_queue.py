@@ -0,0 +1,191 @@
+import os
+import pickle
+import sqlite3
+import time
+
+#  seconds between polls of the work queue by idle workers and the coordinator
+POLL_INTERVAL = 1.
+#  number of expired leases after which a task is given up
+MAX_ATTEMPTS = 3
+
+
+class WorkQueue(object):
+    def __init__(self, path_to_queue, timeout=60.):
+        """Durable queue of ranges of input rows in an SQLite database.
+
+        The coordinator of a run (see `BayesianDistance.calculate_distances`)
+        fills the queue with tasks, each containing the rows and indices of a
+        range of the input table, and the settings of the run. Any number of
+        worker processes, also on other hosts sharing the file system, lease
+        tasks, process them and store their results in the queue. A lease
+        expires if it is not renewed in time, so the task of a lost worker is
+        handed out again; after `MAX_ATTEMPTS` expired leases, the task is
+        given up and its sources are reported as failed.
+
+        The database does not use write-ahead logging, which is not
+        supported on network file systems; the file system needs to support
+        file locks, though.
+
+        Parameters
+        ----------
+        path_to_queue : str
+            Path to the SQLite database file; created if it does not exist.
+        timeout : float
+            Seconds to wait for a lock held by another process.
+        """
+        dirname = os.path.dirname(path_to_queue)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        self.path_to_queue = path_to_queue
+        #  transactions are started explicitly
+        self.connection = sqlite3.connect(
+            path_to_queue, timeout=timeout, isolation_level=None)
+
+    def create(self, meta, settings, payloads):
+        """Start the queue anew.
+
+        Parameters
+        ----------
+        meta : dict
+            Metadata identifying the run (see `get_meta`).
+        settings : dict
+            Settings needed by the workers (e.g. the worker configuration of
+            the `BayesianDistance` object and the lease duration).
+        payloads : iterable
+            Payload of each task, in order.
+        """
+        self.connection.execute('BEGIN IMMEDIATE')
+        try:
+            self.connection.execute('DROP TABLE IF EXISTS meta')
+            self.connection.execute('DROP TABLE IF EXISTS tasks')
+            self.connection.execute(
+                'CREATE TABLE meta (key TEXT PRIMARY KEY, value BLOB)')
+            self.connection.execute(
+                'CREATE TABLE tasks (id INTEGER PRIMARY KEY, payload BLOB, '
+                'status TEXT, worker TEXT, expires REAL, attempts INTEGER, '
+                'result BLOB)')
+            self.connection.executemany(
+                'INSERT INTO meta VALUES (?, ?)',
+                [('meta', pickle.dumps(meta)),
+                 ('settings', pickle.dumps(settings))])
+            self.connection.executemany(
+                "INSERT INTO tasks VALUES (?, ?, 'pending', NULL, 0, 0, NULL)",
+                ((i, pickle.dumps(payload))
+                 for i, payload in enumerate(payloads)))
+            self.connection.execute('COMMIT')
+        except BaseException:
+            self.connection.execute('ROLLBACK')
+            raise
+
+    def get(self, key):
+        """Return the metadata ('meta') or settings ('settings') of the queue.
+
+        Returns None if the queue was not created yet.
+        """
+        try:
+            row = self.connection.execute(
+                'SELECT value FROM meta WHERE key = ?', (key, )).fetchone()
+        except sqlite3.OperationalError:
+            return None
+        return None if row is None else pickle.loads(row[0])
+
+    def get_meta(self):
+        return self.get('meta')
+
+    def get_settings(self):
+        return self.get('settings')
+
+    def lease(self, worker, duration):
+        """Lease the next pending task or a task with an expired lease.
+
+        Returns
+        -------
+        tuple or None
+            ID and payload of the task; None if no task is available.
+
+        """
+        now = time.time()
+        self.connection.execute('BEGIN IMMEDIATE')
+        try:
+            row = self.connection.execute(
+                "SELECT id, payload FROM tasks WHERE status = 'pending' OR "
+                "(status = 'leased' AND expires < ? AND attempts < ?) "
+                "ORDER BY id LIMIT 1", (now, MAX_ATTEMPTS)).fetchone()
+            if row is not None:
+                self.connection.execute(
+                    "UPDATE tasks SET status = 'leased', worker = ?, "
+                    "expires = ?, attempts = attempts + 1 WHERE id = ?",
+                    (worker, now + duration, row[0]))
+            self.connection.execute('COMMIT')
+        except BaseException:
+            self.connection.execute('ROLLBACK')
+            raise
+        if row is None:
+            return None
+        return row[0], pickle.loads(row[1])
+
+    def renew(self, task_id, worker, duration):
+        """Extend the lease of a task; returns False if the lease was lost."""
+        return self.connection.execute(
+            "UPDATE tasks SET expires = ? WHERE id = ? AND worker = ? AND "
+            "status = 'leased'",
+            (time.time() + duration, task_id, worker)).rowcount == 1
+
+    def complete(self, task_id, worker, result):
+        """Store the result of a task, unless it was already completed."""
+        self.connection.execute(
+            "UPDATE tasks SET status = 'done', worker = ?, result = ? "
+            "WHERE id = ? AND status != 'done'",
+            (worker, pickle.dumps(result), task_id))
+
+    def give_up(self, failed):
+        """Complete the tasks whose leases expired `MAX_ATTEMPTS` times.
+
+        Parameters
+        ----------
+        failed : function
+            Called with the payload of each such task; returns its result.
+
+        Returns
+        -------
+        int
+            Number of tasks that were given up.
+
+        """
+        rows = self.connection.execute(
+            "SELECT id, payload FROM tasks WHERE status = 'leased' AND "
+            "expires < ? AND attempts >= ?",
+            (time.time(), MAX_ATTEMPTS)).fetchall()
+        for task_id, payload in rows:
+            self.complete(task_id, None, failed(pickle.loads(payload)))
+        return len(rows)
+
+    def get_result(self, task_id):
+        """Return the result of a task or None if it is not completed."""
+        row = self.connection.execute(
+            "SELECT result FROM tasks WHERE id = ? AND status = 'done'",
+            (task_id, )).fetchone()
+        return None if row is None else pickle.loads(row[0])
+
+    def counts(self):
+        """Number of tasks for each status ('pending', 'leased', 'done')."""
+        counts = {'pending': 0, 'leased': 0, 'done': 0}
+        try:
+            counts.update(self.connection.execute(
+                'SELECT status, COUNT(*) FROM tasks GROUP BY status'))
+        except sqlite3.OperationalError:
+            pass
+        return counts
+
+    def finished(self):
+        """Check whether all tasks are completed."""
+        counts = self.counts()
+        return counts['pending'] + counts['leased'] == 0
+
+    def close(self):
+        self.connection.close()
+
+    def remove(self):
+        self.close()
+        if os.path.exists(self.path_to_queue):
+            os.remove(self.path_to_queue)
@@ -0,0 +1,195 @@
+import csv
+import json
+import marshal
+import os
+import pstats
+import socket
+import threading
+import time
+
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+#  stages of a distance run in the order in which they are reported
+STAGES = ('compile', 'p_far_prior', 'input_write', 'bdc_run', 'parse',
+          'cartesian', 'pdf_output', 'table_assembly', 'table_write')
+#  counters that are always reported
+COUNTERS = ('sources', 'bdc_runs', 'fallback_reruns')
+#  columns of the per-source traces; the times are given in seconds
+TRACE_COLUMNS = ('index', 'lon', 'lat', 'vel', 'p_far', 'p_far_source',
+                 'kda_ref', 'fallback', 'origin', 't_prior', 't_bdc',
+                 't_parse')
+
+
+def get_worker_id():
+    """Name of the current process (and thread, if it is not the main
+    thread) in the run report."""
+    worker_id = '{}:{}'.format(socket.gethostname(), os.getpid())
+    if threading.current_thread() is not threading.main_thread():
+        worker_id += ':{}'.format(threading.current_thread().name)
+    return worker_id
+
+
+def get_dir_size(path):
+    """Size of the files in a directory in bytes (symlinks are not followed)."""
+    size = 0
+    try:
+        for entry in os.scandir(path):
+            size += entry.stat(follow_symlinks=False).st_size
+    except FileNotFoundError:
+        pass
+    return size
+
+
+def get_resource_usage():
+    """Peak memory of the current process in MB and CPU time of its
+    terminated child processes (the BDC executables) in seconds."""
+    if resource is None:
+        return {}
+    usage_self = resource.getrusage(resource.RUSAGE_SELF)
+    usage_children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    #  `ru_maxrss` is given in kB on Linux
+    return {'peak_rss': usage_self.ru_maxrss / 1024,
+            'bdc_cpu': usage_children.ru_utime + usage_children.ru_stime}
+
+
+class RunReport(object):
+    def __init__(self):
+        """Wall and CPU time of the stages of a distance run and resource
+        usage of its workers.
+
+        The times of nested stages are only counted in the innermost stage,
+        so the times of all stages add up. CPU times are those of the
+        calling thread; the CPU time of the BDC executables is given in the
+        resource usage of the workers. Each worker (process or thread)
+        records its own report, which is sent to the main process with the
+        results of its tasks and merged there.
+
+        In profiling mode, the report also contains the traces of the
+        processed sources (rows with the `TRACE_COLUMNS`) and the cProfile
+        statistics of the worker (in the format of `pstats.Stats.stats`).
+        """
+        self.stages = {}
+        self.counters = {}
+        self.workers = {}
+        self.trace = []
+        self.profile = {}
+        self._stack = []
+
+    @contextmanager
+    def stage(self, name):
+        """Context manager timing a stage."""
+        #  wall and CPU time of the nested stages
+        nested = [0., 0.]
+        self._stack.append(nested)
+        wall, cpu = time.perf_counter(), time.thread_time()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - wall
+            cpu = time.thread_time() - cpu
+            self._stack.pop()
+            if self._stack:
+                self._stack[-1][0] += wall
+                self._stack[-1][1] += cpu
+            self.add(name, wall - nested[0], cpu - nested[1])
+
+    def add(self, name, wall, cpu=0., calls=1):
+        stage = self.stages.setdefault(
+            name, {'wall': 0., 'cpu': 0., 'calls': 0})
+        stage['wall'] += wall
+        stage['cpu'] += cpu
+        stage['calls'] += calls
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def add_profile(self, profile):
+        """Add cProfile statistics (a `cProfile.Profile` or a dict in the
+        format of `pstats.Stats.stats`)."""
+        if not isinstance(profile, dict):
+            profile.create_stats()
+            profile = profile.stats
+        for func, stat in profile.items():
+            self.profile[func] = pstats.add_func_stats(
+                self.profile.get(func, (0, 0, 0, 0, {})), stat)
+
+    def record_worker(self, scratch_size=None):
+        """Record the resource usage of the current worker.
+
+        Parameters
+        ----------
+        scratch_size : int
+            Current size of the scratch directory of the worker in bytes;
+            the peak value is reported in MB.
+        """
+        worker = self.workers.setdefault(get_worker_id(), {})
+        worker.update(get_resource_usage())
+        if scratch_size is not None:
+            worker['scratch_peak'] = max(
+                worker.get('scratch_peak', 0.), scratch_size / 1024**2)
+
+    def merge(self, other):
+        """Add the stages, counters, traces and profile of another report."""
+        if other is None:
+            return
+        for name, stage in other.stages.items():
+            self.add(name, stage['wall'], stage['cpu'], stage['calls'])
+        for name, n in other.counters.items():
+            self.count(name, n)
+        self.trace.extend(other.trace)
+        self.add_profile(other.profile)
+        #  the resource usage values are peak or cumulative values
+        for worker_id, values in other.workers.items():
+            worker = self.workers.setdefault(worker_id, {})
+            for key, value in values.items():
+                worker[key] = max(worker.get(key, value), value)
+
+    def to_dict(self):
+        order = {name: i for i, name in enumerate(STAGES)}
+        stages = sorted(self.stages, key=lambda name: (
+            order.get(name, len(STAGES)), name))
+        return {'stages': {name: dict(self.stages[name]) for name in stages},
+                'counters': dict(
+                    {name: 0 for name in COUNTERS}, **self.counters),
+                'workers': {worker_id: dict(values) for worker_id, values
+                            in sorted(self.workers.items())}}
+
+    def __getstate__(self):
+        #  reports are only pickled between stages
+        state = self.__dict__.copy()
+        state['_stack'] = []
+        return state
+
+
+def write_run_report(report, path_to_report):
+    """Write a run report (see `BayesianDistance.finish_run_report`) as JSON."""
+    with open(path_to_report, 'w') as fout:
+        json.dump(report, fout, indent=2)
+        fout.write('\n')
+
+
+def write_profile(profile, path_to_profile):
+    """Write cProfile statistics in the format of `pstats.Stats.dump_stats`,
+    so they can be read with `pstats.Stats(path_to_profile)` or viewers like
+    snakeviz."""
+    with open(path_to_profile, 'wb') as fout:
+        marshal.dump(profile, fout)
+
+
+class TraceWriter(object):
+    def __init__(self, path_to_trace):
+        """Write the traces of the sources of a run to a CSV file."""
+        self._fout = open(path_to_trace, 'w', newline='')
+        self._writer = csv.writer(self._fout)
+        self._writer.writerow(TRACE_COLUMNS)
+
+    def write(self, rows):
+        self._writer.writerows(rows)
+
+    def close(self):
+        self._fout.close()
@@ -0,0 +1,71 @@
+import os
+import shutil
+import tempfile
+
+from multiprocessing.util import Finalize
+
+#  input files of the BDC that are written per run and thus not shared
+SCRATCH_FILES = ('probability_controls.inp', 'sources_info.inp')
+
+
+def default_scratch_dir():
+    """Return the default directory for the scratch directories of the BDC.
+
+    This is the RAM-backed '/dev/shm' if it is available and the default
+    directory for temporary files otherwise.
+    """
+    if os.path.isdir('/dev/shm') and os.access('/dev/shm', os.W_OK):
+        return '/dev/shm'
+    return tempfile.gettempdir()
+
+
+def is_bdc_input(filename):
+    """Check whether a file of the BDC directory is a shared input file."""
+    if filename in SCRATCH_FILES:
+        return False
+    return filename.endswith('.inp') or ('_lbvRBD.' in filename)
+
+
+def create_scratch_dir(path_to_bdc, probability_controls, path_to_scratch=None,
+                       prefix='bdc_'):
+    """Create a scratch directory in which the BDC executable can be run.
+
+    The shared, read-only input files of the BDC (Galaxy model, spiral arm and
+    parallax data) are symlinked from `path_to_bdc`, and the probability
+    controls are written to the scratch directory. The directory is removed
+    when the process that created it exits.
+
+    Parameters
+    ----------
+    path_to_bdc : str
+        Directory containing the BDC input files.
+    probability_controls : str
+        Content of the 'probability_controls.inp' file.
+    path_to_scratch : str
+        Directory in which the scratch directory is created. Defaults to
+        `default_scratch_dir()`.
+    prefix : str
+        Prefix of the name of the scratch directory.
+
+    Returns
+    -------
+    str
+        Path to the scratch directory.
+
+    """
+    if path_to_scratch is None:
+        path_to_scratch = default_scratch_dir()
+    os.makedirs(path_to_scratch, exist_ok=True)
+
+    dirname = tempfile.mkdtemp(prefix=prefix, dir=path_to_scratch)
+    #  unlike atexit handlers, finalizers also run in forked worker processes
+    Finalize(None, shutil.rmtree, args=(dirname, ),
+             kwargs={'ignore_errors': True}, exitpriority=0)
+
+    for filename in filter(is_bdc_input, os.listdir(path_to_bdc)):
+        os.symlink(os.path.join(os.path.abspath(path_to_bdc), filename),
+                   os.path.join(dirname, filename))
+    with open(os.path.join(dirname, 'probability_controls.inp'), 'w') as fout:
+        fout.write(probability_controls)
+
+    return dirname
@@ -0,0 +1,117 @@
+import io
+
+from astropy.io import ascii
+from astropy.table import Table, vstack
+
+#  size of the blocks in which ascii tables are parsed [bytes]
+READ_SIZE = 2**24
+#  formats supported by the fast ascii reader of Astropy, whose files consist
+#  of the header lines followed by the data rows (see `TableWriter`)
+STREAM_FORMATS = ['basic', 'csv', 'tab', 'commented_header', 'no_header',
+                  'rdb']
+
+
+def get_reader_format(table_format):
+    """Format of the fast ascii reader for a table format.
+
+    Returns
+    -------
+    str
+        One of `STREAM_FORMATS`, or None if tables of the given format
+        cannot be streamed.
+
+    """
+    if table_format in ['ascii', 'csv']:
+        reader_format = {'ascii': 'basic'}.get(table_format, table_format)
+    elif table_format.startswith('ascii.'):
+        reader_format = table_format[len('ascii.'):]
+        if reader_format.startswith('fast_'):
+            reader_format = reader_format[len('fast_'):]
+    else:
+        return None
+    return reader_format if reader_format in STREAM_FORMATS else None
+
+
+def iter_table_chunks(table, table_format, chunk_size, read_size=READ_SIZE):
+    """Read a table in chunks with a fixed number of rows.
+
+    Parameters
+    ----------
+    table : str or astropy.table.Table
+        Path to an ascii table or a table in memory.
+    table_format : str
+        Format of the ascii table; it has to be supported by the fast ascii
+        reader of Astropy (see `get_reader_format`).
+    chunk_size : int
+        Number of rows per chunk (except for the last chunk).
+    read_size : int
+        Size of the blocks in which the file is parsed [bytes].
+
+    Yields
+    ------
+    offset : int
+        Index of the first row of the chunk in the table.
+    chunk : astropy.table.Table
+        Rows of the chunk.
+
+    """
+    if isinstance(table, Table):
+        for offset in range(0, len(table), chunk_size):
+            yield offset, table[offset:offset + chunk_size]
+        return
+
+    reader_format = get_reader_format(table_format)
+    if reader_format is None:
+        raise Exception("Cannot stream tables of format '{}'; supported are "
+                        "'ascii', 'csv' and 'ascii.{{{}}}'".format(
+                            table_format, ','.join(STREAM_FORMATS)))
+    blocks = ascii.read(
+        table, format=reader_format, guess=False,
+        fast_reader={'chunk_size': read_size, 'chunk_generator': True})
+
+    #  the blocks of the reader have a fixed size in bytes
+    buffer, n_buffer, offset = [], 0, 0
+    for block in blocks:
+        buffer.append(block)
+        n_buffer += len(block)
+        while n_buffer >= chunk_size:
+            rows = vstack(buffer) if len(buffer) > 1 else buffer[0]
+            yield offset, rows[:chunk_size]
+            offset += chunk_size
+            buffer, n_buffer = [rows[chunk_size:]], n_buffer - chunk_size
+    if n_buffer:
+        yield offset, vstack(buffer) if len(buffer) > 1 else buffer[0]
+
+
+class TableWriter(object):
+    def __init__(self, path_to_table, table_format):
+        """Write a table chunk by chunk to a text file.
+
+        The first chunk is written with the header of the table format; the
+        header lines are omitted for all further chunks, so the file is the
+        same as if the whole table had been written at once.
+
+        Parameters
+        ----------
+        path_to_table : str
+            Path to the output file.
+        table_format : str
+            Text format of the table (see `get_reader_format`).
+        """
+        self.table_format = table_format
+        self._fout = open(path_to_table, 'w')
+        self._n_header = None
+
+    def write(self, table):
+        buffer = io.StringIO()
+        table.write(buffer, format=self.table_format)
+        lines = buffer.getvalue().splitlines(True)
+        if self._n_header is None:
+            self._n_header = len(lines) - len(table)
+        else:
+            lines = lines[self._n_header:]
+        self._fout.writelines(lines)
+        self._fout.flush()
+
+    def close(self):
+        self._fout.close()
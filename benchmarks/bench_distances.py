@@ -0,0 +1,41 @@
+"""End-to-end benchmarks of `BayesianDistance.calculate_distances`."""
+import os
+import shutil
+import tempfile
+
+from .bench_kernels import get_bd
+from .catalogs import SIZES, make_catalog
+
+
+class TimeCalculateDistances:
+    #  a run takes about 0.04 s per source and core, so the largest catalog
+    #  is not run end to end
+    params = SIZES[:3]
+    param_names = ['n_sources']
+    number = 1
+    repeat = 1
+    timeout = 3600
+
+    def setup_cache(self):
+        #  build the BDC executable and extension module once, so that the
+        #  benchmarks do not include the compilation
+        dirname = tempfile.mkdtemp()
+        try:
+            bd = get_bd(os.path.join(dirname, 'results.dat'))
+            bd.check_settings()
+        finally:
+            shutil.rmtree(dirname, ignore_errors=True)
+
+    def setup(self, n_sources):
+        self.dirname = tempfile.mkdtemp()
+        self.bd = get_bd(os.path.join(self.dirname, 'results.dat'))
+        self.bd.input_table = make_catalog(n_sources)
+        #  a single core, so that the results of different machines and runs
+        #  can be compared
+        self.bd.use_ncpus = 1
+
+    def teardown(self, n_sources):
+        shutil.rmtree(self.dirname, ignore_errors=True)
+
+    def time_calculate_distances(self, n_sources):
+        self.bd.calculate_distances()
@@ -0,0 +1,94 @@
+"""Benchmarks of the prior, kinematic distance and table helpers."""
+import os
+import shutil
+import tempfile
+
+from BD_wrapper.BD_wrapper import BayesianDistance
+from BD_wrapper.kinematic_distance import KinematicDistance
+
+from .catalogs import SIZES, make_catalog, make_results
+
+
+def get_bd(path_to_output_table=None):
+    bd = BayesianDistance()
+    bd.verbose = False
+    bd.colname_lon, bd.colname_lat, bd.colname_vel = 'GLON', 'GLAT', 'VLSR'
+    bd.path_to_output_table = path_to_output_table
+    return bd
+
+
+class TimeKinematicDistance:
+    params = SIZES
+    param_names = ['n_sources']
+    timeout = 600
+
+    def setup(self, n_sources):
+        self.catalog = make_catalog(n_sources)
+        self.kd = KinematicDistance()
+        self.kd.initialize()
+
+    def time_calc_kinematic_distance(self, n_sources):
+        for lon, lat, vel in zip(self.catalog['GLON'], self.catalog['GLAT'],
+                                 self.catalog['VLSR']):
+            self.kd.calc_kinematic_distance(lon, lat, vel)
+
+
+class TimeCheckKDA:
+    #  check_KDA compares each source with all entries of the KDA info
+    #  tables, so the largest catalog is left out to keep the run time of the
+    #  suite reasonable
+    params = SIZES[:3]
+    param_names = ['n_sources']
+    timeout = 1800
+
+    def setup(self, n_sources):
+        self.catalog = make_catalog(n_sources)
+        #  all KDA info tables
+        self.bd = get_bd()
+        self.bd.initialize_kda_tables()
+
+    def time_check_KDA(self, n_sources):
+        for lon, lat, vel in zip(self.catalog['GLON'], self.catalog['GLAT'],
+                                 self.catalog['VLSR']):
+            self.bd.check_KDA(lon, lat, vel)
+
+
+class TimeCheckKDABatch:
+    params = SIZES
+    param_names = ['n_sources']
+    timeout = 600
+
+    def setup(self, n_sources):
+        self.catalog = make_catalog(n_sources)
+        self.bd = get_bd()
+        self.bd.initialize_kda_tables()
+
+    def time_check_KDA_batch(self, n_sources):
+        self.bd.check_KDA_batch(self.catalog['GLON'], self.catalog['GLAT'],
+                                self.catalog['VLSR'])
+
+
+class TimeTables:
+    params = SIZES
+    param_names = ['n_sources']
+    #  the table is modified by `get_table_distance_max_probability`, so each
+    #  sample is a single call on a fresh table
+    number = 1
+    timeout = 600
+
+    def setup(self, n_sources):
+        self.dirname = tempfile.mkdtemp()
+        self.bd = get_bd(os.path.join(self.dirname, 'results.dat'))
+        self.bd.initialize_table()
+        self.bd.input_table = make_catalog(n_sources)
+        self.results = make_results(self.bd.input_table)
+        self.bd.table_results = self.bd.get_results_table(self.results)
+
+    def teardown(self, n_sources):
+        shutil.rmtree(self.dirname, ignore_errors=True)
+
+    def time_create_astropy_table(self, n_sources):
+        self.bd.create_astropy_table(self.results)
+
+    def time_get_table_distance_max_probability(self, n_sources):
+        self.bd.get_table_distance_max_probability(save=False)
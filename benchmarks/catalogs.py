@@ -0,0 +1,70 @@
+"""Synthetic catalogs for the benchmarks."""
+import numpy as np
+
+from astropy.table import Table
+
+#  number of sources of the synthetic catalogs
+SIZES = [100, 1000, 10000, 100000]
+
+#  parameters of the flat rotation curve used to assign velocities
+R_0 = 8.15
+THETA_0 = 236.
+
+
+def make_catalog(n_sources, seed=177):
+    """Catalog of sources spread over the Galactic plane.
+
+    The sources are distributed uniformly in Galactic longitude and in
+    heliocentric distance (0.5 to 15 kpc) with a Gaussian latitude
+    distribution (sigma = 0.5 deg). Their velocities follow from a flat
+    rotation curve plus a random velocity dispersion of 5 km/s, so the lbv
+    values are realistic inputs for the BDC.
+
+    Returns
+    -------
+    astropy.table.Table
+        Table with the columns 'GLON', 'GLAT' and 'VLSR' and an index column
+        'ID'.
+
+    """
+    rng = np.random.default_rng(seed)
+    glon = rng.uniform(0., 360., n_sources)
+    glat = np.clip(rng.normal(0., 0.5, n_sources), -2., 2.)
+    dist = rng.uniform(0.5, 15., n_sources)
+
+    lon, lat = np.radians(glon), np.radians(glat)
+    rgal = np.sqrt(R_0**2 + (dist * np.cos(lat))**2 -
+                   2 * R_0 * dist * np.cos(lat) * np.cos(lon))
+    vlsr = THETA_0 * np.sin(lon) * (R_0 / rgal - 1) * np.cos(lat)
+    vlsr += rng.normal(0., 5., n_sources)
+
+    return Table([np.arange(n_sources), np.round(glon, 4),
+                  np.round(glat, 4), np.round(vlsr, 2)],
+                 names=['ID', 'GLON', 'GLAT', 'VLSR'])
+
+
+def make_results(catalog, seed=177):
+    """Result rows as returned by the BDC for a catalog.
+
+    Each source gets two distance solutions whose probabilities add up to
+    one, in the format of the result rows of `calculate_distances` (input
+    row, component, distance, error, probability, spiral arm, Cartesian
+    coordinates, p_far, KDA reference and kinematic distances).
+    """
+    rng = np.random.default_rng(seed)
+    n_sources = len(catalog)
+    dist = np.sort(rng.uniform(0.5, 15., (n_sources, 2)), axis=1)
+    e_dist = rng.uniform(0.1, 1., (n_sources, 2))
+    prob = rng.uniform(0., 1., n_sources)
+    prob = np.stack([prob, 1 - prob], axis=1)
+    arms = np.array(['...', 'Sgr', 'ScN', 'Loc', 'Per', 'Out'])[
+        rng.integers(0, 6, (n_sources, 2))]
+
+    results = []
+    for i, row in enumerate(catalog):
+        for k in range(2):
+            results.append(list(row) + [
+                2, '{:.2f}'.format(dist[i, k]), '{:.2f}'.format(e_dist[i, k]),
+                '{:.2f}'.format(prob[i, k]), arms[i, k], 0., 0., 0.,
+                '0.5', '--', dist[i, 0], dist[i, 1]])
+    return np.array(results)
@@ -1,8 +1,36 @@
+import asyncio
+import cProfile
 import os
+import pstats
+import pickle
+import shutil
+import signal
+import tempfile
+import threading
+import time
 import unittest
 import numpy as np
 from astropy.table import Table
 import BD_wrapper.BD_wrapper as bdw
+from BD_wrapper import BD_multiprocessing
+from BD_wrapper.bdc_async import AsyncBDC
+from BD_wrapper.bdc_build import build_hash, get_bdc_executable
+from BD_wrapper.bdc_cache import BDCResultCache
+from BD_wrapper.bdc_checkpoint import Checkpoint
+from BD_wrapper.bdc_extension import strip_main_program
+from BD_wrapper.bdc_grid import BDCGrid, grid_axis
+from BD_wrapper.bdc_kda import KDAInfoIndex
+from BD_wrapper.bdc_numpy import invert_matrix, running_sum
+from BD_wrapper.bdc_pdfs import (PDFArchive, create_pdf_archive,
+                                 create_pdf_cube, open_pdf_cube)
+from BD_wrapper.bdc_queue import MAX_ATTEMPTS, WorkQueue
+from BD_wrapper.bdc_report import (TRACE_COLUMNS, RunReport, TraceWriter,
+                                   write_profile)
+from BD_wrapper.bdc_scratch import create_scratch_dir
+from BD_wrapper.bdc_stream import (TableWriter, get_reader_format,
+                                   iter_table_chunks)
+from BD_wrapper.KDA_tables import (KDA_INFO_KEYS, kda_info_table_ini,
+                                   load_kda_info_store)
 
 
 class TestBayesianDistance(unittest.TestCase):
@@ -63,6 +91,577 @@ class TestBayesianDistance(unittest.TestCase):
             self.assertEqual(bdc.table_results['dist'][i], value)
             self.assertEqual(bdc.table_results['flag'][i], flag)
 
+    def test_get_bdc_executable(self):
+        path_to_fortran = os.path.join(
+            self.dirname, 'BDC', 'v2.4',
+            'Bayesian_distance_2019_fromlist_v2.4.f')
+        self.assertNotEqual(
+            build_hash(path_to_fortran, flags=['-O0']),
+            build_hash(path_to_fortran, flags=['-O2']))
+
+        with tempfile.TemporaryDirectory() as path_to_cache:
+            path_to_executable = get_bdc_executable(
+                path_to_fortran, flags=['-O0'], path_to_cache=path_to_cache)
+            self.assertTrue(os.access(path_to_executable, os.X_OK))
+            mtime = os.path.getmtime(path_to_executable)
+            self.assertEqual(path_to_executable, get_bdc_executable(
+                path_to_fortran, flags=['-O0'], path_to_cache=path_to_cache))
+            self.assertEqual(mtime, os.path.getmtime(path_to_executable))
+
+    @unittest.skipUnless(shutil.which('gfortran'), 'gfortran not available')
+    def test_engine_parity(self):
+        input_table = Table.read(os.path.join(
+            self.dirname, 'data', 'RD+09_table1_sel.dat'), format='ascii')[:3]
+        results = {}
+        for engine, settings in [('executable', {'bdc_extension': False}),
+                                 ('extension', {}),
+                                 ('numpy', {'bdc_numpy': True})]:
+            with tempfile.TemporaryDirectory() as dirname:
+                bdc = bdw.BayesianDistance()
+                bdc.input_table = input_table.copy()
+                bdc.path_to_output_table = os.path.join(
+                    dirname, 'distances.dat')
+                bdc.colname_lon, bdc.colname_lat, bdc.colname_vel =\
+                    'GLON', 'GLAT', 'Vlsr'
+                bdc.colname_name = 'GRSMC'
+                bdc.use_ncpus = 1
+                bdc.verbose = False
+                for key, value in settings.items():
+                    setattr(bdc, key, value)
+                bdc.calculate_distances()
+                self.assertEqual(bdc.get_engine(), engine)
+                with open(bdc.path_to_output_table) as fin:
+                    results[engine] = fin.read()
+        self.assertEqual(len(results['executable'].splitlines()), 7)
+        for engine in results:
+            self.assertEqual(results[engine], results['executable'])
+
+    def test_strip_main_program(self):
+        source = ('      program bdc\n      call sub ( 1 )\n      end\n\n'
+                  '      subroutine sub ( i )\n      return\n      end\n')
+        self.assertEqual(
+            strip_main_program(source),
+            '\n      subroutine sub ( i )\n      return\n      end\n')
+
+    def test_create_scratch_dir(self):
+        path_to_bdc = os.path.join(self.dirname, 'BDC', 'v2.4')
+        with tempfile.TemporaryDirectory() as path_to_scratch:
+            dirname = create_scratch_dir(
+                path_to_bdc, '0.5 0.5\n', path_to_scratch=path_to_scratch)
+            self.assertTrue(os.path.islink(
+                os.path.join(dirname, 'galaxy_data_Univ.inp')))
+            self.assertTrue(os.path.islink(
+                os.path.join(dirname, 'Per_lbvRBD.2019')))
+            self.assertFalse(os.path.exists(
+                os.path.join(dirname, 'sources_info.inp')))
+            with open(os.path.join(
+                    dirname, 'probability_controls.inp'), 'r') as fin:
+                self.assertEqual(fin.read(), '0.5 0.5\n')
+
+    def test_pdf_cube(self):
+        with tempfile.TemporaryDirectory() as dirname:
+            path_to_pdfs = os.path.join(dirname, 'pdfs.npy')
+            create_pdf_cube(path_to_pdfs, 3, 6)
+            cube = open_pdf_cube(path_to_pdfs, mode='r+')
+            cube[[2, 0]] = np.ones((2, 6, 1001))
+            del cube
+
+            cube = open_pdf_cube(path_to_pdfs)
+            self.assertEqual(cube.shape, (3, 6, 1001))
+            self.assertTrue(np.all(cube[[0, 2]] == 1))
+            self.assertTrue(np.all(np.isnan(cube[1])))
+            del cube
+
+    def test_pdf_archive(self):
+        pdfs = np.random.RandomState(1).uniform(size=(2, 2, 1001))
+        pdfs[1, 1] = np.nan
+        with tempfile.TemporaryDirectory() as dirname:
+            create_pdf_archive(dirname, 3, ['arm', 'final_distance'])
+            archive = PDFArchive(dirname, mode='a')
+            archive.write([2, 0], pdfs)
+            archive.close()
+
+            archive = PDFArchive(dirname)
+            self.assertEqual(len(archive), 3)
+            self.assertTrue(np.allclose(archive[2], pdfs[0], atol=1e-4))
+            self.assertTrue(np.allclose(archive[0][0], pdfs[1, 0], atol=1e-4))
+            self.assertTrue(np.all(np.isnan(archive[0][1])))
+            self.assertTrue(np.all(np.isnan(archive[1])))
+            archive.close()
+
+    def test_results_cache(self):
+        with tempfile.TemporaryDirectory() as dirname:
+            cache = BDCResultCache(os.path.join(dirname, 'cache.sqlite'))
+            cache.put({'a': [[2, '1.00']], 'b': []}, '2.4', 'model1')
+            cache.put({'c': [[2, '3.00']]}, '2.4', 'model2')
+            self.assertEqual(cache.get(['a', 'x']), {'a': [[2, '1.00']]})
+
+            self.assertEqual(cache.invalidate('2.4', 'model2'), 2)
+            self.assertEqual(len(cache), 1)
+            cache.put({'d': [[2, '4.00']]}, '2.4', 'model2')
+            cache.get(['c'])
+            self.assertEqual(cache.evict(len(pickle.dumps([[2, '3.00']]))), 1)
+            self.assertEqual(list(cache.get(['c', 'd'])), ['c'])
+            cache.close()
+
+    def test_bdc_grid(self):
+        axes = [grid_axis([10.03, 10.17], 0.1), np.array([0., 0.1]),
+                np.array([10., 11.])]
+        self.assertTrue(np.allclose(axes[0], [10., 10.1, 10.2]))
+        shape = (3, 2, 2)
+        dist = np.zeros(shape + (2, ))
+        dist[..., 0] = 2. + axes[0][:, None, None]
+        values = {'found': np.ones(shape, dtype='bool'),
+                  'p_far': np.full(shape, 0.5), 'n_kd': np.full(shape, 2),
+                  'kin_dist': dist, 'dist': dist, 'e_dist': 0.1 * dist,
+                  'prob': np.full(shape + (2, ), 0.5),
+                  'arm': np.full(shape + (2, ), '...', dtype='object')}
+        values['arm'][2, ..., 0] = 'Sgr'
+        meta = {'version': '2.4', 'model': 'model1', 'p_far': 0.5,
+                'e_vel': 5.0, 'p_max': [0.85, 0.85, 0.85, 0.15, 0.85]}
+
+        with tempfile.TemporaryDirectory() as dirname:
+            BDCGrid(axes, values, meta).save(os.path.join(dirname, 'grid.npz'))
+            grid = BDCGrid.load(os.path.join(dirname, 'grid.npz'))
+        self.assertTrue(grid.matches(meta))
+        self.assertFalse(grid.matches({'p_far': 0.7}))
+
+        output = grid.lookup([10.05, 10.15, 10.5], [0.05] * 3, [10.5] * 3)
+        self.assertEqual(list(output['valid']), [True, False, False])
+        self.assertAlmostEqual(output['dist'][0, 0], 12.05)
+        self.assertAlmostEqual(output['e_interp'][0], 0.05)
+
+        #  only sources with the p_far and e_vel values of the grid
+        self.bdc._bdc_grid = grid
+        sources = [{'lon': 10.05, 'lat': 0.05, 'vel': 10.5, 'p_far': 0.5,
+                    'plusminus': plusminus} for plusminus in ['', '3.0\t']]
+        self.assertEqual(self.bdc.lookup_bdc_grid(sources), {})
+
+    def test_bdc_grid_positions(self):
+        self.bdc.colnr_lon, self.bdc.colnr_lat, self.bdc.colnr_vel = 0, 1, 2
+        self.bdc._model_hash = 'model1'
+        table = Table([[10., 20., 30.], [0., 0.1, 0.2], [5., 6., 7.]],
+                      names=['lon', 'lat', 'vel'])
+        positions = self.bdc.get_bdc_grid_positions(
+            table, [(0.5, None), (0.75, 'ref'), (0.5, None)])
+        self.assertEqual([list(x) for x in positions],
+                         [[10., 30.], [0., 0.2], [5., 7.]])
+
+        self.bdc._use_bdc_numpy = True
+        with tempfile.TemporaryDirectory() as dirname:
+            self.bdc.path_to_bdc_grid = os.path.join(dirname, 'grid.npz')
+            with self.assertWarns(UserWarning):
+                self.bdc.initialize_bdc_grid([[], [], []])
+            self.assertIsNone(self.bdc._bdc_grid)
+            self.assertEqual(self.bdc.lookup_bdc_grid([{'p_far': 0.5}]), {})
+            self.bdc.bdc_grid_max_nodes = 10
+            with self.assertRaisesRegex(Exception, 'bdc_grid_max_nodes'):
+                self.bdc.initialize_bdc_grid(positions)
+
+    def test_get_cache_key(self):
+        src = {'lon': 30.014, 'lat': -0.051, 'vel': 95.3, 'plusminus': '',
+               'p_far': 0.5, 'kda_ref': None}
+        self.bdc.version = '1.0'
+        key = self.bdc.get_cache_key(src)
+        self.assertEqual(key, self.bdc.get_cache_key(dict(src)))
+        self.bdc.version = '2.4'
+        src['plusminus'] = '5.0\t'
+        self.assertNotEqual(self.bdc.get_cache_key(src), key)
+        self.assertEqual(self.bdc.get_cache_key(src),
+                         self.bdc.get_cache_key(dict(src, plusminus='5\t')))
+        self.assertEqual(self.bdc.get_cache_key(src), self.bdc.get_cache_key(
+            dict(src, lon=np.float64(30.014), p_far=np.float32(0.5))))
+
+        key = self.bdc.get_cache_key(src)
+        self.bdc.path_to_executable = os.path.join('cache', 'bdc-1', 'bdc.out')
+        self.assertEqual(self.bdc.get_bdc_build(), 'bdc-1')
+        self.assertNotEqual(self.bdc.get_cache_key(src), key)
+        for key, value in [('bdc_daemon', True), ('_use_bdc_numpy', True),
+                           ('bdc_output_level', 2)]:
+            keys = [self.bdc.get_cache_key(src)]
+            setattr(self.bdc, key, value)
+            self.assertNotIn(self.bdc.get_cache_key(src), keys)
+
+    def test_get_dedup_key(self):
+        self.bdc.colnr_lon, self.bdc.colnr_lat, self.bdc.colnr_vel = 0, 1, 2
+        row = [30.014, -0.051, 95.3]
+        prior = (0.5, None)
+        self.assertEqual(self.bdc.get_dedup_key(row, prior=prior),
+                         (30.014, -0.051, 95.3, 5.0, 0.5, None, None))
+        self.bdc.dedup_tolerance = [0.01, 0.01, 0.5, 0.]
+        key = self.bdc.get_dedup_key(row, prior=prior)
+        self.assertEqual(key, (3001, -5, 191, 5.0, 0.5, None, None))
+        self.assertEqual(
+            self.bdc.get_dedup_key([30.007, -0.051, 95.4], prior=prior), key)
+        self.assertNotEqual(
+            self.bdc.get_dedup_key(row, prior=(0.7, 'ref')), key)
+
+        self.bdc.version = '1.0'
+        self.bdc.dedup_tolerance = [0.01, 0.01, 0.5, 0.5]
+        self.assertEqual(self.bdc.get_dedup_key(row, prior=prior),
+                         (3001, -5, 191, None, 0.5, None, None))
+
+        self.bdc.prior_velocity_dispersion = True
+        self.bdc.colnr_vel_disp = 3
+        self.assertEqual(
+            self.bdc.get_dedup_key(row + [1.5], prior=prior)[-1], 1.5)
+        self.assertIsNone(
+            self.bdc.get_dedup_key(row + [1.5], prior=(0.7, 'ref'))[-1])
+
+    def test_checkpoint(self):
+        with tempfile.TemporaryDirectory() as dirname:
+            checkpoint = Checkpoint(os.path.join(dirname, 'checkpoint.pickle'))
+            checkpoint.open({'n_sources': 3})
+            checkpoint.append([0, 1], [[['a']], []])
+            checkpoint.close()
+            with open(checkpoint.path_to_checkpoint, 'ab') as fout:
+                fout.write(b'\x80\x04incomplete')
+
+            checkpoint.open({'n_sources': 3}, resume=True)
+            checkpoint.append([2], [[['c']]])
+            checkpoint.close()
+            meta, results, _ = checkpoint.read()
+            self.assertEqual(meta, {'n_sources': 3})
+            self.assertEqual(results, {0: [['a']], 1: [], 2: [['c']]})
+
+            #  last record cut off by a few bytes, or with its last bytes
+            #  zeroed as after a crash of the file system
+            checkpoint.open({'n_sources': 3}, resume=True)
+            checkpoint.append([3], [[['\u00e9']]])
+            checkpoint.close()
+            with open(checkpoint.path_to_checkpoint, 'rb') as fin:
+                content = fin.read()
+            for n_bytes in range(1, 10):
+                for tail in [b'', n_bytes * b'\x00']:
+                    with open(checkpoint.path_to_checkpoint, 'wb') as fout:
+                        fout.write(content[:-n_bytes] + tail)
+                    self.assertEqual(checkpoint.read()[1],
+                                     {0: [['a']], 1: [], 2: [['c']]})
+            checkpoint.open({'n_sources': 3}, resume=True)
+            checkpoint.append([3], [[['d']]])
+            checkpoint.close()
+            self.assertEqual(checkpoint.read()[1],
+                             {0: [['a']], 1: [], 2: [['c']], 3: [['d']]})
+
+            checkpoint.open({'n_sources': 2})
+            self.assertEqual(checkpoint.read()[1], {})
+            checkpoint.remove()
+            self.assertFalse(checkpoint.exists())
+
+    def test_table_chunks(self):
+        table = Table([np.arange(25), np.arange(25) * 0.5,
+                       ['src{}'.format(i) for i in range(25)]],
+                      names=['a', 'b', 'name'])
+        with tempfile.TemporaryDirectory() as dirname:
+            path = os.path.join(dirname, 'table.dat')
+            table.write(path, format='ascii')
+            chunks = list(iter_table_chunks(path, 'ascii', 10, read_size=64))
+            self.assertEqual([offset for offset, _ in chunks], [0, 10, 20])
+            self.assertEqual([len(chunk) for _, chunk in chunks], [10, 10, 5])
+            self.assertEqual(list(chunks[1][1]['name']),
+                             list(table['name'][10:20]))
+
+            writer = TableWriter(os.path.join(dirname, 'out.dat'), 'ascii')
+            for _, chunk in iter_table_chunks(table, 'ascii', 10):
+                writer.write(chunk)
+            writer.close()
+            with open(path) as fin, open(os.path.join(dirname, 'out.dat')) as f:
+                self.assertEqual(fin.read(), f.read())
+
+        for table_format, reader_format in [
+                ('ascii', 'basic'), ('csv', 'csv'), ('ascii.tab', 'tab'),
+                ('ascii.fast_rdb', 'rdb'), ('ascii.latex', None),
+                ('ascii.html', None), ('fits', None)]:
+            self.assertEqual(get_reader_format(table_format), reader_format)
+        with self.assertRaises(Exception):
+            next(iter_table_chunks('table.tex', 'ascii.latex', 10))
+
+    def test_worker_config(self):
+        self.bdc.input_table = self.kda_table_test
+        self.bdc._kda_tables = [self.kda_table_test]
+        self.bdc._scratch_dir, self.bdc._scratch_dir_pid = '/tmp/bdc', 1
+        config = pickle.loads(pickle.dumps(self.bdc.get_worker_config()))
+        self.assertNotIn('input_table', config)
+        self.assertNotIn('_scratch_dir', config)
+
+        handler = signal.getsignal(signal.SIGINT)
+        BD_multiprocessing.init_worker(config)
+        signal.signal(signal.SIGINT, handler)
+        worker = BD_multiprocessing.bd_object
+        self.assertIsNone(worker.input_table)
+        self.assertIsNone(worker._scratch_dir)
+        self.assertEqual(len(worker._kda_tables[0]),
+                         len(self.kda_table_test))
+
+    def test_thread_backend(self):
+        self.bdc.backend = 'threads'
+        self.bdc._kda_tables = [self.kda_table_test]
+        executor, copies = BD_multiprocessing.get_executor(self.bdc, 2)
+        with executor:
+            workers = executor.map(
+                lambda k: BD_multiprocessing.get_bd_object(), range(4))
+        for worker in workers:
+            self.assertIn(worker, copies)
+            self.assertIsNot(worker, self.bdc)
+            self.assertIs(worker._kda_tables, self.bdc._kda_tables)
+
+    def test_work_queue(self):
+        with tempfile.TemporaryDirectory() as dirname:
+            queue = WorkQueue(os.path.join(dirname, 'queue.sqlite'))
+            self.assertIsNone(queue.get_meta())
+            queue.create({'n_sources': 3}, {'lease': 10.},
+                         [([['a'], ['b']], [0, 1]), ([['c']], [2])])
+            self.assertEqual(queue.get_settings(), {'lease': 10.})
+
+            task_id, payload = queue.lease('w1', 10.)
+            self.assertEqual((task_id, payload[1]), (0, [0, 1]))
+            #  the leases of the second task expire immediately
+            self.assertEqual(queue.lease('w2', -1.)[0], 1)
+            self.assertEqual(queue.lease('w3', -1.)[0], 1)
+            self.assertFalse(queue.renew(1, 'w2', 10.))
+
+            queue.complete(0, 'w1', ['r0', 'r1'])
+            self.assertEqual(queue.get_result(0), ['r0', 'r1'])
+            self.assertIsNone(queue.get_result(1))
+            self.assertFalse(queue.finished())
+
+            for attempt in range(MAX_ATTEMPTS - 2):
+                queue.lease('w5', -1.)
+            self.assertIsNone(queue.lease('w6', 10.))
+            self.assertEqual(queue.give_up(lambda payload: ['failed']), 1)
+            self.assertEqual(queue.get_result(1), ['failed'])
+            self.assertTrue(queue.finished())
+            queue.remove()
+
+    def test_work_queue_settings(self):
+        for key in ['path_to_pdfs', 'path_to_pdf_archive']:
+            bdc = bdw.BayesianDistance()
+            bdc.path_to_work_queue = 'queue.sqlite'
+            setattr(bdc, key, 'pdfs')
+            with self.assertRaisesRegex(Exception, 'path_to_work_queue'):
+                bdc.initialize_bdc()
+
+    def test_queue_worker_restarts(self):
+        run_queue_worker = BD_multiprocessing.run_queue_worker
+        poll_interval = BD_multiprocessing.POLL_INTERVAL
+        #  workers that fail before leasing a range
+        BD_multiprocessing.run_queue_worker = lambda path: os._exit(3)
+        BD_multiprocessing.POLL_INTERVAL = 0.01
+        self.bdc.input_table = Table([[1., 2.]], names=['a'])
+        self.bdc.start_method = 'fork'
+        with tempfile.TemporaryDirectory() as dirname:
+            self.bdc.path_to_work_queue = os.path.join(dirname, 'queue.sqlite')
+            try:
+                with self.assertRaisesRegex(Exception, 'exited with code 3'):
+                    list(BD_multiprocessing.determine_distances_queue(
+                        self.bdc, self.bdc.input_table, [0, 1], use_ncpus=1))
+            finally:
+                BD_multiprocessing.run_queue_worker = run_queue_worker
+                BD_multiprocessing.POLL_INTERVAL = poll_interval
+
+    def test_queue_worker_waits_for_queue(self):
+        handler = signal.getsignal(signal.SIGINT)
+        poll_interval = BD_multiprocessing.POLL_INTERVAL
+        BD_multiprocessing.POLL_INTERVAL = 0.01
+        with tempfile.TemporaryDirectory() as dirname:
+            path_to_queue = os.path.join(dirname, 'queue.sqlite')
+
+            def create_queue():
+                time.sleep(0.1)
+                queue = WorkQueue(path_to_queue)
+                queue.create({'n_sources': 0}, {
+                    'config': self.bdc.get_worker_config(), 'lease': 10.}, [])
+                queue.close()
+
+            thread = threading.Thread(target=create_queue)
+            thread.start()
+            try:
+                BD_multiprocessing.run_queue_worker(path_to_queue, 'w1')
+            finally:
+                thread.join()
+                BD_multiprocessing.POLL_INTERVAL = poll_interval
+                signal.signal(signal.SIGINT, handler)
+            queue = WorkQueue(path_to_queue)
+            self.assertTrue(queue.finished())
+            queue.close()
+
+    def test_async_bdc(self):
+        with tempfile.TemporaryDirectory() as dirname:
+            path_to_executable = os.path.join(dirname, 'bdc.sh')
+            with open(path_to_executable, 'w') as fout:
+                fout.write('#!/bin/sh\ncp "$1" "$1.$2.out"\n')
+            os.chmod(path_to_executable, 0o755)
+            bdc = AsyncBDC(path_to_executable, max_processes=2, output_level=1)
+
+            async def run_all():
+                return await asyncio.gather(*[
+                    bdc.run(dirname, 'SRC{}'.format(i), 'source {}'.format(i))
+                    for i in range(4)])
+
+            self.assertEqual(asyncio.run(run_all()), [0, 0, 0, 0])
+            with open(os.path.join(
+                    dirname, 'SRC3_sources_info.inp.1.out')) as fin:
+                self.assertEqual(fin.read(), 'source 3')
+
+    def test_run_report(self):
+        report = RunReport()
+        with report.stage('parse'):
+            with report.stage('cartesian'):
+                time.sleep(0.05)
+            with report.stage('cartesian'):
+                time.sleep(0.05)
+        report.count('fallback_reruns', 2)
+        report.record_worker(scratch_size=2 * 1024**2)
+        self.assertEqual(report.stages['cartesian']['calls'], 2)
+        #  the time of the nested stages is not counted for the outer stage
+        self.assertGreaterEqual(report.stages['cartesian']['wall'], 0.1)
+        self.assertLess(report.stages['parse']['wall'], 0.05)
+
+        merged = RunReport()
+        merged.merge(pickle.loads(pickle.dumps(report)))
+        merged.merge(report)
+        merged.merge(None)
+        result = merged.to_dict()
+        self.assertEqual(list(result['stages']), ['parse', 'cartesian'])
+        self.assertEqual(result['stages']['parse']['calls'], 2)
+        self.assertEqual(result['counters'], {
+            'sources': 0, 'bdc_runs': 0, 'fallback_reruns': 4})
+        worker, = result['workers'].values()
+        self.assertEqual(worker['scratch_peak'], 2.)
+
+    def test_profile_and_trace(self):
+        profiler = cProfile.Profile()
+        profiler.enable()
+        running_sum(np.arange(10.))
+        profiler.disable()
+        report = RunReport()
+        report.add_profile(profiler)
+        report.trace.append((0, 30., 0., 50., 0.5, 'flat', '--', 0, 'bdc',
+                             0.01, 0.1, 0.01))
+        merged = RunReport()
+        merged.merge(pickle.loads(pickle.dumps(report)))
+        merged.merge(report)
+        self.assertEqual(len(merged.trace), 2)
+
+        with tempfile.TemporaryDirectory() as dirname:
+            path_to_profile = os.path.join(dirname, 'run.prof')
+            write_profile(merged.profile, path_to_profile)
+            stats = pstats.Stats(path_to_profile)
+            calls = [stat[1] for func, stat in stats.stats.items()
+                     if func[2] == 'running_sum']
+            self.assertEqual(calls, [2])
+
+            path_to_trace = os.path.join(dirname, 'trace.csv')
+            writer = TraceWriter(path_to_trace)
+            writer.write(merged.trace)
+            writer.close()
+            table = Table.read(path_to_trace, format='ascii.csv')
+            self.assertEqual(table.colnames, list(TRACE_COLUMNS))
+            self.assertEqual(len(table), 2)
+
+    def test_kda_info_store(self):
+        with tempfile.TemporaryDirectory() as dirname:
+            path_to_kda_info = os.path.join(dirname, 'KDA_info')
+            os.makedirs(path_to_kda_info)
+            self.kda_table_test.write(os.path.join(
+                path_to_kda_info, 'test.dat'), format='ascii')
+            path_to_ini = os.path.join(path_to_kda_info, 'test.ini')
+            with open(path_to_ini, 'w') as fout:
+                fout.write(kda_info_table_ini('test', weight_cat=0.5))
+
+            store = load_kda_info_store(path_to_kda_info, dirname)
+            columns, parameters = store['test']
+            self.assertEqual(parameters['reference'], 'test')
+            self.assertEqual(parameters['weight_cat'], 0.5)
+            for key in KDA_INFO_KEYS:
+                self.assertTrue(np.array_equal(
+                    columns[key], self.kda_table_test[key]))
+            self.assertEqual(len(os.listdir(dirname)), 2)
+
+            #  loaded from the store
+            columns, parameters = load_kda_info_store(
+                path_to_kda_info, dirname)['test']
+            self.assertEqual(parameters['weight_cat'], 0.5)
+
+            #  rebuilt after a change of the init file
+            with open(path_to_ini, 'w') as fout:
+                fout.write(kda_info_table_ini('test', weight_cat=0.25))
+            os.utime(path_to_ini, ns=(0, 0))
+            columns, parameters = load_kda_info_store(
+                path_to_kda_info, dirname)['test']
+            self.assertEqual(parameters['weight_cat'], 0.25)
+
+    def test_kda_info_index(self):
+        rng = np.random.default_rng(177)
+        n_rows = 500
+        pa = rng.uniform(0, np.pi, n_rows)
+        columns = {
+            'GLON': rng.uniform(29, 31, n_rows),
+            'GLAT': rng.uniform(-1, 1, n_rows),
+            'VLSR': rng.uniform(0, 100, n_rows),
+            'd_VLSR': rng.uniform(1, 10, n_rows),
+            'p_far': rng.choice([-0.5, 0.5], n_rows),
+            'cos_pa': np.cos(pa), 'sin_pa': np.sin(pa),
+            'aa': rng.uniform(0, 0.1, n_rows)**2,
+            'bb': rng.uniform(0, 0.1, n_rows)**2}
+        sources = list(zip(rng.uniform(28.9, 31.1, 1000),
+                           rng.uniform(-1.1, 1.1, 1000),
+                           rng.uniform(0, 100, 1000)))
+        for size, threshold_spatial in [('fwhm', 0.5), ('std', 0.125),
+                                        ('fwhm', 0)]:
+            parameters = {
+                'reference': 'test', 'weight_cat': 1,
+                'threshold_spatial': threshold_spatial,
+                'threshold_spectral': 0.125, 'size': size,
+                'linewidth': 'fwhm'}
+            self.bdc._kda_tables = [Table(columns)]
+            self.bdc._kda_parameters = [parameters]
+            kda_info_index = KDAInfoIndex(columns, parameters)
+            for lon, lat, vel in sources:
+                self.bdc._kda_info_indices = []
+                result = self.bdc.check_KDA(lon, lat, vel)
+                self.bdc._kda_info_indices = [kda_info_index]
+                self.assertEqual(self.bdc.check_KDA(lon, lat, vel), result)
+
+    def test_kda_prior_batch(self):
+        rng = np.random.default_rng(177)
+        n_rows = 200
+        pa = rng.uniform(0, np.pi, n_rows)
+        table = Table({
+            'GLON': rng.uniform(29, 31, n_rows),
+            'GLAT': rng.uniform(-1, 1, n_rows),
+            'VLSR': rng.uniform(0, 100, n_rows),
+            'd_VLSR': rng.uniform(1, 10, n_rows),
+            'p_far': rng.choice([-0.5, 0.5], n_rows),
+            'cos_pa': np.cos(pa), 'sin_pa': np.sin(pa),
+            'aa': rng.uniform(0, 0.2, n_rows)**2,
+            'bb': rng.uniform(0, 0.2, n_rows)**2})
+        #  the first two tables are identical, so their weights are tied
+        self.bdc._kda_tables = [table, table, table[::2]]
+        self.bdc._kda_parameters = [
+            {'reference': reference, 'weight_cat': weight_cat,
+             'threshold_spatial': 0.5, 'threshold_spectral': 0.125,
+             'size': 'fwhm', 'linewidth': 'fwhm'}
+            for reference, weight_cat in [('a', 1), ('b', 1), ('c', 0.5)]]
+        lon, lat, vel = (rng.uniform(28.9, 31.1, 1000),
+                         rng.uniform(-1.1, 1.1, 1000),
+                         rng.uniform(0, 100, 1000))
+        priors = [self.bdc.check_KDA(*source)
+                  for source in zip(lon, lat, vel)]
+        self.assertIn('c', [kda_ref for p_far, kda_ref in priors])
+        self.assertEqual(self.bdc.check_KDA_batch(lon, lat, vel), priors)
+
+    def test_invert_matrix(self):
+        for a in [np.array([[4., 1., 2.], [1., 3., 0.], [2., 0., 5.]]),
+                  np.array([[0., 2., 0.], [1., 0., 0.], [0., 0., 2.]])]:
+            self.assertTrue(np.allclose(np.dot(a, invert_matrix(a)),
+                                        np.eye(3)))
+
+    def test_running_sum(self):
+        values = np.array([[1e16, 1., -1e16, 1.], [1., 2., 3., 4.]])
+        self.assertEqual(list(running_sum(values, axis=1)), [1., 10.])
+        self.assertEqual(list(running_sum(values.T, axis=0)), [1., 10.])
+
     # def test_init(self):
     #     Aperture(8, 8, 4, data=self.test_data)
     #     # Non-integer indizes: